@@ -0,0 +1,44 @@
+import argparse
+import json
+import os
+from bench.suite import run, compare, parse_size
+
+def main(argv: list[str] | None = None) -> int:
+    args = argparse.ArgumentParser(prog="python -m bench", description="Time every PyCom phase on synthetic inputs")
+    args.add_argument("-g", "--grammars", default="example,stack", help="comma separated: example, stack")
+    args.add_argument("-s", "--sizes", default="1K,10K,100K", help="comma separated input sizes such as 1K or 100M")
+    args.add_argument("-r", "--repeat", type=int, default=3, help="timed runs per size, the fastest is kept")
+    args.add_argument("-o", "--out", default="build/bench.json")
+    args.add_argument("--compare", help="an earlier JSON report to compare against")
+    args.add_argument("--no-packrat", action="store_true", help="parse without memoization, as Parser.parse does by default")
+    args.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    args.add_argument("--rules", action="store_true", help="also time each transformer rule and C emitter at the largest size")
+    options = args.parse_args(argv)
+    report = run(
+        options.grammars.split(","),
+        [parse_size(size) for size in options.sizes.split(",")],
+        options.repeat,
+        not options.no_packrat,
+        not options.no_memory,
+        options.rules,
+        print,
+    )
+    for grammar, phases in report["scaling"].items():
+        for phase, exponents in phases.items():
+            print(f"scaling {grammar:<8} {phase:<10} {' '.join(f'{e:.2f}' for e in exponents)}")
+    for grammar, phases in report.get("rules", {}).items():
+        for phase, times in phases.items():
+            for name, seconds in list(times.items())[:5]:
+                print(f"rule    {grammar:<8} {phase:<10} {name:<24} {seconds:.4f}s")
+    if options.compare:
+        with open(options.compare) as f:
+            for line in compare(json.load(f), report):
+                print(line)
+    os.makedirs(os.path.dirname(options.out) or ".", exist_ok=True)
+    with open(options.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {options.out}")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
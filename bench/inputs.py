@@ -0,0 +1,36 @@
+def stack_source(size: int) -> str:
+    # every line leaves the stack empty, so inputs of any size are valid
+    lines: list[str] = []
+    total = 0
+    i = 0
+    while total < size:
+        match i % 3:
+            case 0:
+                line = f"{i % 1000} {i % 7 + 1} * {i % 13} + . + print\n"
+            case 1:
+                line = f"{i % 500 + 100} {i % 9 + 1} / {i % 4} - print\n"
+            case _:
+                line = f"{i % 97} . * {i % 5 + 1} % print\n"
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return "".join(lines)
+
+def example_source(size: int) -> str:
+    # a chain of functions, each calling the one before it
+    lines = ["fn g0(x) = x + 1;\n"]
+    total = len(lines[0])
+    i = 1
+    while total < size:
+        match i % 3:
+            case 0:
+                line = f"fn g{i}(x) = g{i-1}(x) * 2 - -x;\n"
+            case 1:
+                line = f"fn g{i}(x) = g{i-1}(x) + !x;\n"
+            case _:
+                line = f"fn g{i}(x) = -g{i-1}(x * 3);\n"
+        lines.append(line)
+        total += len(line)
+        i += 1
+    lines.append(f"print(g{i-1}(3))\n")
+    return "".join(lines)
@@ -0,0 +1,191 @@
+import math
+import platform
+import subprocess
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Callable
+from bench.inputs import stack_source, example_source
+from src.lex import Lexer
+from src.parse import Parser, Tree
+from src.profiler import Profiler
+from src.transform import Transformer
+from src import codegen
+
+PHASES = ("lex", "parse", "transform", "generate_c")
+
+class Grammar:
+    def __init__(self, name: str, lexer: Lexer, parser: Parser, transformer: Transformer, transform: Callable[[Tree], Tree], source: Callable[[int], str]):
+        self.name = name
+        self.lexer = lexer
+        self.parser = parser
+        self.transformer = transformer
+        self.transform = transform
+        self.source = source
+
+def grammars() -> dict[str, Grammar]:
+    import example.example as example
+    import example.stack_based as stack_based
+    def transform_stack(tree: Tree) -> Tree:
+        stack_based.stack_top = 0
+        stack_based.initialized_env = {}
+        return stack_based.transformer.start(tree)
+    return {
+        "example": Grammar("example", example.lexer, example.start_parser, example.transformer, lambda tree: example.transformer.transform(tree, start=True), example_source),
+        "stack": Grammar("stack", stack_based.lexer, stack_based.expr_parser, stack_based.transformer, transform_stack, stack_source),
+    }
+
+def parse_size(text: str) -> int:
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    text = text.strip().upper().removesuffix("B")
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def format_size(size: int) -> str:
+    for unit, scale in (("G", 1 << 30), ("M", 1 << 20), ("K", 1 << 10)):
+        if size >= scale and size % scale == 0:
+            return f"{size // scale}{unit}"
+    return str(size)
+
+def count_nodes(tree: Tree | str) -> int:
+    count = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Tree):
+            count += 1
+            stack.extend(node.nodes)
+    return count
+
+def run_phases(grammar: Grammar, text: str, packrat: bool, memory: bool) -> dict[str, tuple[float, int, int]]:
+    # seconds, items processed and peak traced bytes for every phase, each
+    # phase consuming the previous one's output
+    results: dict[str, tuple[float, int, int]] = {}
+    def phase(name: str, fn: Callable[[], Any], items: Callable[[Any], int]) -> Any:
+        if memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        value = fn()
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] - base if memory else 0
+        results[name] = (seconds, items(value), peak)
+        return value
+    tokens = phase("lex", lambda: grammar.lexer.lex("<bench>", text), len)
+    tree = phase("parse", lambda: grammar.parser.parse(tokens, packrat), count_nodes)
+    c_tree = phase("transform", lambda: grammar.transform(tree), count_nodes)
+    phase("generate_c", lambda: codegen.generate_c(c_tree, {}), len)
+    return results
+
+UNITS = {"lex": "tokens", "parse": "nodes", "transform": "nodes", "generate_c": "bytes"}
+
+def measure(grammar: Grammar, size: int, repeat: int = 3, packrat: bool = True, memory: bool = True) -> list[dict[str, Any]]:
+    text = grammar.source(size)
+    best: dict[str, tuple[float, int, int]] = {}
+    for _ in range(repeat):
+        for name, result in run_phases(grammar, text, packrat, False).items():
+            if name not in best or result[0] < best[name][0]:
+                best[name] = result
+    peaks = {name: 0 for name in PHASES}
+    if memory:
+        # tracing slows everything down, so it gets a run of its own
+        tracemalloc.start()
+        try:
+            peaks = {name: result[2] for name, result in run_phases(grammar, text, packrat, True).items()}
+        finally:
+            tracemalloc.stop()
+    results = []
+    for name in PHASES:
+        seconds, items, _ = best[name]
+        results.append({
+            "grammar": grammar.name,
+            "size": size,
+            "bytes": len(text),
+            "phase": name,
+            "seconds": seconds,
+            "items": items,
+            "unit": UNITS[name],
+            "rate": items / seconds if seconds else math.inf,
+            "peak_bytes": peaks[name],
+        })
+    return results
+
+def scaling(results: list[dict[str, Any]]) -> dict[str, dict[str, list[float]]]:
+    # the exponent k in seconds ~ bytes ** k between consecutive sizes: 1
+    # is linear, and anything well above it is worth a look
+    curves: dict[str, dict[str, list[float]]] = defaultdict(dict)
+    runs: dict[tuple[str, str], list[tuple[int, float]]] = defaultdict(list)
+    for result in results:
+        runs[result["grammar"], result["phase"]].append((result["bytes"], result["seconds"]))
+    for (grammar, phase), points in runs.items():
+        points.sort()
+        exponents = []
+        for (n1, t1), (n2, t2) in zip(points, points[1:]):
+            if n2 > n1 and t1 > 0 and t2 > 0:
+                exponents.append(round(math.log(t2 / t1) / math.log(n2 / n1), 3))
+        curves[grammar][phase] = exponents
+    return dict(curves)
+
+def rule_times(grammar: Grammar, size: int, packrat: bool = True) -> dict[str, dict[str, float]]:
+    # exclusive seconds spent in each transformer rule and C emitter, from
+    # the profiler over one run
+    text = grammar.source(size)
+    tree = grammar.parser.parse(grammar.lexer.lex("<bench>", text), packrat)
+    with Profiler() as profiler:
+        codegen.generate_c(grammar.transform(tree), {})
+    times: dict[str, dict[str, float]] = {"transform": {}, "generate_c": {}}
+    for phase, name, stats in profiler.rows():
+        times[phase][name] = stats.self_time
+    return times
+
+def commit() -> str | None:
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+def run(names: list[str], sizes: list[int], repeat: int = 3, packrat: bool = True, memory: bool = True, rules: bool = False, progress: Callable[[str], None] = lambda line: None) -> dict[str, Any]:
+    available = grammars()
+    results: list[dict[str, Any]] = []
+    report: dict[str, Any] = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "packrat": packrat,
+        "results": results,
+    }
+    for name in names:
+        if name not in available:
+            assert False, f"Not implemented: grammar '{name}'"
+        for size in sizes:
+            for result in measure(available[name], size, repeat, packrat, memory):
+                results.append(result)
+                progress(format_result(result))
+    report["scaling"] = scaling(results)
+    if rules:
+        report["rules"] = {name: rule_times(available[name], max(sizes), packrat) for name in names}
+    return report
+
+def format_result(result: dict[str, Any]) -> str:
+    return (
+        f"{result['grammar']:<8} {format_size(result['size']):>5} {result['phase']:<10} "
+        f"{result['seconds']:>9.4f}s {result['rate']:>12,.0f} {result['unit']}/s "
+        f"{result['peak_bytes'] / (1 << 20):>9.2f} MiB"
+    )
+
+def compare(old: dict[str, Any], new: dict[str, Any]) -> list[str]:
+    # time ratios new/old for every run present in both reports
+    before = {(r["grammar"], r["size"], r["phase"]): r for r in old["results"]}
+    lines = []
+    for result in new["results"]:
+        key = (result["grammar"], result["size"], result["phase"])
+        if key not in before or not before[key]["seconds"]:
+            continue
+        ratio = result["seconds"] / before[key]["seconds"]
+        memory = ""
+        if before[key]["peak_bytes"] and result["peak_bytes"]:
+            memory = f" memory x{result['peak_bytes'] / before[key]['peak_bytes']:.2f}"
+        lines.append(f"{key[0]:<8} {format_size(key[1]):>5} {key[2]:<10} time x{ratio:.2f}{memory}")
+    return lines
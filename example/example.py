@@ -1,7 +1,7 @@
 from src.lex import Lexer
 from src.parse import Parser, alt, seq, many, Tree, C
 from src.transform import Transformer
-from src.codegen import generate_c
+from src.codegen import write_c
 
 # Lexing
 
@@ -192,4 +192,4 @@ if __name__ == "__main__":
     tree = start_parser.parse(tokens)
     tree = transformer.transform(tree, start=True)
     with open("build/out.c", "w") as f:
-      f.write(generate_c(tree))
+      write_c(tree, f)
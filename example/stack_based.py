@@ -1,7 +1,9 @@
 from src.lex import Lexer
 from src.parse import Parser, alt, some, Tree, C
 from src.transform import Transformer
-from src.codegen import generate_c
+from src.codegen import write_c
+from src.optimize import optimize
+from src import stack
 from typing import Literal
 
 lexer = Lexer()
@@ -81,26 +83,52 @@ def transform_expr(*atoms: Tree):
     atoms_list = [transformer.transform(a) for a in atoms]
     return C.Block(*atoms_list)
 
-@transformer.new_rule("#Start")
-def transform(tree: Tree):
-    tree = transformer.transform(tree)
+def program(body: Tree) -> Tree:
     return C.Program(
         C.Include("stdio.h"),
         C.FunctionDeclaration(
             C.IntType(),
             C.Identifier("main"),
             C.ParameterList(),
-            tree,
+            body,
         ),
     )
 
-def compile(file: str, text: str, out_path: str = "build/out.c"):
+@transformer.new_rule("#Start")
+def transform(tree: Tree):
+    return program(transformer.transform(tree))
+
+print_op = stack.apply("print", lambda value: C.Call(
+    C.Identifier("printf"),
+    C.StringLiteral(r"%d\n"),
+    value,
+), 1, pushes=0, effect=True)
+
+def stack_ops(tree: Tree) -> list[stack.Op]:
+    ops = []
+    for atom in tree.nodes:
+        match atom.type:
+            case "INT":
+                ops.append(stack.push(C.IntLiteral(atom.nodes[0])))
+            case "print":
+                ops.append(print_op)
+            case ".":
+                ops.append(stack.dup())
+            case _:
+                ops.append(stack.binary(atom.nodes[0]))
+    return ops
+
+def compile(file: str, text: str, out_path: str = "build/out.c", passes: tuple[str, ...] = (), lowered: bool = False):
     global stack_top, initialized_env
     stack_top = 0
     initialized_env = {}
     tokens = lexer.lex(file, text)
     tree = expr_parser.parse(tokens)
-    c_tree = transformer.start(tree)
-    c_code = generate_c(c_tree)
+    if lowered:
+        c_tree = program(C.Block(*stack.lower(stack_ops(tree))))
+    else:
+        c_tree = transformer.start(tree)
+    if passes:
+        c_tree = optimize(c_tree, passes)
     with open(out_path, "w") as f:
-        f.write(c_code)
+        write_c(c_tree, f)
@@ -0,0 +1,97 @@
+from array import array
+from typing import Any
+from src.lex import Location, NO_LOCATION
+from src.parse import Tree, TYPES
+
+class Arena:
+    # columnar storage for whole trees: one row per node in a few flat
+    # arrays, with children stored as contiguous runs of references
+    # (index >= 0 is a node, -1 - i is self.values[i])
+    def __init__(self) -> None:
+        self.kinds = array("H")
+        self.rests = array("q")
+        self.files: list[str] = []
+        self.file_ids: dict[str, int] = {}
+        self.location_files = array("H")
+        self.lines = array("i")
+        self.columns = array("i")
+        self.starts = array("q")
+        self.counts = array("I")
+        self.children = array("q")
+        self.values: list[Any] = []
+        self.value_ids: dict[str, int] = {}
+    def __len__(self) -> int:
+        return len(self.kinds)
+    def value(self, value: Any) -> int:
+        if isinstance(value, str):
+            i = self.value_ids.get(value)
+            if i is None:
+                i = self.value_ids[value] = len(self.values)
+                self.values.append(value)
+            return -1 - i
+        self.values.append(value)
+        return -len(self.values)
+    def file(self, file: str) -> int:
+        i = self.file_ids.get(file)
+        if i is None:
+            i = self.file_ids[file] = len(self.files)
+            self.files.append(file)
+        return i
+    def add(self, tree: Tree) -> int:
+        # post-order, so a node's children always get their rows first;
+        # subtrees shared within the tree are stored once
+        rows: dict[int, int] = {}
+        stack: list[tuple[Tree, bool]] = [(tree, False)]
+        while stack:
+            node, ready = stack.pop()
+            if id(node) in rows:
+                continue
+            if not ready:
+                stack.append((node, True))
+                for child in reversed(node.nodes):
+                    if isinstance(child, Tree) and id(child) not in rows:
+                        stack.append((child, False))
+                continue
+            refs = [rows[id(c)] if isinstance(c, Tree) else self.value(c) for c in node.nodes]
+            rows[id(node)] = len(self.kinds)
+            self.kinds.append(node.kind)
+            self.rests.append(node.rest)
+            location = node.location
+            self.location_files.append(self.file(location.file))
+            self.lines.append(location.line)
+            self.columns.append(location.column)
+            self.starts.append(len(self.children))
+            self.counts.append(len(refs))
+            self.children.extend(refs)
+        return rows[id(tree)]
+    def type(self, row: int) -> str:
+        return TYPES[self.kinds[row]]
+    def location(self, row: int) -> Location:
+        if self.lines[row] == -1 and self.files[self.location_files[row]] == "?":
+            return NO_LOCATION
+        return Location(self.files[self.location_files[row]], self.lines[row], self.columns[row])
+    def child_rows(self, row: int) -> array[int]:
+        start = self.starts[row]
+        return self.children[start:start + self.counts[row]]
+    def tree(self, row: int) -> Tree:
+        trees: dict[int, Tree] = {}
+        stack: list[tuple[int, bool]] = [(row, False)]
+        while stack:
+            r, ready = stack.pop()
+            if r in trees:
+                continue
+            refs = self.child_rows(r)
+            if not ready:
+                stack.append((r, True))
+                stack.extend((c, False) for c in reversed(refs) if c >= 0 and c not in trees)
+                continue
+            nodes = [trees[c] if c >= 0 else self.values[-1 - c] for c in refs]
+            tree = Tree(TYPES[self.kinds[r]], nodes, self.location(r), self.rests[r])
+            trees[r] = tree
+        return trees[row]
+    def nbytes(self) -> int:
+        columns = [
+            self.kinds, self.rests, self.location_files, self.lines,
+            self.columns, self.starts, self.counts, self.children,
+        ]
+        return sum(c.itemsize * len(c) for c in columns)
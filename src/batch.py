@@ -0,0 +1,101 @@
+import argparse
+import contextlib
+import glob
+import importlib
+import io
+import os
+from types import ModuleType
+from src.codegen import write_c, Scope, can_fork, start_pool
+
+grammar: ModuleType | None = None
+parser_name = "start_parser"
+
+def load_grammar(name: str, parser: str) -> None:
+    # runs once per worker, so every file a worker compiles reuses the same
+    # lexer, parser and transformer objects
+    global grammar, parser_name
+    grammar = importlib.import_module(name)
+    parser_name = parser
+    if getattr(grammar, "compile", None) is None:
+        getattr(grammar, parser)
+
+def compile_file(file: str, out_path: str) -> str | None:
+    assert grammar is not None, "No grammar loaded"
+    output = io.StringIO()
+    try:
+        with open(file) as f:
+            text = f.read()
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        with contextlib.redirect_stdout(output):
+            compile = getattr(grammar, "compile", None)
+            if compile is not None:
+                compile(file, text, out_path)
+            else:
+                tokens = grammar.lexer.lex(file, text)
+                tree = getattr(grammar, parser_name).parse(tokens)
+                c_tree = grammar.transformer.transform(tree, start=True)
+                # a fresh scope, so a file's output doesn't depend on what
+                # its worker compiled before
+                with open(out_path, "w") as f:
+                    write_c(c_tree, f, Scope({}, 0))
+    except SystemExit:
+        # lexer and parser errors are printed before exiting
+        return output.getvalue().strip() or "exited"
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+def run_file(job: tuple[str, str]) -> tuple[str, str | None]:
+    return job[0], compile_file(*job)
+
+def expand(patterns: list[str]) -> list[str]:
+    files: dict[str, None] = {}
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        files.update(dict.fromkeys(matches))
+    return list(files)
+
+def output_path(file: str, base: str, out_dir: str) -> str:
+    # the extension is kept, so a.stk and a.src don't both become a.c
+    return os.path.join(out_dir, os.path.relpath(file, base) + ".c")
+
+def compile_all(name: str, files: list[str], out_dir: str = "build/batch", workers: int | None = None, parser: str = "start_parser") -> dict[str, str | None]:
+    base = os.path.commonpath([os.path.dirname(os.path.abspath(file)) for file in files]) if files else "."
+    jobs = [(file, output_path(os.path.abspath(file), base, out_dir)) for file in files]
+    workers = min(workers if workers is not None else os.cpu_count() or 1, len(jobs))
+    # loaded here first, so a grammar that fails to load fails once instead
+    # of in every worker the pool starts again after it dies
+    load_grammar(name, parser)
+    if workers <= 1:
+        return dict(map(run_file, jobs))
+    with start_pool(workers, can_fork(), load_grammar, (name, parser)) as pool:
+        results = dict(pool.imap_unordered(run_file, jobs, max(1, len(jobs) // (workers * 4))))
+        pool.close()
+        pool.join()
+    return {file: results[file] for file in files}
+
+def main(argv: list[str] | None = None) -> int:
+    args = argparse.ArgumentParser(prog="python -m src.batch", description="Compile many source files with one grammar module")
+    args.add_argument("grammar", help="module defining compile(file, text, out_path), or lexer, transformer and a parser")
+    args.add_argument("files", nargs="+", help="source files or glob patterns")
+    args.add_argument("-o", "--out-dir", default="build/batch")
+    args.add_argument("-j", "--jobs", type=int, default=None, help="worker processes, defaults to the number of cores")
+    args.add_argument("--parser", default="start_parser", help="parser attribute used without compile()")
+    options = args.parse_args(argv)
+    files = expand(options.files)
+    try:
+        load_grammar(options.grammar, options.parser)
+    except Exception as e:
+        print(f"Cannot load grammar '{options.grammar}': {type(e).__name__}: {e}")
+        return 1
+    results = compile_all(options.grammar, files, options.out_dir, options.jobs, options.parser)
+    failed = [(file, error) for file, error in results.items() if error is not None]
+    for file, error in failed:
+        print(f"FAILED {file}:")
+        for line in error.splitlines():
+            print(f"    {line}")
+    print(f"{len(results) - len(failed)} compiled, {len(failed)} failed")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import shutil
+import subprocess
+from typing import Sequence
+
+class BuildError:
+    def __init__(self, command: list[str], output: str):
+        self.command = command
+        self.output = output
+    def format(self):
+        return f"BUILD ERROR: {' '.join(self.command)}\n{self.output}"
+
+class BuildCache:
+    # binaries are stored under the hash of the compiler, its flags and the
+    # C source, so an unchanged program is never compiled twice. Each hit
+    # touches the binary, and the least recently used ones are removed once
+    # the cache grows past max_bytes
+    def __init__(self, cache_dir: str = "build/binaries", max_bytes: int = 64 << 20, compiler: str = "gcc"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.compiler = compiler
+        self.hits = 0
+        self.misses = 0
+    def key(self, code: str, flags: Sequence[str]) -> str:
+        digest = hashlib.sha256()
+        path = shutil.which(self.compiler) or self.compiler
+        # a reinstalled compiler changes the size or mtime of its driver
+        if os.path.exists(path):
+            stat = os.stat(path)
+            path = f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+        for part in (path, *flags):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        digest.update(code.encode())
+        return digest.hexdigest()
+    def raw_build(self, code: str, out: str, flags: Sequence[str] = ()) -> str | BuildError:
+        cached = os.path.join(self.cache_dir, self.key(code, flags))
+        if os.path.exists(cached):
+            self.hits += 1
+            os.utime(cached)
+        else:
+            self.misses += 1
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{cached}.{os.getpid()}.tmp"
+            source = f"{tmp}.c"
+            with open(source, "w") as f:
+                f.write(code)
+            command = [self.compiler, "-o", tmp, source, *flags]
+            try:
+                result = subprocess.run(command, capture_output=True, text=True)
+            finally:
+                os.remove(source)
+            if result.returncode != 0:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                return BuildError(command, result.stderr)
+            os.replace(tmp, cached)
+            self.evict(keep=cached)
+        if os.path.dirname(out):
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+        tmp = f"{out}.{os.getpid()}.tmp"
+        shutil.copy2(cached, tmp)
+        os.replace(tmp, out)
+        return out
+    def build(self, code: str, out: str, flags: Sequence[str] = ()) -> str:
+        result = self.raw_build(code, out, flags)
+        if isinstance(result, BuildError):
+            print(result.format())
+            exit(1)
+        return result
+    def entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith((".tmp", ".c")):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+    def evict(self, keep: str | None = None) -> None:
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+cache = BuildCache()
+
+def build(code: str, out: str, flags: Sequence[str] = ()) -> str:
+    return cache.build(code, out, flags)
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+from typing import Any
+from src.parse import Tree
+
+MISSING = object()
+
+class LRU:
+    def __init__(self, size: int) -> None:
+        assert size > 0, "LRU size must be positive"
+        self.size = size
+        self.entries: OrderedDict[Any, Any] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    def __len__(self) -> int:
+        return len(self.entries)
+    def get(self, key: Any, default: Any = MISSING) -> Any:
+        value = self.entries.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+    def put(self, key: Any, value: Any) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+class HashCons:
+    # maps every subtree to one canonical tree with the same type and
+    # children; trees compare by identity, so a key holds the canonical
+    # children themselves and leaves by value. Locations and rests are not
+    # part of the key: a canonical tree keeps the first ones it was seen with
+    def __init__(self, size: int = 1 << 16) -> None:
+        self.trees = LRU(size)
+    def make(self, tree: Tree) -> Tree:
+        try:
+            key = (tree.kind, *tree.nodes)
+            canonical = self.trees.get(key)
+        except TypeError:
+            return tree
+        if canonical is MISSING:
+            self.trees.put(key, tree)
+            return tree
+        return canonical
+    def cons(self, tree: Tree) -> Tree:
+        done: dict[int, Tree] = {}
+        stack: list[tuple[Tree, bool]] = [(tree, False)]
+        while stack:
+            node, ready = stack.pop()
+            if id(node) in done:
+                continue
+            if not ready:
+                stack.append((node, True))
+                stack.extend((c, False) for c in node.nodes if isinstance(c, Tree) and id(c) not in done)
+                continue
+            nodes = [done[id(c)] if isinstance(c, Tree) else c for c in node.nodes]
+            canonical = node
+            if any(a is not b for a, b in zip(nodes, node.nodes)):
+                canonical = Tree(node.type, nodes, node.location, node.rest)
+            done[id(node)] = self.make(canonical)
+        return done[id(tree)]
@@ -1,4 +1,11 @@
-from src.parse import Tree
+import multiprocessing
+import multiprocessing.pool
+import os
+import threading
+import warnings
+from src.parse import Tree, intern_type
+from src.cache import LRU, MISSING
+from typing import IO, Callable
 
 var_counter = 0
 def new_var():
@@ -7,114 +14,402 @@ def new_var():
     var_counter += 1
     return var
 
-def get_indents_c(code: str) -> list[int]:
-    lines = code.splitlines()
-    indent = 0
-    indent_guides: list[int] = []
-    for line in lines:
-        if line.count("}"):
-            indent -= line.count("}")
-        indent_guides.append(indent)
-        if line.count("{"):
-            indent += line.count("{")
-    return indent_guides
-
-def generate_c(tree: Tree, env: dict[str, str] = {}) -> str:
-    if tree.type == "C_IntLiteral":
-        return str(tree.nodes[0])
-    if tree.type == "C_CharLiteral":
-        return f"'{tree.nodes[0]}'"
-    if tree.type == "C_StringLiteral":
-      return f"\"{tree.nodes[0]}\""
-    if tree.type == "C_Identifier":
-        return str(tree.nodes[0])
-    if tree.type == "C_Variable":
-        if env.get(tree.nodes[0]):
-            return env[tree.nodes[0]]
-        else:
-            env[tree.nodes[0]] = new_var()
-            return env[tree.nodes[0]]
-    if tree.type == "C_ArgumentList":
-        args = [generate_c(a) for a in tree.nodes]
-        return ", ".join(args)
-    if tree.type == "C_BinaryOperator":
-        left, op, right = tree.nodes
-        left = generate_c(left)
-        right = generate_c(right)
-        return f"({left} {op} {right})"
-    if tree.type == "C_UnaryOperator":
-      op, right = tree.nodes
-      right = generate_c(right)
-      return f"({op}{right})"
-    if tree.type == "C_Call":
-        name = generate_c(tree.nodes[0])
-        nodes = ", ".join([generate_c(node) for node in tree.nodes[1:]])
-        return f"{name}({nodes})"
-    if tree.type == "C_Statement":
-        expr = generate_c(tree.nodes[0])
-        return f"{expr};\n"
-    if tree.type == "C_Return":
-        value = generate_c(tree.nodes[0])
-        return f"return {value};\n"
-    if tree.type == "C_While":
-      cond, body = tree.nodes
-      return f"while ({cond}) {body}"
-    if tree.type == "C_If":
-      cond, body = tree.nodes
-      return f"if ({cond}) {body}"
-    if tree.type == "C_IfElse":
-      cond, body, elbody = tree.nodes
-      return f"if ({cond}) {body} else {elbody}"
-    if tree.type == "C_StatementList":
-      statements = [generate_c(s) for s in tree.nodes]
-      return "\n".join(statements) + "\n"
-    if tree.type == "C_Block":
-        code = "{\n"
-        for node in tree.nodes:
-            code += generate_c(node)
-        return code + "}\n"
-    if tree.type == "C_Type":
-        return str(tree.nodes[0])
-    if tree.type == "C_Parameter":
-      type, name = tree.nodes
-      return f"{type} {name}"
-    if tree.type == "C_ParameterList":
-      return f", ".join([generate_c(p) for p in tree.nodes])
-    if tree.type == "C_VariableDeclaration":
-      type, name, value = tree.nodes
-      type = generate_c(type)
-      name = generate_c(name)
-      value = generate_c(value)
-      return f"{type} {name} = {value};\n"
-    if tree.type == "C_Assignment":
-      name, value = tree.nodes
-      name = generate_c(name)
-      value = generate_c(value)
-      return f"{name} = {value};\n"
-    if tree.type == "C_FunctionDeclaration":
-        ret, name, params, body = tree.nodes
-        ret = generate_c(ret)
-        name = generate_c(name)
-        params = [f"{generate_c(p.nodes[0])} {generate_c(p.nodes[1])}" for p in params.nodes]
-        body = generate_c(body)
-        code = f"{ret} {name}("
-        for i, param in enumerate(params):
-            if i > 0:
-                code += ", "
-            code += param
-        code += ") "
-        code += body
-        return code
-    if tree.type == "C_Include":
-        file = tree.nodes[0]
-        return f"#include <{file}>\n"
-    if tree.type == "C_DeclarationList":
-      return "\n".join([generate_c(d) for d in tree.nodes])
-    if tree.type == "C_Program":
-        decls = "\n".join([generate_c(d) for d in tree.nodes])
-        indents = get_indents_c(decls)
-        formatted = ""
-        for indent, line in zip(indents, decls.splitlines()):
-            formatted += indent * "    " + line.lstrip() + "\n"
-        return formatted
+class Scope(dict[str, str]):
+    # a naming scope over some shared names, with its own counter so its
+    # names don't depend on what was generated before it
+    def __init__(self, names: dict[str, str], counter: int):
+        super().__init__()
+        self.names = names
+        self.counter = counter
+    def get(self, name: str, default: str | None = None) -> str | None:
+        return dict.get(self, name) or self.names.get(name, default)
+    def new_var(self):
+        var = f"v{self.counter}"
+        self.counter += 1
+        return var
+
+class Writer:
+    def __init__(self, out: IO[str] | list[str]):
+        self.out: Callable[[str], object] = out.append if isinstance(out, list) else out.write
+        self.parts: list[str] = []
+        self.write = self.parts.append
+        # emitters end lines with newline, call line where a line may start
+        # and indent and dedent around the body of a block; lines are only
+        # indented while formatting
+        self.formatting = False
+        self.depth = 0
+        self.start = True
+    def indent(self) -> None:
+        self.depth += 1
+    def dedent(self) -> None:
+        self.depth -= 1
+    def newline(self) -> None:
+        self.parts.append("\n")
+        self.start = True
+    def line(self) -> None:
+        if self.start:
+            self.start = False
+            if self.formatting and self.depth:
+                self.parts.append("    " * self.depth)
+    def code(self, code: str) -> None:
+        # code generated by a Writer at depth 0, indented to this one's
+        if self.formatting and self.depth:
+            pad = "    " * self.depth
+            lines = code.split("\n")
+            code = "\n".join(pad + line if line and (i or self.start) else line for i, line in enumerate(lines))
+        self.write(code)
+        if "\n" in code:
+            self.start = code.endswith("\n")
+    def mark(self) -> None:
+        if self.parts:
+            self.out("".join(self.parts))
+            self.parts.clear()
+    def close(self) -> None:
+        self.mark()
+
+type Emitter = Callable[[Tree, Writer, dict[str, str]], None]
+
+# variable names shared by every generate_c call that doesn't pass its own
+ENV: dict[str, str] = {}
+
+# generated code by tree identity, see set_cache; variables make the code
+# depend on ENV, so only calls using it are cached. A tree's code is only
+# kept once the tree is seen a second time, that is when hash consing
+# shared it, since the code of every subtree of a deep tree that is used
+# once adds up to far more than the output
+memo: LRU | None = None
+seen: LRU | None = None
+
+def set_cache(size: int) -> None:
+    global memo, seen
+    memo = LRU(size) if size else None
+    seen = LRU(size) if size else None
+
+emitters: dict[int, Emitter] = {}
+
+def emitter(type: str):
+    def wrapper(fn: Emitter):
+        emitters[intern_type(type)] = fn
+        return fn
+    return wrapper
+
+def emit(tree: Tree, w: Writer, env: dict[str, str]) -> None:
+    if memo is None or env is not ENV:
+        emitters.get(tree.kind, missing)(tree, w, env)
+        return
+    if seen.get(tree) is MISSING:
+        seen.put(tree, True)
+        emitters.get(tree.kind, missing)(tree, w, env)
+        return
+    key = (tree, w.formatting)
+    code = memo.get(key)
+    if code is MISSING:
+        parts: list[str] = []
+        sub = Writer(parts)
+        sub.formatting = w.formatting
+        emitters.get(tree.kind, missing)(tree, sub, env)
+        sub.close()
+        code = "".join(parts)
+        memo.put(key, code)
+    w.code(code)
+
+def missing(tree: Tree, w: Writer, env: dict[str, str]) -> None:
     assert False, f"Not implemented: '{tree.type}'"
+
+def emit_joined(trees: list[Tree], sep: str, w: Writer, env: dict[str, str]) -> None:
+    for i, tree in enumerate(trees):
+        if i > 0:
+            w.write(sep)
+        emit(tree, w, env)
+
+def emit_lines(trees: list[Tree], w: Writer, env: dict[str, str]) -> None:
+    for i, tree in enumerate(trees):
+        if i > 0:
+            w.newline()
+        emit(tree, w, env)
+
+def write_c(tree: Tree, out: IO[str] | list[str], env: dict[str, str] = ENV) -> None:
+    w = Writer(out)
+    emit(tree, w, env)
+    w.close()
+
+def generate_c(tree: Tree, env: dict[str, str] = ENV) -> str:
+    parts: list[str] = []
+    write_c(tree, parts, env)
+    return "".join(parts)
+
+@emitter("C_IntLiteral")
+@emitter("C_Identifier")
+@emitter("C_Type")
+def emit_value(tree: Tree, w: Writer, env: dict[str, str]):
+    w.write(str(tree.nodes[0]))
+
+@emitter("C_CharLiteral")
+def emit_char(tree: Tree, w: Writer, env: dict[str, str]):
+    w.write(f"'{tree.nodes[0]}'")
+
+@emitter("C_StringLiteral")
+def emit_string(tree: Tree, w: Writer, env: dict[str, str]):
+    w.write(f"\"{tree.nodes[0]}\"")
+
+@emitter("C_Variable")
+def emit_variable(tree: Tree, w: Writer, env: dict[str, str]):
+    name = tree.nodes[0]
+    var = env.get(name)
+    if not var:
+        var = env[name] = env.new_var() if isinstance(env, Scope) else new_var()
+    w.write(var)
+
+@emitter("C_ArgumentList")
+@emitter("C_ParameterList")
+def emit_list(tree: Tree, w: Writer, env: dict[str, str]):
+    emit_joined(tree.nodes, ", ", w, env)
+
+@emitter("C_BinaryOperator")
+def emit_binary(tree: Tree, w: Writer, env: dict[str, str]):
+    left, op, right = tree.nodes
+    w.write("(")
+    emit(left, w, env)
+    w.write(f" {op} ")
+    emit(right, w, env)
+    w.write(")")
+
+@emitter("C_UnaryOperator")
+def emit_unary(tree: Tree, w: Writer, env: dict[str, str]):
+    op, right = tree.nodes
+    w.write(f"({op}")
+    emit(right, w, env)
+    w.write(")")
+
+@emitter("C_Call")
+def emit_call(tree: Tree, w: Writer, env: dict[str, str]):
+    emit(tree.nodes[0], w, env)
+    w.write("(")
+    emit_joined(tree.nodes[1:], ", ", w, env)
+    w.write(")")
+
+@emitter("C_Statement")
+def emit_statement(tree: Tree, w: Writer, env: dict[str, str]):
+    w.line()
+    emit(tree.nodes[0], w, env)
+    w.write(";")
+    w.newline()
+    w.mark()
+
+@emitter("C_Return")
+def emit_return(tree: Tree, w: Writer, env: dict[str, str]):
+    w.line()
+    w.write("return ")
+    emit(tree.nodes[0], w, env)
+    w.write(";")
+    w.newline()
+    w.mark()
+
+@emitter("C_While")
+def emit_while(tree: Tree, w: Writer, env: dict[str, str]):
+    cond, body = tree.nodes
+    w.line()
+    w.write("while (")
+    emit(cond, w, env)
+    w.write(") ")
+    emit(body, w, env)
+
+@emitter("C_If")
+@emitter("C_IfElse")
+def emit_if(tree: Tree, w: Writer, env: dict[str, str]):
+    cond, body, *elbody = tree.nodes
+    w.line()
+    w.write("if (")
+    emit(cond, w, env)
+    w.write(") ")
+    emit(body, w, env)
+    if elbody:
+        w.line()
+        w.write("else ")
+        emit(elbody[0], w, env)
+
+@emitter("C_StatementList")
+def emit_statements(tree: Tree, w: Writer, env: dict[str, str]):
+    emit_lines(tree.nodes, w, env)
+    w.newline()
+
+@emitter("C_Block")
+def emit_block(tree: Tree, w: Writer, env: dict[str, str]):
+    w.line()
+    w.write("{")
+    w.newline()
+    w.indent()
+    for node in tree.nodes:
+        emit(node, w, env)
+    w.dedent()
+    w.line()
+    w.write("}")
+    w.newline()
+    w.mark()
+
+@emitter("C_Parameter")
+def emit_parameter(tree: Tree, w: Writer, env: dict[str, str]):
+    type, name = tree.nodes
+    emit(type, w, env)
+    w.write(" ")
+    emit(name, w, env)
+
+@emitter("C_VariableDeclaration")
+def emit_declaration(tree: Tree, w: Writer, env: dict[str, str]):
+    type, name, value = tree.nodes
+    w.line()
+    emit(type, w, env)
+    w.write(" ")
+    emit(name, w, env)
+    w.write(" = ")
+    emit(value, w, env)
+    w.write(";")
+    w.newline()
+    w.mark()
+
+@emitter("C_Assignment")
+def emit_assignment(tree: Tree, w: Writer, env: dict[str, str]):
+    name, value = tree.nodes
+    w.line()
+    emit(name, w, env)
+    w.write(" = ")
+    emit(value, w, env)
+    w.write(";")
+    w.newline()
+    w.mark()
+
+@emitter("C_FunctionDeclaration")
+def emit_function(tree: Tree, w: Writer, env: dict[str, str]):
+    ret, name, params, body = tree.nodes
+    w.line()
+    emit(ret, w, env)
+    w.write(" ")
+    emit(name, w, env)
+    w.write("(")
+    for i, param in enumerate(params.nodes):
+        if i > 0:
+            w.write(", ")
+        emit(param.nodes[0], w, env)
+        w.write(" ")
+        emit(param.nodes[1], w, env)
+    w.write(") ")
+    emit(body, w, env)
+
+@emitter("C_Include")
+def emit_include(tree: Tree, w: Writer, env: dict[str, str]):
+    w.line()
+    w.write(f"#include <{tree.nodes[0]}>")
+    w.newline()
+    w.mark()
+
+@emitter("C_DeclarationList")
+def emit_declarations(tree: Tree, w: Writer, env: dict[str, str]):
+    emit_lines(tree.nodes, w, env)
+
+@emitter("C_Program")
+def emit_program(tree: Tree, w: Writer, env: dict[str, str]):
+    if w.formatting:
+        emit_lines(tree.nodes, w, env)
+        return
+    w.formatting = True
+    emit_lines(tree.nodes, w, env)
+    w.formatting = False
+
+# Parallel generation: the top-level declarations of a program are generated
+# independently, each in its own Scope, and joined in order
+
+def units(tree: Tree, items: list[Tree | None]) -> None:
+    # flattens nested programs and declaration lists; None is a separator
+    for i, node in enumerate(tree.nodes):
+        if i > 0:
+            items.append(None)
+        if node.type in ("C_Program", "C_DeclarationList"):
+            units(node, items)
+        else:
+            items.append(node)
+
+def global_names(items: list[Tree | None]) -> dict[str, str]:
+    # functions and top-level variables, which every unit must agree on
+    names: dict[str, str] = {}
+    for item in items:
+        if item is not None and item.type in ("C_FunctionDeclaration", "C_VariableDeclaration"):
+            name = item.nodes[1]
+            if name.type == "C_Variable" and name.nodes[0] not in names:
+                names[name.nodes[0]] = f"v{len(names)}"
+    return names
+
+def generate_unit(unit: Tree, names: dict[str, str], separator: bool, formatting: bool) -> str:
+    # every unit starts a line at depth 0, as it would in write_c
+    parts: list[str] = []
+    w = Writer(parts)
+    w.formatting = formatting
+    emit(unit, w, Scope(names, len(names)))
+    if separator:
+        w.newline()
+    w.close()
+    return "".join(parts)
+
+jobs: list[tuple[Tree, dict[str, str], bool, bool]] = []
+
+def can_fork() -> bool:
+    # only fork while no other thread could be holding a lock
+    return "fork" in multiprocessing.get_all_start_methods() and threading.active_count() == 1
+
+def start_pool(workers: int, fork: bool, initializer: Callable[..., None] | None = None, initargs: tuple[object, ...] = ()) -> multiprocessing.pool.Pool:
+    context = multiprocessing.get_context("fork" if fork else "spawn")
+    with warnings.catch_warnings():
+        # the handler threads of an earlier pool may still be exiting
+        warnings.filterwarnings("ignore", "This process .* is multi-threaded", DeprecationWarning)
+        return context.Pool(workers, initializer, initargs)
+
+def run_job(i: int) -> str:
+    return generate_unit(*jobs[i])
+
+def write_c_parallel(tree: Tree, out: IO[str] | list[str], workers: int | None = None) -> None:
+    global jobs
+    formatting = tree.type == "C_Program"
+    if not formatting and tree.type != "C_DeclarationList":
+        write_c(tree, out, Scope({}, 0))
+        return
+    items: list[Tree | None] = []
+    units(tree, items)
+    names = global_names(items)
+    pending: list[tuple[Tree, dict[str, str], bool, bool]] = []
+    for i, item in enumerate(items):
+        if item is not None:
+            separator = i + 1 < len(items)
+            pending.append((item, names, separator, formatting))
+    workers = workers if workers is not None else os.cpu_count() or 1
+    if workers > 1 and len(pending) > 1:
+        # forked workers inherit the jobs, so trees are never pickled
+        chunksize = max(1, len(pending) // (workers * 4))
+        fork = can_fork()
+        jobs = pending if fork else []
+        try:
+            with start_pool(workers, fork) as pool:
+                if fork:
+                    results = pool.map(run_job, range(len(pending)), chunksize)
+                else:
+                    results = pool.starmap(generate_unit, pending, chunksize)
+                pool.close()
+                pool.join()
+        finally:
+            jobs = []
+    else:
+        results = [generate_unit(*job) for job in pending]
+    w = Writer(out)
+    results_iter = iter(results)
+    for i, item in enumerate(items):
+        if item is None:
+            # only separators not already appended to the unit before them
+            if i == 0 or items[i - 1] is None:
+                w.newline()
+            continue
+        w.write(next(results_iter))
+        w.mark()
+    w.close()
+
+def generate_c_parallel(tree: Tree, workers: int | None = None) -> str:
+    parts: list[str] = []
+    write_c_parallel(tree, parts, workers)
+    return "".join(parts)
@@ -0,0 +1,312 @@
+import hashlib
+import importlib.util
+import os
+import sys
+from types import ModuleType
+from src.lex import Lexer
+from src.parse import Parser
+
+VERSION = 3
+
+PRELUDE = '''import re
+from array import array
+from src.lex import NO_LOCATION, LineIndex, LexError, TokenStream
+from src.parse import Tree, ParseError
+
+SKIP = -1
+'''
+
+LEXER = '''
+def match(code, pos):
+    kind = SKIP
+    end = pos
+    m = REGEX.match(code, pos)
+    if m is not None:
+        if m.end() > pos:
+            kind, end = GROUPS[m.lastgroup], m.end()
+        else:
+            for (k, pattern) in FALLBACK:
+                m = pattern.match(code, pos)
+                if m is not None and m.end() > pos:
+                    kind, end = k, m.end()
+                    break
+    lengths = LITERAL_LENGTHS.get(code[pos:pos+1])
+    if lengths:
+        for length in lengths:
+            if length <= end - pos:
+                break
+            literal = LITERALS.get(code[pos:pos+length])
+            if literal is not None:
+                return literal, pos + length
+    if end == pos:
+        return None
+    if kind != SKIP and end - pos <= LONGEST_LITERAL:
+        keyword = LITERALS.get(code[pos:end])
+        if keyword is not None:
+            return keyword, end
+    return kind, end
+
+def raw_lex(file, code):
+    index = LineIndex(file, code)
+    kinds = array("H")
+    starts = array("q")
+    ends = array("q")
+    pos = 0
+    size = len(code)
+    while pos < size:
+        m = match(code, pos)
+        if m is None:
+            return LexError(code[pos], index.location(pos))
+        kind, end = m
+        if kind != SKIP:
+            kinds.append(kind)
+            starts.append(pos)
+            ends.append(end)
+        pos = end
+    return TokenStream(code, index, NAMES, kinds, starts, ends)
+
+def lex_error(file, code):
+    result = raw_lex(file, code)
+    if isinstance(result, LexError):
+        return result.format()
+    return "No Errors Found (lex.py)"
+
+def lex(file, code):
+    result = raw_lex(file, code)
+    if isinstance(result, LexError):
+        print(result.format())
+        exit(1)
+    return result
+'''
+
+PARSER = '''
+def raw_parse(tokens, pos=0):
+    return ROOT(tokens if isinstance(tokens, TokenStream) else TokenStream.of(tokens), pos)
+
+def parse_error(tokens):
+    result = raw_parse(tokens)
+    if isinstance(result, ParseError):
+        return result.format()
+    if result.rest < len(tokens):
+        rest = tokens[result.rest]
+        return f"{rest.location} SYNTAX ERROR: Expected EOF, but got '{rest.value}'"
+    return "No Errors Found (parse.py)"
+
+def parse(tokens):
+    result = raw_parse(tokens)
+    if isinstance(result, ParseError):
+        print(result.format())
+        exit(1)
+    if result.rest < len(tokens):
+        rest = tokens[result.rest]
+        print(f"{rest.location} SYNTAX ERROR: Expected EOF, but got '{rest.value}'")
+        exit(1)
+    return result
+'''
+
+def resolve(p: Parser) -> Parser:
+    while p.kind == "rule" and isinstance(p.frozen, Parser):
+        p = p.frozen
+    assert p.kind != "rule", f"Not implemented: '{p.label()}' is not built from combinators"
+    return p
+
+def grammar_nodes(root: Parser) -> list[Parser]:
+    nodes: list[Parser] = []
+    seen: set[Parser] = set()
+    stack = [resolve(root.freeze())]
+    while stack:
+        p = stack.pop()
+        if p in seen:
+            continue
+        seen.add(p)
+        nodes.append(p)
+        stack.extend(resolve(c) for c in reversed(p.children))
+    return nodes
+
+def describe(lexer: Lexer, root: Parser) -> str:
+    nodes = grammar_nodes(root)
+    ids = {p: i for i, p in enumerate(nodes)}
+    lines = [f"version {VERSION}", f"skips {lexer.skips!r}", f"patterns {lexer.patterns!r}"]
+    for p in nodes:
+        children = [ids[resolve(c)] for c in p.children]
+        lines.append(f"{p.kind} {p.name!r} {children} {p.bindings} {sorted(p.table.items())}")
+    return "\n".join(lines)
+
+def merge_error(lines: list[str], indent: str, error: str) -> None:
+    lines.append(f"{indent}if {error}.location.line == location.line and {error}.location.column == location.column:")
+    lines.append(f"{indent}    expected.extend({error}.expected)")
+    lines.append(f"{indent}else:")
+    lines.append(f"{indent}    expected = list({error}.expected)")
+    lines.append(f"{indent}    location = {error}.location if {error}.location.line != -1 else location")
+    lines.append(f"{indent}    got = {error}.got")
+
+def generate_node(p: Parser, fn: dict[Parser, str], lines: list[str]) -> None:
+    name = fn[p]
+    children = [fn[resolve(c)] for c in p.children]
+    lines.append("")
+    if p.kind == "token":
+        lines += [
+            f"def {name}(toks, pos):",
+            f"    i = toks.begin + pos",
+            f"    if i >= toks.end:",
+            f"        return ParseError([{p.name!r}], 'EOF', NO_LOCATION)",
+            f"    value = toks.code[toks.starts[i]:toks.ends[i]]",
+            f"    if toks.names[toks.kinds[i]] != {p.name!r}:",
+            f"        return ParseError([{p.name!r}], value, toks.cached_location(i))",
+            f"    return Tree({p.name!r}, [value], toks.cached_location(i), pos + 1)",
+        ]
+    elif p.kind == "seq":
+        lines += [f"def {name}(toks, pos):", "    start = pos"]
+        for i, child in enumerate(children):
+            lines += [
+                f"    t{i} = {child}(toks, pos)",
+                f"    if isinstance(t{i}, ParseError):",
+                f"        if toks.begin + pos >= toks.end and start < len(toks) and toks.value(len(toks) - 1):",
+                f"            return ParseError(t{i}.expected, t{i}.got, toks.location(len(toks) - 1))",
+                f"        return t{i}",
+                f"    pos = t{i}.rest",
+            ]
+        bound = ", ".join(f"t{i}" for i, b in enumerate(p.bindings) if b)
+        lines += [
+            f"    location = toks.cached_location(toks.begin + start) if toks.begin + start < toks.end else NO_LOCATION",
+            f"    return Tree({p.name!r}, [{bound}], location, pos)",
+        ]
+    elif p.kind == "alt":
+        lines += [
+            f"def {name}(toks, pos):",
+            f"    expected = []",
+            f"    i = toks.begin + pos",
+            f"    if i < toks.end:",
+            f"        name = toks.names[toks.kinds[i]]",
+            f"        got = name",
+            f"        here = location = toks.cached_location(i)",
+            f"    else:",
+            f"        name = None",
+            f"        got = 'EOF'",
+            f"        location = NO_LOCATION",
+        ]
+        for i, c in enumerate(p.children):
+            indent = "    "
+            if not c.nullable and not c.opaque:
+                lines.append(f"    if name is None or name in {name}_FIRST_{i}:")
+                indent = "        "
+            lines += [
+                f"{indent}r = {children[i]}(toks, pos)",
+                f"{indent}if isinstance(r, Tree):",
+                f"{indent}    return r",
+            ]
+            merge_error(lines, indent, "r")
+            if not c.nullable and not c.opaque:
+                got = "toks.value(pos)" if c.got == "value" else "name"
+                lines += [
+                    f"    elif location.line == here.line and location.column == here.column:",
+                    f"        expected.extend({c.expected!r})",
+                    f"    else:",
+                    f"        expected = {c.expected!r}",
+                    f"        location = here",
+                    f"        got = {got}",
+                ]
+        lines.append("    return ParseError(expected, got, location)")
+        for i, c in enumerate(p.children):
+            if not c.nullable and not c.opaque:
+                lines.append(f"{name}_FIRST_{i} = frozenset({sorted(c.first)!r})")
+    elif p.kind == "some":
+        lines += [
+            f"def {name}(toks, pos):",
+            f"    head = {children[0]}(toks, pos)",
+            f"    if isinstance(head, ParseError):",
+            f"        return head",
+            f"    nodes = [head]",
+            f"    last = head",
+            f"    while last.rest != pos:",
+            f"        pos = last.rest",
+            f"        item = {children[0]}(toks, pos)",
+            f"        if isinstance(item, ParseError):",
+            f"            break",
+            f"        nodes.append(item)",
+            f"        last = item",
+            f"    return Tree({p.name!r}, nodes, last.location, last.rest)",
+        ]
+    elif p.kind == "many":
+        lines += [
+            f"def {name}(toks, pos):",
+            f"    result = {children[0]}(toks, pos)",
+            f"    if isinstance(result, ParseError):",
+            f"        return Tree({p.name!r}, [], NO_LOCATION, pos)",
+            f"    return result",
+        ]
+    elif p.kind == "operators":
+        lines += [
+            f"{name}_TABLE = {p.table!r}",
+            f"def {name}_climb(toks, pos, min_precedence):",
+            f"    start = pos",
+            f"    left = {children[0]}(toks, pos)",
+            f"    if isinstance(left, ParseError):",
+            f"        return left",
+            f"    pos = left.rest",
+            f"    while toks.begin + pos < toks.end:",
+            f"        op = {name}_TABLE.get(toks.names[toks.kinds[toks.begin + pos]])",
+            f"        if op is None or op[0] < min_precedence:",
+            f"            break",
+            f"        precedence, right_assoc, type = op",
+            f"        right = {name}_climb(toks, pos + 1, precedence if right_assoc else precedence + 1)",
+            f"        if isinstance(right, ParseError):",
+            f"            if toks.begin + pos + 1 >= toks.end and toks.value(len(toks) - 1):",
+            f"                return ParseError(right.expected, right.got, toks.location(len(toks) - 1))",
+            f"            return right",
+            f"        left = Tree(type, [left, right], toks.cached_location(toks.begin + start), right.rest)",
+            f"        pos = left.rest",
+            f"    return left",
+            f"def {name}(toks, pos):",
+            f"    return {name}_climb(toks, pos, 0)",
+        ]
+    else:
+        assert False, f"Not implemented: '{p.kind}'"
+
+def generate(lexer: Lexer, root: Parser) -> str:
+    lexer.compile()
+    assert lexer.regex is not None
+    lines = [f"# generated by src/generator.py from:", *[f"# {l}" for l in describe(lexer, root).splitlines()]]
+    lines.append(PRELUDE)
+    lines += [
+        f"REGEX = re.compile({lexer.regex.pattern!r})",
+        f"GROUPS = {lexer.groups!r}",
+        f"FALLBACK = [{', '.join(f'({k}, re.compile({p.pattern!r}))' for k, p in lexer.fallback)}]",
+        f"NAMES = {lexer.names!r}",
+        f"LITERALS = {lexer.literals!r}",
+        f"LITERAL_LENGTHS = {lexer.literal_lengths!r}",
+        f"LONGEST_LITERAL = {lexer.longest_literal!r}",
+    ]
+    lines.append(LEXER)
+    nodes = grammar_nodes(root)
+    fn = {p: f"p{i}" for i, p in enumerate(nodes)}
+    for p in nodes:
+        generate_node(p, fn, lines)
+    lines.append("")
+    lines.append(f"ROOT = {fn[nodes[0]]}")
+    lines.append(PARSER)
+    return "\n".join(lines)
+
+def fingerprint(lexer: Lexer, root: Parser) -> str:
+    # the whole reachable grammar, wherever its rules are defined; a hit
+    # still imports the cached module without generating it again
+    return hashlib.sha256(describe(lexer, root).encode()).hexdigest()[:16]
+
+def load(lexer: Lexer, root: Parser, cache_dir: str = "build/grammars") -> ModuleType:
+    name = f"pycom_grammar_{fingerprint(lexer, root)}"
+    path = os.path.join(cache_dir, f"{name}.py")
+    module = sys.modules.get(name)
+    if module is not None and module.__file__ == path and os.path.exists(path):
+        return module
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(generate(lexer, root))
+        os.replace(tmp, path)
+    spec = importlib.util.spec_from_file_location(name, path)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
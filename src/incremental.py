@@ -0,0 +1,297 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+from typing import Any, overload
+from src.lex import Lexer, LexError, LineIndex, SourceLocation, Location, TokenStream, SKIP
+from src.parse import Parser, Tree, ParseError
+
+type Key = tuple[Parser, int]
+
+class Positions(Sequence[int]):
+    # offsets into the code, stored as they were when lexed plus a pending
+    # delta for each run of entries, so an edit moves everything behind it
+    # by adding a run instead of rewriting every entry
+    def __init__(self, raw: array[int], firsts: list[int] | None = None, deltas: list[int] | None = None) -> None:
+        self.raw = raw
+        self.firsts = firsts if firsts is not None else [0]
+        self.deltas = deltas if deltas is not None else [0]
+    def __len__(self) -> int:
+        return len(self.raw)
+    @overload
+    def __getitem__(self, i: int) -> int: ...
+    @overload
+    def __getitem__(self, i: slice) -> list[int]: ...
+    def __getitem__(self, i: int | slice) -> int | list[int]:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self.raw)
+        return self.raw[i] + self.deltas[bisect_right(self.firsts, i) - 1]
+    def splice(self, first: int, resync: int, inserted: array[int], delta: int) -> 'Positions':
+        # entries [first, resync) are replaced by inserted, which holds
+        # final offsets; the ones from resync on move by delta
+        firsts: list[int] = []
+        deltas: list[int] = []
+        def run(at: int, d: int) -> None:
+            if firsts and firsts[-1] == at:
+                deltas[-1] = d
+            elif not deltas or deltas[-1] != d:
+                firsts.append(at)
+                deltas.append(d)
+        k = bisect_right(self.firsts, first) - 1
+        for i in range(k + 1):
+            run(self.firsts[i], self.deltas[i])
+        run(first, 0)
+        after = first + len(inserted)
+        k = bisect_right(self.firsts, resync) - 1
+        run(after, self.deltas[k] + delta)
+        for i in range(k + 1, len(self.firsts)):
+            run(self.firsts[i] - resync + after, self.deltas[i] + delta)
+        positions = Positions(self.raw[:first] + inserted + self.raw[resync:], firsts, deltas)
+        if len(firsts) > 32:
+            positions.flatten()
+        return positions
+    def flatten(self) -> None:
+        bounds = self.firsts[1:] + [len(self.raw)]
+        raw = array("q")
+        for first, end, delta in zip(self.firsts, bounds, self.deltas):
+            raw.extend(map(delta.__add__, self.raw[first:end]))
+        self.raw = raw
+        self.firsts = [0]
+        self.deltas = [0]
+
+def positions(offsets: Sequence[int]) -> Positions:
+    if isinstance(offsets, Positions):
+        return offsets
+    return Positions(array("q", offsets))
+
+class Damage:
+    def __init__(self, first: int, resync: int, shift: int, delta: int) -> None:
+        # old tokens [first, resync) were relexed; old token i >= resync is
+        # now token i + shift, and its text moved by delta characters
+        self.first = first
+        self.resync = resync
+        self.shift = shift
+        self.delta = delta
+
+def relex(
+        lexer: Lexer,
+        tokens: TokenStream,
+        offset: int,
+        removed: int,
+        inserted: str) -> tuple[TokenStream, Damage] | LexError:
+    lexer.compile()
+    old = tokens.code
+    code = old[:offset] + inserted + old[offset + removed:]
+    delta = len(inserted) - removed
+    count = len(tokens.kinds)
+    starts = positions(tokens.starts)
+    ends = positions(tokens.ends)
+    # back up one token: the edit may extend the token in front of it
+    first = max(bisect_left(ends, offset) - 1, 0)
+    pos = ends[first - 1] if first > 0 else 0
+    edit_end = offset + len(inserted)
+    lines = positions(tokens.index.newlines)
+    before = bisect_left(lines, offset)
+    after = bisect_left(lines, offset + removed)
+    added = array("q")
+    pos_nl = inserted.find("\n")
+    while pos_nl != -1:
+        added.append(offset + pos_nl)
+        pos_nl = inserted.find("\n", pos_nl + 1)
+    index = LineIndex(tokens.index.file, "")
+    index.newlines = lines.splice(before, after, added, delta)
+    kinds = array("H")
+    new_starts = array("q")
+    new_ends = array("q")
+    resync = count
+    size = len(code)
+    while pos < size:
+        if pos >= edit_end:
+            # the lexer is stateless: once we are back on an old token
+            # boundary past the edit, the rest of the stream is unchanged
+            t = bisect_left(starts, pos - delta, first)
+            if t < count and starts[t] == pos - delta:
+                resync = t
+                break
+        m = lexer.match(code, pos)
+        if m is None:
+            return LexError(code[pos], index.location(pos))
+        kind, end = m
+        if kind != SKIP:
+            kinds.append(kind)
+            new_starts.append(pos)
+            new_ends.append(end)
+        pos = end
+    shift = first + len(kinds) - resync
+    stream = TokenStream(
+        code, index, tokens.names,
+        tokens.kinds[:first] + kinds + tokens.kinds[resync:],
+        starts.splice(first, resync, new_starts, delta),
+        ends.splice(first, resync, new_ends, delta))
+    return stream, Damage(first, resync, shift, delta)
+
+def move_location(location: Location, delta: int) -> Location:
+    if isinstance(location, SourceLocation):
+        return SourceLocation(location.index, location.offset + delta)
+    return location
+
+NODES: Any = Tree.__dict__["nodes"]
+
+class MovedTree(Tree):
+    # a subtree of an earlier parse at its place after an edit; its
+    # children are only moved when they are first read
+    __slots__ = ("moved", "shift", "delta")
+    def __init__(self, tree: Tree, shift: int, delta: int) -> None:
+        if isinstance(tree, MovedTree) and tree.moved is not None:
+            shift += tree.shift
+            delta += tree.delta
+            tree = tree.moved
+        self.kind = tree.kind
+        self.location = move_location(tree.location, delta)
+        self.rest = tree.rest + shift
+        self.moved: Tree | None = tree
+        self.shift = shift
+        self.delta = delta
+    @property  # type: ignore[override]
+    def nodes(self) -> list[Any]:
+        if self.moved is not None:
+            shift, delta = self.shift, self.delta
+            NODES.__set__(self, [MovedTree(n, shift, delta) if isinstance(n, Tree) else n for n in self.moved.nodes])
+            self.moved = None
+        return NODES.__get__(self)
+    @nodes.setter
+    def nodes(self, nodes: list[Any]) -> None:
+        self.moved = None
+        NODES.__set__(self, nodes)
+
+class Memo(dict[Key, Tree | ParseError]):
+    # a packrat table that records how far each entry looked into the
+    # tokens, and falls back to the entries of the previous parse that
+    # an edit left intact; Parser.apply calls get before computing an
+    # entry and sets it after, and each miss opens a frame on the stack
+    def __init__(self, previous: 'Memo | None' = None, damage: Damage | None = None) -> None:
+        super().__init__()
+        self.reach: dict[Key, int] = {}
+        self.stack: list[tuple[Key, int]] = []
+        self.previous = previous
+        self.damage = damage
+    def lookup(self, key: Key) -> tuple[Tree | ParseError, int] | None:
+        result = dict.get(self, key)
+        if result is not None:
+            return result, self.reach[key]
+        if self.previous is None or self.damage is None:
+            return None
+        parser, pos = key
+        damage = self.damage
+        if pos < damage.first:
+            old = self.previous.lookup(key)
+            if old is None or old[1] > damage.first:
+                return None
+            result, reach = old
+        elif pos - damage.shift >= damage.resync:
+            old = self.previous.lookup((parser, pos - damage.shift))
+            if old is None:
+                return None
+            result, reach = old
+            if isinstance(result, Tree):
+                result = MovedTree(result, damage.shift, damage.delta)
+            else:
+                result = ParseError(result.expected, result.got, move_location(result.location, damage.delta))
+            reach += damage.shift
+        else:
+            return None
+        dict.__setitem__(self, key, result)
+        self.reach[key] = reach
+        return result, reach
+    def get(self, key: Key, default: None = None) -> Tree | ParseError | None:
+        found = self.lookup(key)
+        if found is None:
+            self.stack.append((key, key[1] + 1))
+            return None
+        self.touch(found[1])
+        return found[0]
+    def __setitem__(self, key: Key, result: Tree | ParseError) -> None:
+        # frames left open by an exception inside the entry are dropped
+        while True:
+            top, reach = self.stack.pop()
+            if top == key:
+                break
+        if key[0].opaque:
+            # raw parse functions may look at any token
+            reach = 1 << 62
+        elif isinstance(result, Tree):
+            reach = max(reach, result.rest + 1)
+        dict.__setitem__(self, key, result)
+        self.reach[key] = reach
+        self.touch(reach)
+    def touch(self, reach: int) -> None:
+        if self.stack and self.stack[-1][1] < reach:
+            self.stack[-1] = (self.stack[-1][0], reach)
+
+class Document:
+    def __init__(self, lexer: Lexer, parser: Parser, file: str, code: str) -> None:
+        self.lexer = lexer
+        self.parser = parser.freeze()
+        self.file = file
+        self.code = code
+        self.tokens: TokenStream | None = None
+        self.memo = Memo()
+        self.result: Tree | ParseError | LexError = self.reparse(None)
+    def reparse(self, damage: Damage | None) -> Tree | ParseError | LexError:
+        if self.tokens is None:
+            tokens = self.lexer.raw_lex(self.file, self.code)
+            if isinstance(tokens, LexError):
+                return tokens
+            self.tokens = tokens
+            damage = None
+        self.memo = Memo(self.memo if damage is not None else None, damage)
+        try:
+            return self.parser.raw_parse(self.tokens, memo=self.memo)
+        except BaseException:
+            # the next edit starts over instead of trusting a partial table
+            self.memo = Memo()
+            raise
+        finally:
+            # entries the parse did not reach again are dropped here
+            self.memo.previous = None
+    def raw_edit(self, offset: int, removed: int, inserted: str) -> Tree | ParseError | LexError:
+        assert 0 <= offset and offset + removed <= len(self.code), "Edit out of range"
+        damage = None
+        if self.tokens is not None:
+            relexed = relex(self.lexer, self.tokens, offset, removed, inserted)
+            if isinstance(relexed, LexError):
+                self.code = self.code[:offset] + inserted + self.code[offset + removed:]
+                self.tokens = None
+                self.result = relexed
+                return relexed
+            tokens, damage = relexed
+            # the document keeps one line index, updated on every edit, so
+            # trees kept from earlier parses do not hold on to old line
+            # tables; their locations before the edit are still right, and
+            # moved trees get new ones
+            self.tokens.index.newlines = tokens.index.newlines
+            tokens.index = self.tokens.index
+            self.tokens = tokens
+            self.code = tokens.code
+        else:
+            self.code = self.code[:offset] + inserted + self.code[offset + removed:]
+        self.result = self.reparse(damage)
+        return self.result
+    def error(self) -> str:
+        result = self.result
+        if isinstance(result, (ParseError, LexError)):
+            return result.format()
+        assert self.tokens is not None
+        if result.rest < len(self.tokens):
+            rest = self.tokens[result.rest]
+            return f"{rest.location} SYNTAX ERROR: Expected EOF, but got '{rest.value}'"
+        return "No Errors Found (incremental.py)"
+    def edit(self, offset: int, removed: int, inserted: str) -> Tree:
+        self.raw_edit(offset, removed, inserted)
+        message = self.error()
+        if not message.startswith("No Errors Found"):
+            print(message)
+            exit(1)
+        assert isinstance(self.result, Tree)
+        return self.result
@@ -1,34 +1,291 @@
-
 import re
+import re._constants as sre
+import re._parser as sre_parse
+import codecs
+from array import array
+from bisect import bisect_right
+from collections.abc import Sequence
+from typing import IO, Any, Iterable, Iterator, overload
 
 class Location:
+    __slots__ = ("file", "line", "column")
     def __init__(self, file: str, line: int, column: int) -> None:
         self.file = file
         self.line = line
         self.column = column
     def __repr__(self) -> str:
         return f"{self.file}:{self.line}:{self.column}:"
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Location):
+            return NotImplemented
+        return (self.file, self.line, self.column) == (other.file, other.line, other.column)
+    def __hash__(self) -> int:
+        return hash((self.file, self.line, self.column))
+
+# shared placeholder for trees and errors that have no position; never mutate it
+NO_LOCATION = Location("?", -1, -1)
 
 class Token:
+    __slots__ = ("name", "value", "location")
     def __init__(self, name: str, value: str, location: Location) -> None:
         self.name = name
         self.value = value
         self.location = location
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Token):
+            return NotImplemented
+        return (self.name, self.value, self.location) == (other.name, other.value, other.location)
+    def __hash__(self) -> int:
+        return hash((self.name, self.value, self.location))
     def __repr__(self) -> str:
         if not self.value or self.value == self.name:
             return f"[{self.name}]"
         return f"[{self.name}:{self.value}]"
 
+class LineIndex:
+    def __init__(self, file: str, code: str) -> None:
+        self.file = file
+        newlines: list[int] = []
+        pos = code.find("\n")
+        while pos != -1:
+            newlines.append(pos)
+            pos = code.find("\n", pos + 1)
+        self.newlines: Sequence[int] = newlines
+    def location(self, offset: int) -> Location:
+        return SourceLocation(self, offset)
+    def resolve(self, offset: int) -> tuple[int, int]:
+        line = bisect_right(self.newlines, offset - 1)
+        start = self.newlines[line - 1] + 1 if line else 0
+        return line + 1, offset - start + 1
+
+class SourceLocation(Location):
+    # most locations are never printed, so the line and column are only
+    # looked up in the index when first read
+    __slots__ = ("index", "offset")
+    def __init__(self, index: LineIndex, offset: int) -> None:
+        self.file = index.file
+        self.index = index
+        self.offset = offset
+    def __getattr__(self, name: str) -> int:
+        if name != "line" and name != "column":
+            raise AttributeError(name)
+        self.line, self.column = self.index.resolve(self.offset)
+        return getattr(self, name)
+    def __reduce__(self):
+        return (Location, (self.file, self.line, self.column))
+
+class TokenStream(Sequence[Token]):
+    def __init__(
+            self,
+            code: str,
+            index: LineIndex,
+            names: list[str],
+            kinds: array[int] | None = None,
+            starts: Sequence[int] | None = None,
+            ends: Sequence[int] | None = None,
+            begin: int = 0,
+            end: int = -1,
+            locations: list[Location | None] | None = None) -> None:
+        self.code = code
+        self.index = index
+        self.names = names
+        self.kinds = kinds if kinds is not None else array("H")
+        self.starts: Sequence[int] = starts if starts is not None else array("q")
+        self.ends: Sequence[int] = ends if ends is not None else array("q")
+        self.begin = begin
+        self.end = end if end != -1 else len(self.kinds)
+        # built on first use, and shared with slices
+        self.locations = locations
+    @staticmethod
+    def of(tokens: Iterable[Token]) -> 'TokenStream':
+        names: list[str] = []
+        kinds: dict[str, int] = {}
+        column = array("H")
+        starts = array("q")
+        ends = array("q")
+        values: list[str] = []
+        locations: list[Location | None] = []
+        pos = 0
+        for tok in tokens:
+            kind = kinds.get(tok.name)
+            if kind is None:
+                kind = kinds[tok.name] = len(names)
+                names.append(tok.name)
+            column.append(kind)
+            starts.append(pos)
+            pos += len(tok.value)
+            ends.append(pos)
+            values.append(tok.value)
+            locations.append(tok.location)
+        return TokenStream("".join(values), LineIndex("?", ""), names, column, starts, ends, locations=locations)
+    # name, value and location of the token at i, counted from the start
+    # of this stream, without building a Token
+    def name(self, i: int) -> str:
+        return self.names[self.kinds[self.begin + i]]
+    def value(self, i: int) -> str:
+        i += self.begin
+        return self.code[self.starts[i]:self.ends[i]]
+    def location(self, i: int) -> Location:
+        return self.cached_location(self.begin + i)
+    def cached_location(self, i: int) -> Location:
+        if self.locations is None:
+            self.locations = [None] * len(self.kinds)
+        location = self.locations[i]
+        if location is None:
+            location = self.locations[i] = SourceLocation(self.index, self.starts[i])
+        return location
+    def token(self, i: int) -> Token:
+        start = self.starts[i]
+        return Token(self.names[self.kinds[i]], self.code[start:self.ends[i]], self.cached_location(i))
+    def __len__(self) -> int:
+        return self.end - self.begin
+    @overload
+    def __getitem__(self, i: int) -> Token: ...
+    @overload
+    def __getitem__(self, i: slice) -> 'TokenStream': ...
+    def __getitem__(self, i: int | slice) -> 'Token | TokenStream':
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            assert step == 1, "TokenStream slices must be contiguous"
+            stop = max(start, stop)
+            return TokenStream(
+                self.code, self.index, self.names,
+                self.kinds, self.starts, self.ends,
+                self.begin + start, self.begin + stop, self.locations)
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("token index out of range")
+        return self.token(self.begin + i)
+    def __iter__(self) -> Iterator[Token]:
+        for i in range(self.begin, self.end):
+            yield self.token(i)
+    def __eq__(self, other: object) -> bool:
+        # compares like a list of its tokens
+        if not isinstance(other, (TokenStream, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+    def __add__(self, other: Sequence[Token]) -> list[Token]:
+        if not isinstance(other, (TokenStream, list)):
+            return NotImplemented
+        return list(self) + list(other)
+    def __radd__(self, other: Sequence[Token]) -> list[Token]:
+        if not isinstance(other, list):
+            return NotImplemented
+        return other + list(self)
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+type Source = str | bytes | IO[str] | IO[bytes] | Iterable[str | bytes]
+
+def read_chunks(source: Source, size: int, encoding: str = "utf-8") -> Iterator[str]:
+    chunks: Iterable[str | bytes]
+    if isinstance(source, (str, bytes)):
+        chunks = [source]
+    elif hasattr(source, "read"):
+        read = getattr(source, "read")
+        chunks = iter(lambda: read(size), read(0))
+    else:
+        chunks = source
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            yield chunk
+        else:
+            yield decoder.decode(chunk)
+    yield decoder.decode(b"", True)
+
+class LexError:
+    def __init__(self, char: str, location: Location):
+        self.char = char
+        self.location = location
+    def format(self):
+        return f"{self.location} SYNTAX ERROR: Unknown character: '{self.char}'"
+
+SKIP = -1
+
+CATEGORIES = {
+    sre.CATEGORY_DIGIT: r"\d", sre.CATEGORY_NOT_DIGIT: r"\D",
+    sre.CATEGORY_SPACE: r"\s", sre.CATEGORY_NOT_SPACE: r"\S",
+    sre.CATEGORY_WORD: r"\w", sre.CATEGORY_NOT_WORD: r"\W",
+}
+
+def char_class(items: list[tuple[Any, Any]]) -> str | None:
+    parts: list[str] = []
+    for op, av in items:
+        if op is sre.NEGATE:
+            parts.insert(0, "^")
+        elif op is sre.LITERAL:
+            parts.append(re.escape(chr(av)))
+        elif op is sre.RANGE:
+            parts.append(f"{re.escape(chr(av[0]))}-{re.escape(chr(av[1]))}")
+        elif op is sre.CATEGORY and av in CATEGORIES:
+            parts.append(CATEGORIES[av])
+        else:
+            return None
+    return f"[{''.join(parts)}]"
+
+def first_chars(items: Iterable[tuple[Any, Any]]) -> tuple[list[str], bool] | None:
+    # character classes a match of a parsed regex can start with, and
+    # whether it can match the empty string; None when not known. Zero
+    # width assertions are ignored, which only allows more characters
+    classes: list[str] = []
+    for op, av in items:
+        if op in (sre.AT, sre.ASSERT, sre.ASSERT_NOT):
+            continue
+        if op is sre.LITERAL:
+            return [*classes, re.escape(chr(av))], False
+        if op is sre.NOT_LITERAL:
+            return [*classes, f"[^{re.escape(chr(av))}]"], False
+        if op is sre.ANY:
+            return [*classes, "(?s:.)"], False
+        if op is sre.IN:
+            cls = char_class(av)
+            if cls is None:
+                return None
+            return [*classes, cls], False
+        if op is sre.BRANCH:
+            branches = [first_chars(branch) for branch in av[1]]
+        elif op is sre.SUBPATTERN and not av[1] and not av[2]:
+            branches = [first_chars(av[3])]
+        elif op is sre.ATOMIC_GROUP:
+            branches = [first_chars(av)]
+        elif op in (sre.MAX_REPEAT, sre.MIN_REPEAT, sre.POSSESSIVE_REPEAT):
+            body = first_chars(av[2])
+            branches = [body if body is None or av[0] else (body[0], True)]
+        else:
+            return None
+        empty = False
+        for branch in branches:
+            if branch is None:
+                return None
+            classes.extend(branch[0])
+            empty = empty or branch[1]
+        if not empty:
+            return classes, False
+    return classes, True
+
 class Lexer:
     def __init__(self) -> None:
         self.patterns: list[tuple[str, str]] = []
         self.skips: list[str] = []
+        self.regex: re.Pattern[str] | None = None
+        self.names: list[str] = []
+        self.groups: dict[str, int] = {}
+        self.fallback: list[tuple[int, re.Pattern[str]]] = []
+        self.literals: dict[str, int] = {}
+        self.literal_lengths: dict[str, list[int]] = {}
+        self.longest_literal = 0
+        # the characters a token or skip can start with, if known
+        self.first: re.Pattern[str] | None = None
     def add_token(self, name: str, regex: str = "") -> None:
         if not regex:
             regex = name
         self.patterns.append((name, regex))
+        self.regex = None
     def skip(self, regex: str) -> None:
         self.skips.append(regex)
+        self.regex = None
     def convert_regexes(self) -> None:
         new_patterns: list[tuple[str, str]] = []
         for (name, regex) in self.patterns:
@@ -44,91 +301,165 @@ class Lexer:
             else:
                 new_skips.append("^" + skip)
         self.skips = new_skips
-    def lex_error(self, file: str, code: str) -> str:
-        tokens: list[Token] = []
-        line = 1
-        column = 1
-        self.convert_regexes()
-        while len(code) > 0:
-            matched = False
-            for skip in self.skips:
-                location = Location(file, line, column)
-                if not re.match(skip, code): continue
-                m = re.match(skip, code)
-                assert m is not None
-                matched = True
-                for char in m.group(0):
-                    if char == "\n":
-                        line += 1
-                        column = 1
-                        continue
-                    column += 1
-                    code = code[1:]
-            for (name, pattern) in self.patterns:
-                location = Location(file, line, column)
-                m_str: str
-                if name == pattern:
-                    if not code.startswith(pattern): continue
-                    m_str = pattern
-                else:
-                    match = re.match(pattern, code)
-                    if match is None: continue
-                    m_str = match.group(0)
-                matched = True
-                for char in m_str:
-                    if char == "\n":
-                        line += 1
-                        column = 1
-                        continue
-                    column += 1
-                    code = code[1:]
-                tokens.append(Token(name, m_str, location))
-            location = Location(file, line, column)
-            if not matched:
-                return f"{location} SYNTAX ERROR: Unknown character: '{code[0]}'"
-        return "No Errors Found (lex.py)"
+        self.regex = None
+    def compile(self) -> re.Pattern[str]:
+        if self.regex is not None:
+            return self.regex
+        self.names = []
+        self.literals = {}
+        entries: list[tuple[int, str]] = []
+        for skip in self.skips:
+            entries.append((SKIP, skip.removeprefix("^")))
+        for (name, regex) in self.patterns:
+            if name not in self.names:
+                self.names.append(name)
+            kind = self.names.index(name)
+            if name == regex:
+                self.literals.setdefault(regex, kind)
+            else:
+                entries.append((kind, regex.removeprefix("^")))
+        lengths: dict[str, set[int]] = {}
+        for literal in self.literals:
+            lengths.setdefault(literal[0], set()).add(len(literal))
+        self.literal_lengths = {c: sorted(ls, reverse=True) for c, ls in lengths.items()}
+        self.longest_literal = max(map(len, self.literals), default=0)
+        alternatives: list[str] = []
+        self.groups = {}
+        self.fallback = []
+        for i, (kind, regex) in enumerate(entries):
+            group = f"g{i}"
+            alternatives.append(f"(?P<{group}>{regex})")
+            self.groups[group] = kind
+            self.fallback.append((kind, re.compile(regex)))
+        self.regex = re.compile("|".join(alternatives) if alternatives else "(?!)")
+        starts = [re.escape(literal[0]) for literal in self.literals if literal]
+        self.first = None
+        for _, regex in entries:
+            parsed = sre_parse.parse(regex)
+            first = None if parsed.state.flags & (re.IGNORECASE | re.LOCALE) else first_chars(parsed)
+            if first is None:
+                break
+            starts.extend(first[0])
+        else:
+            self.first = re.compile("|".join(starts) if starts else "(?!)")
+        return self.regex
+    def match(self, code: str, pos: int = 0) -> tuple[int, int] | None:
+        kind = SKIP
+        end = pos
+        m = self.compile().match(code, pos)
+        if m is not None:
+            if m.end() > pos:
+                assert m.lastgroup is not None
+                kind, end = self.groups[m.lastgroup], m.end()
+            else:
+                # an alternative matched the empty string, which would
+                # shadow every later alternative; retry them one by one
+                for (k, pattern) in self.fallback:
+                    m = pattern.match(code, pos)
+                    if m is not None and m.end() > pos:
+                        kind, end = k, m.end()
+                        break
+        # literal tokens: longest match wins over a shorter regex match,
+        # and a regex token spelled exactly like a literal is reclassified
+        lengths = self.literal_lengths.get(code[pos:pos+1])
+        if lengths:
+            for length in lengths:
+                if length <= end - pos:
+                    break
+                literal = self.literals.get(code[pos:pos+length])
+                if literal is not None:
+                    return literal, pos + length
+        if end == pos:
+            return None
+        if kind != SKIP and end - pos <= self.longest_literal:
+            keyword = self.literals.get(code[pos:end])
+            if keyword is not None:
+                return keyword, end
+        return kind, end
 
-    def lex(self, file: str, code: str) -> list[Token]:
-        tokens: list[Token] = []
+    def raw_lex(self, file: str, code: str) -> TokenStream | LexError:
+        self.compile()
+        match = self.match
+        index = LineIndex(file, code)
+        kinds = array("H")
+        starts = array("q")
+        ends = array("q")
+        pos = 0
+        size = len(code)
+        while pos < size:
+            m = match(code, pos)
+            if m is None:
+                return LexError(code[pos], index.location(pos))
+            kind, end = m
+            if kind != SKIP:
+                kinds.append(kind)
+                starts.append(pos)
+                ends.append(end)
+            pos = end
+        return TokenStream(code, index, self.names, kinds, starts, ends)
+    def iter_tokens(
+            self,
+            file: str,
+            source: Source,
+            chunk_size: int = 1 << 16,
+            encoding: str = "utf-8") -> Iterator[Token | LexError]:
+        chunks = read_chunks(source, chunk_size, encoding)
+        self.compile()
+        lookahead = max(chunk_size, self.longest_literal)
+        buffer = ""
+        pos = 0
+        eof = False
         line = 1
         column = 1
-        self.convert_regexes()
-        while len(code) > 0:
-            matched = False
-            for skip in self.skips:
-                location = Location(file, line, column)
-                if not re.match(skip, code): continue
-                m = re.match(skip, code)
-                assert m is not None
-                matched = True
-                for char in m.group(0):
-                    if char == "\n":
-                        line += 1
-                        column = 1
-                        continue
-                    column += 1
-                    code = code[1:]
-            for (name, pattern) in self.patterns:
-                location = Location(file, line, column)
-                m_str: str
-                if name == pattern:
-                    if not code.startswith(pattern): continue
-                    m_str = pattern
-                else:
-                    match = re.match(pattern, code)
-                    if match is None: continue
-                    m_str = match.group(0)
-                matched = True
-                for char in m_str:
-                    if char == "\n":
-                        line += 1
-                        column = 1
-                        continue
-                    column += 1
-                    code = code[1:]
-                tokens.append(Token(name, m_str, location))
-            location = Location(file, line, column)
-            if not matched:
-                print(f"{location} SYNTAX ERROR: Unknown character: '{code[0]}'")
+        while True:
+            # keep at least one chunk of lookahead, and never accept a
+            # match that runs into the end of the buffer before EOF
+            if pos < len(buffer) and (eof or len(buffer) - pos >= lookahead):
+                match = self.match(buffer, pos)
+                if eof or (match is not None and match[1] < len(buffer)):
+                    location = Location(file, line, column)
+                    if match is None:
+                        yield LexError(buffer[pos], location)
+                        return
+                    kind, end = match
+                    text = buffer[pos:end]
+                    newlines = text.count("\n")
+                    if newlines:
+                        line += newlines
+                        column = len(text) - text.rfind("\n")
+                    else:
+                        column += len(text)
+                    if kind != SKIP:
+                        yield Token(self.names[kind], text, location)
+                    pos = end
+                    continue
+            if pos < len(buffer) and self.first is not None and self.first.match(buffer, pos) is None:
+                # no token starts with this character, so reading on can't
+                # change the error
+                yield LexError(buffer[pos], Location(file, line, column))
+                return
+            if eof:
+                return
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+            else:
+                buffer = buffer[pos:] + chunk
+                pos = 0
+    def lex_stream(self, file: str, source: Source, chunk_size: int = 1 << 16) -> Iterator[Token]:
+        for token in self.iter_tokens(file, source, chunk_size):
+            if isinstance(token, LexError):
+                print(token.format())
                 exit(1)
-        return tokens
\ No newline at end of file
+            yield token
+    def lex_error(self, file: str, code: str) -> str:
+        result = self.raw_lex(file, code)
+        if isinstance(result, LexError):
+            return result.format()
+        return "No Errors Found (lex.py)"
+    def lex(self, file: str, code: str) -> TokenStream:
+        result = self.raw_lex(file, code)
+        if isinstance(result, LexError):
+            print(result.format())
+            exit(1)
+        return result
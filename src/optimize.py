@@ -0,0 +1,555 @@
+from src.parse import Tree, C
+from typing import Callable
+
+type Key = tuple[str, str]
+
+INT_MAX = 2**31 - 1
+NAMES = ("C_Variable", "C_Identifier")
+STORES = ("C_Assignment", "C_VariableDeclaration")
+SIMPLE = ("C_Statement", "C_Return", *STORES)
+# operators that may be evaluated where the source did not evaluate them:
+# none of them can trap on int operands
+SAFE_OPS = {"+", "-", "*", "&", "|", "^", "==", "!=", "<", ">", "<=", ">=", "!", "~"}
+# operators without side effects; anything else (++, --, the address-of
+# and dereference operators, assignment operators) is never removed,
+# duplicated or rewritten
+PURE_UNARY = {"-", "+", "!", "~"}
+PURE_BINARY = {"+", "-", "*", "/", "%", "<<", ">>", "&", "|", "^", "==", "!=", "<", ">", "<=", ">=", "&&", "||"}
+
+def var_key(tree: Tree) -> Key | None:
+    if isinstance(tree, Tree) and tree.type in NAMES:
+        return (tree.type, tree.nodes[0])
+    return None
+
+def int_value(tree: Tree) -> int | None:
+    # negative constants are built as UnaryOperator("-", IntLiteral(n)) so
+    # that they still print correctly under another unary minus
+    if not isinstance(tree, Tree):
+        return None
+    if tree.type == "C_IntLiteral":
+        text = tree.nodes[0]
+        if text.isdigit() and (text == "0" or text[0] != "0"):
+            return int(text)
+        return None
+    if tree.type == "C_UnaryOperator" and tree.nodes[0] == "-":
+        value = tree.nodes[1]
+        if value.type == "C_IntLiteral" and int_value(value) is not None:
+            return -int_value(value)
+    return None
+
+def literal(value: int) -> Tree:
+    if value < 0:
+        return C.UnaryOperator("-", C.IntLiteral(str(-value)))
+    return C.IntLiteral(str(value))
+
+def is_constant(tree: Tree) -> bool:
+    return int_value(tree) is not None or tree.type == "C_CharLiteral"
+
+def is_pure(tree: Tree | str) -> bool:
+    if not isinstance(tree, Tree):
+        return True
+    if tree.type in ("C_IntLiteral", "C_CharLiteral", "C_StringLiteral", *NAMES):
+        return True
+    if tree.type == "C_UnaryOperator":
+        return tree.nodes[0] in PURE_UNARY and is_pure(tree.nodes[1])
+    if tree.type == "C_BinaryOperator":
+        left, op, right = tree.nodes
+        return op in PURE_BINARY and is_pure(left) and is_pure(right)
+    return False
+
+def same(left: Tree, right: Tree) -> bool:
+    return repr(left) == repr(right)
+
+def size(tree: Tree | str) -> int:
+    if not isinstance(tree, Tree):
+        return 0
+    return 1 + sum(size(node) for node in tree.nodes)
+
+def mentions(tree: Tree | str, out: set[Key]) -> set[Key]:
+    if isinstance(tree, Tree):
+        key = var_key(tree)
+        if key is not None:
+            out.add(key)
+        for node in tree.nodes:
+            mentions(node, out)
+    return out
+
+def stores(tree: Tree | str, out: set[Key]) -> set[Key]:
+    # names assigned, incremented, decremented or whose address is taken
+    if isinstance(tree, Tree):
+        key = None
+        if tree.type in STORES:
+            key = var_key(target(tree))
+        elif tree.type == "C_UnaryOperator" and tree.nodes[0] in ("++", "--", "&"):
+            key = var_key(tree.nodes[1])
+        elif tree.type == "C_BinaryOperator" and tree.nodes[1] not in PURE_BINARY and tree.nodes[1].endswith("="):
+            key = var_key(tree.nodes[0])
+        if key is not None:
+            out.add(key)
+        for node in tree.nodes:
+            stores(node, out)
+    return out
+
+def escaped(tree: Tree | str, out: set[Key]) -> set[Key]:
+    if isinstance(tree, Tree):
+        if tree.type == "C_UnaryOperator" and tree.nodes[0] == "&":
+            key = var_key(tree.nodes[1])
+            if key is not None:
+                out.add(key)
+        for node in tree.nodes:
+            escaped(node, out)
+    return out
+
+def touches_memory(tree: Tree | str) -> bool:
+    # calls and dereferences may read or write any global, and any local
+    # whose address was taken
+    if not isinstance(tree, Tree):
+        return False
+    if tree.type == "C_Call" or tree.type == "C_UnaryOperator" and tree.nodes[0] == "*":
+        return True
+    return any(touches_memory(node) for node in tree.nodes)
+
+def clobbers(tree: Tree, memory: set[Key]) -> set[Key]:
+    out = stores(tree, set())
+    if touches_memory(tree):
+        out |= memory
+    return out
+
+def global_names(tree: Tree) -> set[Key]:
+    return {key for node in tree.nodes if isinstance(node, Tree) and node.type == "C_VariableDeclaration" for key in stores(node, set())}
+
+def declared(tree: Tree | str, out: dict[Key, bool]) -> dict[Key, bool]:
+    # every name declared in the tree, and whether all its declarations
+    # give it type int
+    if isinstance(tree, Tree):
+        if tree.type in ("C_Parameter", "C_VariableDeclaration"):
+            key = var_key(tree.nodes[1])
+            if key is not None:
+                out[key] = out.get(key, True) and repr(tree.nodes[0]) == repr(C.IntType())
+        for node in tree.nodes:
+            declared(node, out)
+    return out
+
+def with_types(ints: set[Key], types: dict[Key, bool]) -> set[Key]:
+    return (ints - types.keys()) | {key for key, is_int in types.items() if is_int}
+
+def target(stmt: Tree) -> Tree:
+    return stmt.nodes[0] if stmt.type == "C_Assignment" else stmt.nodes[1]
+
+def value(stmt: Tree) -> Tree:
+    return stmt.nodes[-1]
+
+def with_value(stmt: Tree, new: Tree) -> Tree:
+    if new is stmt.nodes[-1]:
+        return stmt
+    return Tree(stmt.type, [*stmt.nodes[:-1], new], stmt.location, stmt.rest)
+
+def rebuild(tree: Tree | str, fn: Callable[[Tree], Tree]) -> Tree | str:
+    if not isinstance(tree, Tree):
+        return tree
+    nodes = [rebuild(node, fn) for node in tree.nodes]
+    if any(a is not b for a, b in zip(nodes, tree.nodes)):
+        tree = Tree(tree.type, nodes, tree.location, tree.rest)
+    return fn(tree)
+
+def truncate(left: int, right: int) -> int:
+    quotient = abs(left) // abs(right)
+    return quotient if (left < 0) == (right < 0) else -quotient
+
+def evaluate(op: str, left: int, right: int) -> int | None:
+    match op:
+        case "+": return left + right
+        case "-": return left - right
+        case "*": return left * right
+        case "/" if right != 0: return truncate(left, right)
+        case "%" if right != 0: return left - right * truncate(left, right)
+        case "<<" if left >= 0 and 0 <= right < 31: return left << right
+        case ">>" if left >= 0 and 0 <= right < 31: return left >> right
+        case "&": return left & right
+        case "|": return left | right
+        case "^": return left ^ right
+        case "==": return int(left == right)
+        case "!=": return int(left != right)
+        case "<": return int(left < right)
+        case ">": return int(left > right)
+        case "<=": return int(left <= right)
+        case ">=": return int(left >= right)
+        case "&&": return int(bool(left) and bool(right))
+        case "||": return int(bool(left) or bool(right))
+    return None
+
+def fold_node(tree: Tree) -> Tree:
+    result = None
+    if tree.type == "C_BinaryOperator":
+        left, op, right = tree.nodes
+        a, b = int_value(left), int_value(right)
+        if a is not None and b is not None:
+            result = evaluate(op, a, b)
+    elif tree.type == "C_UnaryOperator":
+        op, operand = tree.nodes
+        a = int_value(operand)
+        if a is not None and not (op == "-" and operand.type == "C_IntLiteral"):
+            match op:
+                case "-": result = -a
+                case "+": result = a
+                case "!": result = int(not a)
+                case "~": result = ~a
+    # anything that would overflow int is left for the compiler to report
+    if result is None or not -INT_MAX <= result <= INT_MAX:
+        return tree
+    return literal(result)
+
+def fold(tree: Tree) -> Tree:
+    return rebuild(tree, fold_node)
+
+def simplify_node(tree: Tree) -> Tree:
+    if tree.type == "C_UnaryOperator":
+        op, operand = tree.nodes
+        if op == "+":
+            return operand
+        if op == "-" and operand.type == "C_UnaryOperator" and operand.nodes[0] == "-":
+            return operand.nodes[1]
+        return tree
+    if tree.type != "C_BinaryOperator":
+        return tree
+    left, op, right = tree.nodes
+    a, b = int_value(left), int_value(right)
+    match op:
+        case "+" if b == 0: return left
+        case "+" if a == 0: return right
+        case "-" if b == 0: return left
+        case "-" if a == 0: return C.UnaryOperator("-", right)
+        case "*" | "/" if b == 1: return left
+        case "*" if a == 1: return right
+        case "*" | "&" if (a == 0 or b == 0) and is_pure(left) and is_pure(right): return literal(0)
+        case "|" | "^" | "<<" | ">>" if b == 0: return left
+        case "|" | "^" if a == 0: return right
+        case "%" if b == 1 and is_pure(left): return literal(0)
+        case "-" | "^" if is_pure(left) and same(left, right): return literal(0)
+        case "==" | "<=" | ">=" if is_pure(left) and same(left, right): return literal(1)
+        case "!=" | "<" | ">" if is_pure(left) and same(left, right): return literal(0)
+    return tree
+
+def simplify(tree: Tree) -> Tree:
+    return rebuild(tree, simplify_node)
+
+def substitute(tree: Tree, facts: dict[Key, Tree]) -> Tree:
+    if not facts:
+        return tree
+    def replace(node: Tree) -> Tree:
+        key = var_key(node)
+        if key is not None:
+            return facts.get(key, node)
+        return node
+    def walk(node: Tree | str) -> Tree | str:
+        if not isinstance(node, Tree):
+            return node
+        if node.type == "C_Call":
+            # the callee is a name but never a value
+            nodes = [node.nodes[0], *(walk(arg) for arg in node.nodes[1:])]
+        elif node.type == "C_UnaryOperator" and node.nodes[0] not in PURE_UNARY:
+            return node
+        elif node.type == "C_BinaryOperator" and node.nodes[1] not in PURE_BINARY:
+            nodes = [node.nodes[0], node.nodes[1], walk(node.nodes[2])]
+        else:
+            nodes = [walk(child) for child in node.nodes]
+        if any(a is not b for a, b in zip(nodes, node.nodes)):
+            node = Tree(node.type, nodes, node.location, node.rest)
+        return replace(node)
+    return walk(tree)
+
+def kill(facts: dict[Key, Tree], key: Key) -> None:
+    facts.pop(key, None)
+    for other, copy in list(facts.items()):
+        if var_key(copy) == key:
+            del facts[other]
+
+def copyprop_statements(statements: list[Tree], facts: dict[Key, Tree], memory: set[Key]) -> list[Tree]:
+    # facts map a name to the constant or name it is known to hold; they are
+    # only carried forward through straight-line code
+    out = []
+    for stmt in statements:
+        if stmt.type in ("C_Statement", "C_Return"):
+            stmt = with_value(stmt, substitute(value(stmt), facts))
+            for key in clobbers(stmt, memory):
+                kill(facts, key)
+        elif stmt.type in STORES:
+            stmt = with_value(stmt, substitute(value(stmt), facts))
+            for key in clobbers(stmt, memory):
+                kill(facts, key)
+            key = var_key(target(stmt))
+            new = value(stmt)
+            if key is not None and (is_constant(new) or var_key(new) is not None) and var_key(new) != key:
+                facts[key] = new
+        else:
+            stmt = copyprop_compound(stmt, facts, memory)
+            for key in clobbers(stmt, memory):
+                kill(facts, key)
+        out.append(stmt)
+    return out
+
+def copyprop_compound(tree: Tree, facts: dict[Key, Tree], memory: set[Key]) -> Tree:
+    match tree.type:
+        case "C_Block" | "C_StatementList":
+            nodes = copyprop_statements(list(tree.nodes), dict(facts), memory)
+        case "C_While" | "C_If" | "C_IfElse":
+            # a loop runs its condition and body again after the body, so
+            # only facts about names it never assigns hold inside it
+            if tree.type == "C_While":
+                facts = dict(facts)
+                for key in clobbers(tree, memory):
+                    kill(facts, key)
+            cond, *bodies = tree.nodes
+            cond = substitute(cond, facts)
+            if tree.type != "C_While":
+                facts = dict(facts)
+                for key in clobbers(cond, memory):
+                    kill(facts, key)
+            nodes = [cond, *(copyprop_compound(body, facts, memory) for body in bodies)]
+        case "C_FunctionDeclaration":
+            nodes = [*tree.nodes[:3], copyprop_compound(tree.nodes[3], {}, memory | escaped(tree, set()))]
+        case "C_Program" | "C_DeclarationList":
+            memory = memory | global_names(tree)
+            nodes = [copyprop_compound(node, {}, memory) if isinstance(node, Tree) else node for node in tree.nodes]
+        case _:
+            return tree
+    return Tree(tree.type, nodes, tree.location, tree.rest)
+
+def copyprop(tree: Tree) -> Tree:
+    return copyprop_compound(tree, {}, set())
+
+def reads(tree: Tree, memory: set[Key]) -> set[Key]:
+    if tree.type == "C_Call":
+        names = set().union(*(mentions(arg, set()) for arg in tree.nodes[1:]))
+    else:
+        names = mentions(tree, set())
+    if touches_memory(tree):
+        names |= memory
+    return names
+
+def dse_statements(statements: list[Tree], globals: set[Key], memory: set[Key]) -> list[Tree]:
+    # backward liveness over the top level of a function body; nothing but
+    # globals is live when the function ends, compound statements are
+    # assumed to read every name they mention, and calls every name in
+    # memory
+    live = set(globals)
+    later: set[Key] = set()
+    # the assignment that next touches a name, which a dead declaration of
+    # that name can be moved onto
+    first: dict[Key, int] = {}
+    out = []
+    for stmt in reversed(statements):
+        if stmt.type in STORES:
+            key = var_key(target(stmt))
+            new = value(stmt)
+            if key is not None and key not in live:
+                if stmt.type == "C_VariableDeclaration" and key in later:
+                    if key not in first:
+                        names = reads(new, memory)
+                        live |= names
+                        later |= names | {key}
+                        out.append(stmt)
+                        continue
+                    i = first.pop(key)
+                    out[i] = C.VariableDeclaration(stmt.nodes[0], out[i].nodes[0], value(out[i]))
+                if is_pure(new):
+                    continue
+                stmt = C.Statement(new)
+                key = None
+            names = reads(new, memory)
+            live.discard(key)
+            live |= names
+            later |= names
+            for name in names:
+                first.pop(name, None)
+            if key is not None:
+                later.add(key)
+                if stmt.type == "C_Assignment":
+                    first[key] = len(out)
+                else:
+                    first.pop(key, None)
+        else:
+            if stmt.type == "C_Return":
+                names = reads(value(stmt), memory)
+                live = names | globals
+            elif stmt.type == "C_Statement":
+                names = reads(value(stmt), memory)
+                live |= names
+            else:
+                names = reads(stmt, memory)
+                live |= names
+            later |= names
+            for name in names:
+                first.pop(name, None)
+        out.append(stmt)
+    out.reverse()
+    return out
+
+def dse_tree(tree: Tree, globals: set[Key]) -> Tree:
+    match tree.type:
+        case "C_Program" | "C_DeclarationList":
+            globals = globals | global_names(tree)
+            nodes = [dse_tree(node, globals) if isinstance(node, Tree) else node for node in tree.nodes]
+        case "C_FunctionDeclaration":
+            body = tree.nodes[3]
+            if body.type != "C_Block":
+                return tree
+            statements = dse_statements(list(body.nodes), globals, globals | escaped(tree, set()))
+            nodes = [*tree.nodes[:3], Tree(body.type, statements, body.location, body.rest)]
+        case _:
+            return tree
+    return Tree(tree.type, nodes, tree.location, tree.rest)
+
+def dse(tree: Tree) -> Tree:
+    return dse_tree(tree, set())
+
+def has_string(tree: Tree | str) -> bool:
+    if not isinstance(tree, Tree):
+        return False
+    return tree.type == "C_StringLiteral" or any(has_string(node) for node in tree.nodes)
+
+def candidates(tree: Tree | str, out: list[Tree]) -> list[Tree]:
+    # expressions that can be hoisted in front of their statement: pure,
+    # and never under the right side of && or ||
+    if not isinstance(tree, Tree):
+        return out
+    if tree.type == "C_BinaryOperator":
+        left, op, right = tree.nodes
+        if op in ("&&", "||"):
+            candidates(left, out)
+            return out
+        if op in SAFE_OPS and is_pure(tree) and not has_string(tree):
+            out.append(tree)
+    elif tree.type == "C_UnaryOperator":
+        op, operand = tree.nodes
+        if op in SAFE_OPS and is_pure(tree) and not has_string(tree) and int_value(tree) is None:
+            out.append(tree)
+    for node in tree.nodes[1:] if tree.type == "C_Call" else tree.nodes:
+        candidates(node, out)
+    return out
+
+def replace_expression(tree: Tree | str, text: str, new: Tree) -> Tree | str:
+    if not isinstance(tree, Tree):
+        return tree
+    if repr(tree) == text:
+        return new
+    if tree.type == "C_BinaryOperator" and tree.nodes[1] in ("&&", "||"):
+        nodes = [replace_expression(tree.nodes[0], text, new), *tree.nodes[1:]]
+    else:
+        nodes = [replace_expression(node, text, new) for node in tree.nodes]
+    if any(a is not b for a, b in zip(nodes, tree.nodes)):
+        return Tree(tree.type, nodes, tree.location, tree.rest)
+    return tree
+
+def common_expression(statements: list[Tree], memory: set[Key], ints: set[Key]) -> tuple[str, list[int]] | None:
+    # the largest expression computed at least twice while none of the
+    # names it reads changes, with the statements computing it; only
+    # expressions over names declared int, as the holder is declared int
+    best: tuple[int, str, list[int]] | None = None
+    open: dict[str, tuple[set[Key], int, list[int]]] = {}
+    def close(text: str) -> None:
+        nonlocal best
+        names, weight, where = open.pop(text)
+        if len(where) >= 2 and (best is None or weight > best[0]):
+            best = (weight, text, where)
+    for i, stmt in enumerate(statements):
+        if stmt.type not in SIMPLE:
+            for text in list(open):
+                close(text)
+            continue
+        for expr in candidates(value(stmt), []):
+            text = repr(expr)
+            if text not in open:
+                names = mentions(expr, set())
+                if not names <= ints:
+                    continue
+                open[text] = (names, size(expr), [])
+            open[text][2].append(i)
+        changed = clobbers(stmt, memory)
+        for text, (names, _, _) in list(open.items()):
+            if names & changed:
+                close(text)
+    for text in list(open):
+        close(text)
+    if best is None:
+        return None
+    return best[1], best[2]
+
+def cse_statements(statements: list[Tree], used: set[str], memory: set[Key], ints: set[Key]) -> list[Tree]:
+    statements = [stmt if stmt.type in SIMPLE else cse_compound(stmt, used, memory, ints) for stmt in statements]
+    while (found := common_expression(statements, memory, ints)) is not None:
+        text, where = found
+        first = statements[where[0]]
+        holder = target(first) if first.type in STORES and repr(value(first)) == text else None
+        # reuse the name the first occurrence is stored to, unless it is
+        # reassigned before the last occurrence
+        if holder is not None:
+            key = var_key(holder)
+            if key is None or any(key in clobbers(statements[i], memory) for i in range(where[0] + 1, where[-1] + 1)):
+                holder = None
+        if holder is None:
+            n = 0
+            while f"_cse{n}" in used:
+                n += 1
+            used.add(f"_cse{n}")
+            holder = C.Identifier(f"_cse{n}")
+            expr = next(e for e in candidates(value(first), []) if repr(e) == text)
+            for i in sorted(set(where)):
+                statements[i] = with_value(statements[i], replace_expression(value(statements[i]), text, holder))
+            statements.insert(where[0], C.VariableDeclaration(C.IntType(), holder, expr))
+        else:
+            for i in sorted(set(where[1:])):
+                statements[i] = with_value(statements[i], replace_expression(value(statements[i]), text, holder))
+    return statements
+
+def cse_compound(tree: Tree, used: set[str], memory: set[Key], ints: set[Key]) -> Tree:
+    match tree.type:
+        case "C_Block" | "C_StatementList":
+            nodes = cse_statements(list(tree.nodes), used, memory, ints)
+        case "C_While" | "C_If" | "C_IfElse":
+            nodes = [tree.nodes[0], *(cse_compound(body, used, memory, ints) for body in tree.nodes[1:])]
+        case "C_FunctionDeclaration":
+            names = {name for _, name in mentions(tree, set())}
+            ints = with_types(ints, declared(tree, {}))
+            nodes = [*tree.nodes[:3], cse_compound(tree.nodes[3], used | names, memory | escaped(tree, set()), ints)]
+        case "C_Program" | "C_DeclarationList":
+            memory = memory | global_names(tree)
+            types: dict[Key, bool] = {}
+            for node in tree.nodes:
+                if isinstance(node, Tree) and node.type == "C_VariableDeclaration":
+                    declared(node, types)
+            ints = with_types(ints, types)
+            nodes = [cse_compound(node, used, memory, ints) if isinstance(node, Tree) else node for node in tree.nodes]
+        case _:
+            return tree
+    return Tree(tree.type, nodes, tree.location, tree.rest)
+
+def cse(tree: Tree) -> Tree:
+    return cse_compound(tree, {name for _, name in mentions(tree, set())}, set(), set())
+
+PASSES: dict[str, Callable[[Tree], Tree]] = {
+    "fold": fold,
+    "simplify": simplify,
+    "copyprop": copyprop,
+    "dse": dse,
+    "cse": cse,
+}
+
+DEFAULT = ("fold", "simplify", "copyprop", "dse", "cse")
+
+def optimize(tree: Tree, passes: tuple[str, ...] = DEFAULT, rounds: int = 8) -> Tree:
+    # passes run in the order given, and the whole sequence again while it
+    # still changes something: propagated copies expose new constants, and
+    # folded constants new copies
+    for name in passes:
+        if name not in PASSES:
+            assert False, f"Not implemented: optimization pass '{name}'"
+    text = repr(tree)
+    for _ in range(rounds):
+        for name in passes:
+            tree = PASSES[name](tree)
+        new = repr(tree)
+        if new == text:
+            break
+        text = new
+    return tree
@@ -1,18 +1,41 @@
-from src.lex import Token, Location
-from typing import Any, Callable
+import os
+from src.lex import Token, TokenStream, Location, NO_LOCATION
+from typing import Any, Callable, Sequence
 
 
+# node types are interned to small ints; TYPES maps them back to names
+TYPES: list[str] = []
+KINDS: dict[str, int] = {}
+
+def intern_type(type: str) -> int:
+    kind = KINDS.get(type)
+    if kind is None:
+        kind = KINDS[type] = len(TYPES)
+        TYPES.append(type)
+    return kind
+
 class Tree:
+    __slots__ = ("kind", "nodes", "location", "rest")
     def __init__(
             self,
             type: str,
             nodes: list[Any],
-            location: Location = Location("?", -1, -1),
-            rest: list[Token] = []):
-        self.type = type
+            location: Location = NO_LOCATION,
+            rest: int = 0):
+        kind = KINDS.get(type)
+        self.kind = kind if kind is not None else intern_type(type)
         self.nodes = nodes
         self.location = location
         self.rest = rest
+    @property
+    def type(self) -> str:
+        return TYPES[self.kind]
+    @type.setter
+    def type(self, type: str) -> None:
+        self.kind = intern_type(type)
+    def __reduce__(self):
+        # kinds are only meaningful in the process that interned them
+        return (Tree, (self.type, self.nodes, self.location, self.rest))
     def __repr__(self):
         nodes = ", ".join([str(n) for n in self.nodes])
         return f"{self.type}({nodes})"
@@ -40,30 +63,107 @@ class ParseError:
         message += f", but got '{self.got}' instead"
         return message
 
+# packrat results by parser and position, for the length of one parse
+type Memo = dict[tuple['Parser', int], Tree | ParseError]
+
+type ParseFn = Callable[[TokenStream, int, Memo | None], Tree | ParseError]
+
 class Parser:
+    # filled in by seq(), operators() and analyze(); until then every parser
+    # shares these defaults, which are only ever replaced, never changed
+    bindings: list[bool] = []
+    table: dict[str, tuple[int, bool, str]] = {}
+    nullable = False
+    opaque = False
+    first: set[str] | frozenset[str] = frozenset()
+    expected: list[str] = []
+    got = "name"
+    dispatch: dict[str, list[int]] | None = None
+    fallback: list[int] = []
     def __init__(
             self,
-            parse: Callable[[], Callable[[list[Token]], Tree | ParseError] | 'Parser']):
+            parse: Callable[[], 'ParseFn | Parser'],
+            kind: str = "rule",
+            name: str = "",
+            children: list['Parser'] | None = None):
         self.parse_fn = parse
-    def raw_parse(self, tokens: list[Token]) -> Tree | ParseError:
-        parse = self.parse_fn()
+        self.kind = kind
+        self.name = name
+        self.children = children if children is not None else []
+        self.frozen: ParseFn | Parser | None = None
+    def label(self) -> str:
+        if self.kind == "rule":
+            code = getattr(self.parse_fn, "__code__", None)
+            if code is None:
+                return "rule"
+            return f"rule at {os.path.basename(code.co_filename)}:{code.co_firstlineno}"
+        if self.kind == "token":
+            return f"'{self.name}'"
+        if self.name:
+            return f"{self.kind} {self.name}"
+        return self.kind
+    def raw_parse(self, tokens: Sequence[Token], pos: int = 0, packrat: bool = False, memo: Memo | None = None) -> Tree | ParseError:
+        if not isinstance(tokens, TokenStream):
+            tokens = TokenStream.of(tokens)
+        if packrat and memo is None:
+            memo = {}
+        return self.apply(tokens, pos, memo)
+    def apply(self, tokens: TokenStream, pos: int, memo: Memo | None) -> Tree | ParseError:
+        # the memo lookup and the call share one frame per parser, so that
+        # packrat parsing doesn't lower how deeply inputs can nest
+        parse = self.frozen
+        if parse is None:
+            # until a grammar is frozen its rules build new combinators on
+            # every call, which could never be looked up again; only the
+            # rules themselves are memoized then
+            parse = self.parse_fn()
+            memoize = memo is not None and self.kind == "rule"
+        else:
+            memoize = memo is not None
+        if memoize:
+            key = (self, pos)
+            result = memo.get(key)
+            if result is not None:
+                return result
         if isinstance(parse, Parser):
-            return parse.raw_parse(tokens)
-        return parse(tokens)
-    def parse_error(self, tokens: list[Token]) -> str: 
-        result = self.raw_parse(tokens)
+            result = parse.apply(tokens, pos, memo)
+        else:
+            result = parse(tokens, pos, memo)
+        if memoize:
+            memo[key] = result
+        return result
+    def freeze(self) -> 'Parser':
+        stack: list[Parser] = [self]
+        frozen: list[Parser] = []
+        while stack:
+            parser = stack.pop()
+            if parser.frozen is not None:
+                continue
+            parser.frozen = parser.parse_fn()
+            if isinstance(parser.frozen, Parser):
+                parser.children = [parser.frozen]
+            elif parser.kind == "rule":
+                parser.opaque = True
+            frozen.append(parser)
+            stack.extend(parser.children)
+        analyze(frozen)
+        return self
+    def parse_error(self, tokens: Sequence[Token], packrat: bool = False) -> str: 
+        result = self.raw_parse(tokens, packrat=packrat)
         if isinstance(result, ParseError):
             return result.format()
-        if result.rest:
-            return f"{result.rest[0].location} SYNTAX ERROR: Expected EOF, but got '{result.rest[0].value}'"
+        if result.rest < len(tokens):
+            rest = tokens[result.rest]
+            return f"{rest.location} SYNTAX ERROR: Expected EOF, but got '{rest.value}'"
         return "No Errors Found (parse.py)"
-    def parse(self, tokens: list[Token]) -> Tree:
-        result = self.raw_parse(tokens)
+    def parse(self, tokens: Sequence[Token], packrat: bool = False) -> Tree:
+        result = self.raw_parse(tokens, packrat=packrat)
         if isinstance(result, ParseError):
             print(result.format())
             exit(1)
-        if result.rest:
-            print(f"{result.rest[0].location} SYNTAX ERROR: Expected EOF, but got '{result.rest[0].value}'")
+        if result.rest < len(tokens):
+            rest = tokens[result.rest]
+            print(f"{rest.location} SYNTAX ERROR: Expected EOF, but got '{rest.value}'")
             exit(1)
         return result
 
@@ -150,87 +250,232 @@ class C:
     def CharType():
         return C.Type("char")
 
+def analyze(parsers: list[Parser]) -> None:
+    changed = True
+    while changed:
+        changed = False
+        for p in parsers:
+            if p.kind == "token":
+                nullable, opaque, first = False, False, {p.name}
+            elif p.kind == "many":
+                c = p.children[0]
+                nullable, opaque, first = True, c.opaque, c.first
+            elif p.kind == "seq":
+                nullable, opaque, first = True, False, set()
+                for c in p.children:
+                    opaque = opaque or c.opaque
+                    first = first | c.first
+                    if not c.nullable:
+                        nullable = False
+                        break
+            elif p.kind == "alt":
+                nullable = any(c.nullable for c in p.children)
+                opaque = any(c.opaque for c in p.children)
+                first = set().union(*[c.first for c in p.children])
+            elif p.children:
+                c = p.children[0]
+                nullable, opaque, first = c.nullable, c.opaque or p.opaque, c.first
+            else:
+                nullable, opaque, first = p.nullable, p.opaque, p.first
+            if (nullable, opaque, first) != (p.nullable, p.opaque, p.first):
+                p.nullable, p.opaque, p.first = nullable, opaque, first
+                changed = True
+    done: set[Parser] = set()
+    for p in parsers:
+        analyze_error(p, done)
+    for p in parsers:
+        if p.kind != "alt":
+            continue
+        always = [i for i, c in enumerate(p.children) if c.nullable or c.opaque]
+        p.dispatch = {}
+        for name in p.first:
+            p.dispatch[name] = [
+                i for i, c in enumerate(p.children)
+                if name in c.first or c.nullable or c.opaque
+            ]
+        p.fallback = always
+
+# the error a parser returns when the next token is outside its FIRST set:
+# what it expects there, and whether 'got' is the token's name or value
+def analyze_error(p: Parser, done: set[Parser]) -> None:
+    if p in done:
+        return
+    done.add(p)
+    if p.kind == "token":
+        p.expected, p.got = [p.name], "value"
+    elif p.kind == "alt":
+        p.expected, p.got = [], "name"
+        for c in p.children:
+            analyze_error(c, done)
+            p.expected = p.expected + c.expected
+    elif p.kind == "seq":
+        for c in p.children:
+            if not c.nullable:
+                analyze_error(c, done)
+                p.expected, p.got = c.expected, c.got
+                break
+    elif p.children:
+        c = p.children[0]
+        analyze_error(c, done)
+        p.expected, p.got = c.expected, c.got
+
 def token(name: str):
-    def parse(tokens: list[Token]):
-        if len(tokens) == 0:
-            return ParseError([name], "EOF", Location("?", -1, -1))
-        if tokens[0].name != name:
-            return ParseError([name], tokens[0].value, tokens[0].location)
-        return Tree(name, [tokens[0].value], tokens[0].location, tokens[1:])
-    return Parser(lambda: parse)
+    def parse(tokens: TokenStream, pos: int, memo: Memo | None):
+        # read the columns directly instead of building a Token
+        i = tokens.begin + pos
+        if i >= tokens.end:
+            return ParseError([name], "EOF", NO_LOCATION)
+        value = tokens.code[tokens.starts[i]:tokens.ends[i]]
+        if tokens.names[tokens.kinds[i]] != name:
+            return ParseError([name], value, tokens.cached_location(i))
+        return Tree(name, [value], tokens.cached_location(i), pos + 1)
+    return Parser(lambda: parse, "token", name)
+
+TOKENS: dict[str, Parser] = {}
+
+def shared_token(name: str) -> Parser:
+    # a token parser only depends on its name, so the ones seq() and alt()
+    # build for strings are shared instead of built again on every call of
+    # a rule that isn't frozen
+    parser = TOKENS.get(name)
+    if parser is None:
+        parser = TOKENS[name] = token(name)
+    return parser
 
 def some(name: str, parser: Parser) -> Parser:
-    def parse(tokens: list[Token]):
-        head = parser.raw_parse(tokens)
+    def parse(tokens: TokenStream, pos: int, memo: Memo | None):
+        head = parser.apply(tokens, pos, memo)
         if isinstance(head, ParseError):
             return head
-        tokens = head.rest
-        tail = some(name, parser).raw_parse(tokens)
-        if isinstance(tail, ParseError):
-            return Tree(name, [head], head.location, head.rest)
-        return Tree(name, [head] + tail.nodes, tail.location)
-    return Parser(lambda: parse)
+        nodes: list[Tree] = [head]
+        last = head
+        while last.rest != pos:
+            pos = last.rest
+            item = parser.apply(tokens, pos, memo)
+            if isinstance(item, ParseError):
+                break
+            nodes.append(item)
+            last = item
+        return Tree(name, nodes, last.location, last.rest)
+    return Parser(lambda: parse, "some", name, [parser])
 
 def many(name: str, parser: Parser) -> Parser:
-    def parse(tokens: list[Token]):
-        result = some(name, parser).raw_parse(tokens)
+    items = some(name, parser)
+    def parse(tokens: TokenStream, pos: int, memo: Memo | None):
+        result = items.apply(tokens, pos, memo)
         if isinstance(result, ParseError):
-            return Tree(name, [], Location("?", -1, -1), tokens)
+            return Tree(name, [], NO_LOCATION, pos)
         return result
-    return Parser(lambda: parse)
+    return Parser(lambda: parse, "many", name, [items])
 
 type SeqElem = str | Parser | list[SeqElem]
 
+def seq_element(s: SeqElem) -> tuple[Parser, bool]:
+    if isinstance(s, list):
+        p, _ = seq_element(s[0])
+        return p, True
+    if isinstance(s, str):
+        return shared_token(s), False
+    return s, False
+
 def seq(type: str, *parsers: SeqElem) -> Parser:
-    def parse(tokens: list[Token]):
-        last: Token = tokens[-1] if tokens else Token("", "", Location("?", -1, -1))
-        first: Token = tokens[0] if tokens else Token("", "", Location("?", -1, -1))
+    elements = [seq_element(p) for p in parsers]
+    def parse(tokens: TokenStream, pos: int, memo: Memo | None):
+        start = pos
         bindings: list[Tree] = []
-        for parser in parsers:
-            binding = False
-            p: Parser
-            def get_parser(s: SeqElem, binding: bool) -> tuple[Parser, bool]:
-                p: Parser
-                if isinstance(s, list):
-                    p, binding = get_parser(s[0], binding)
-                    binding = True
-                elif isinstance(s, str):
-                    p = token(s)
-                else:
-                    p = s
-                return p, binding
-            p, binding = get_parser(parser, binding)
-            tree = p.raw_parse(tokens)
+        for (p, binding) in elements:
+            tree = p.apply(tokens, pos, memo)
             if isinstance(tree, ParseError):
-                if not tokens and last.value:
-                    return ParseError(tree.expected, tree.got, last.location)
+                if pos >= len(tokens) and start < len(tokens) and tokens.value(len(tokens) - 1):
+                    return ParseError(tree.expected, tree.got, tokens.location(len(tokens) - 1))
                 return tree
             if binding:
                 bindings.append(tree)
-            tokens = tree.rest
-        return Tree(type, bindings, first.location, tokens)
-    return Parser(lambda: parse)
+            pos = tree.rest
+        location = tokens.location(start) if start < len(tokens) else NO_LOCATION
+        return Tree(type, bindings, location, pos)
+    result = Parser(lambda: parse, "seq", type, [p for (p, _) in elements])
+    result.bindings = [b for (_, b) in elements]
+    return result
 
 def alt(*parsers: Parser | str):
-    def parse(tokens: list[Token]):
-        expected = []
-        got = tokens[0].name if tokens else "EOF"
-        location = tokens[0].location if tokens else Location("?", -1, -1)
-        for parser in parsers:
-            if isinstance(parser, str):
-                parser = token(parser)
-            tree = parser.raw_parse(tokens)
+    branches = [shared_token(p) if isinstance(p, str) else p for p in parsers]
+    def parse(tokens: TokenStream, pos: int, memo: Memo | None):
+        expected: list[str] = []
+        got = "EOF"
+        location = NO_LOCATION
+        if pos >= len(tokens) or result.dispatch is None:
+            if pos < len(tokens):
+                got = tokens.name(pos)
+                location = tokens.location(pos)
+            for parser in branches:
+                tree = parser.apply(tokens, pos, memo)
+                if isinstance(tree, Tree):
+                    return tree
+                if tree.location.line == location.line and tree.location.column == location.column:
+                    expected.extend(tree.expected)
+                else:
+                    expected = list(tree.expected)
+                    location = tree.location if tree.location.line != -1 else location
+                    got = tree.got
+            return ParseError(expected, got, location)
+        # only try the branches that can start with the next token; the
+        # others would fail on it, with errors known from analyze()
+        name = tokens.names[tokens.kinds[tokens.begin + pos]]
+        errors: dict[int, ParseError] = {}
+        for i in result.dispatch.get(name, result.fallback):
+            tree = branches[i].apply(tokens, pos, memo)
             if isinstance(tree, Tree):
                 return tree
-            if tree.location.line == location.line and tree.location.column == location.column:
-                expected.extend(tree.expected)
-            elif len(tree.expected) > len(expected):
-                expected = tree.expected
-                location = tree.location if tree.location.line != -1 else location
-                got = tree.got
+            errors[i] = tree
+        got = name
+        here = location = tokens.location(pos)
+        for i, parser in enumerate(branches):
+            error = errors.get(i)
+            if error is None:
+                if location.line == here.line and location.column == here.column:
+                    expected.extend(parser.expected)
+                else:
+                    expected = list(parser.expected)
+                    location = here
+                    got = tokens.value(pos) if parser.got == "value" else name
+            elif error.location.line == location.line and error.location.column == location.column:
+                expected.extend(error.expected)
             else:
-                expected = tree.expected
-                location = tree.location if tree.location.line != -1 else location
-                got = tree.got
+                expected = list(error.expected)
+                location = error.location if error.location.line != -1 else location
+                got = error.got
         return ParseError(expected, got, location)
-    return Parser(lambda: parse)
+    result = Parser(lambda: parse, "alt", "", branches)
+    return result
+
+def operators(operand: Parser, *levels: tuple[str, dict[str, str]]) -> Parser:
+    table: dict[str, tuple[int, bool, str]] = {}
+    for precedence, (assoc, ops) in enumerate(levels):
+        assert assoc in ("left", "right"), f"Unknown associativity: '{assoc}'"
+        for op, type in ops.items():
+            table[op] = (precedence, assoc == "right", type)
+    def climb(tokens: TokenStream, pos: int, memo: Memo | None, min_precedence: int) -> Tree | ParseError:
+        start = pos
+        left = operand.apply(tokens, pos, memo)
+        if isinstance(left, ParseError):
+            return left
+        pos = left.rest
+        while pos < len(tokens):
+            op = table.get(tokens.name(pos))
+            if op is None or op[0] < min_precedence:
+                break
+            precedence, right_assoc, type = op
+            right = climb(tokens, pos + 1, memo, precedence if right_assoc else precedence + 1)
+            if isinstance(right, ParseError):
+                if pos + 1 >= len(tokens) and tokens.value(len(tokens) - 1):
+                    return ParseError(right.expected, right.got, tokens.location(len(tokens) - 1))
+                return right
+            left = Tree(type, [left, right], tokens.location(start), right.rest)
+            pos = left.rest
+        return left
+    def parse(tokens: TokenStream, pos: int, memo: Memo | None):
+        return climb(tokens, pos, memo, 0)
+    result = Parser(lambda: parse, "operators", "", [operand])
+    result.table = table
+    return result
@@ -0,0 +1,153 @@
+import time
+from collections import defaultdict
+from typing import Any, Callable
+from src.parse import Parser, Tree, TYPES
+from src.transform import Transformer
+from src import codegen
+
+class Stats:
+    __slots__ = ("calls", "successes", "failures", "tokens", "time", "self_time", "active")
+    def __init__(self) -> None:
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.tokens = 0
+        # time includes callees, but only once for recursive calls
+        self.time = 0.0
+        self.self_time = 0.0
+        self.active = 0
+
+class Profiler:
+    # instruments Parser.apply (and with it every token, seq, alt, some
+    # and many), the rule table of every transformer used and the codegen
+    # emitters by patching them while enabled; nothing is patched otherwise
+    def __init__(self) -> None:
+        self.stats: dict[tuple[str, str], Stats] = {}
+        self.stacks: dict[tuple[str, ...], float] = defaultdict(float)
+        self.frames: list[str] = []
+        self.inner: list[float] = []
+        self.saved: list[tuple[Any, str, Any]] = []
+        # each instrumented transformer with its own table and the one
+        # installed in its place, as installed
+        self.tables: dict[int, tuple[Transformer, list[Any], list[Any]]] = {}
+    def call(self, key: tuple[str, str], frame: str, fn: Callable[..., Any], *args: Any) -> tuple[Stats, Any]:
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = Stats()
+        stats.calls += 1
+        stats.active += 1
+        self.frames.append(frame)
+        self.inner.append(0.0)
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        except BaseException:
+            stats.failures += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            own = elapsed - self.inner.pop()
+            self.stacks[tuple(self.frames)] += own
+            self.frames.pop()
+            if self.inner:
+                self.inner[-1] += elapsed
+            stats.self_time += own
+            stats.active -= 1
+            if not stats.active:
+                stats.time += elapsed
+        return stats, result
+    def parser_key(self, parser: Parser, label: str) -> tuple[str, str]:
+        # rules build their combinators again on every call until frozen,
+        # so parsers are told apart by label; unnamed ones are qualified by
+        # the parser they were called from
+        if label == parser.kind and self.frames:
+            return ("parse", f"{label} in {self.frames[-1]}")
+        return ("parse", label)
+    def patch(self, owner: Any, name: str, value: Any) -> None:
+        self.saved.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, value)
+    def rule(self, name: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+        profiler = self
+        def profiled_rule(*args: Any) -> Any:
+            stats, result = profiler.call(("transform", name), f"transform {name}", fn, *args)
+            stats.successes += 1
+            return result
+        return profiled_rule
+    def instrument(self, transformer: Transformer) -> None:
+        # top-down rules are looked up in the table by transform, bottom-up
+        # and cached ones by reduce, so the table itself is replaced
+        if id(transformer) in self.tables:
+            return
+        table = [fn if fn is None else self.rule(TYPES[kind], fn) for kind, fn in enumerate(transformer.table)]
+        self.tables[id(transformer)] = (transformer, transformer.table, list(table))
+        transformer.table = table
+    def enable(self) -> None:
+        assert not self.saved, "Profiler already enabled"
+        profiler = self
+        apply = Parser.apply
+        transform = Transformer.transform
+        reduce = Transformer.reduce
+        emit = codegen.emit
+        def profiled_apply(self: Parser, tokens: Any, pos: int, memo: Any) -> Any:
+            label = self.label()
+            stats, result = profiler.call(profiler.parser_key(self, label), label, apply, self, tokens, pos, memo)
+            if isinstance(result, Tree):
+                stats.successes += 1
+                stats.tokens += result.rest - pos
+            else:
+                stats.failures += 1
+            return result
+        def profiled_transform(self: Transformer, tree: Any, start: bool = False) -> Any:
+            profiler.instrument(self)
+            return transform(self, tree, start)
+        def profiled_reduce(self: Transformer, tree: Tree) -> Any:
+            profiler.instrument(self)
+            return reduce(self, tree)
+        def profiled_emit(tree: Tree, w: codegen.Writer, env: dict[str, str]) -> None:
+            stats, _ = profiler.call(("generate_c", tree.type), f"emit {tree.type}", emit, tree, w, env)
+            stats.successes += 1
+        self.patch(Parser, "apply", profiled_apply)
+        self.patch(Transformer, "transform", profiled_transform)
+        self.patch(Transformer, "reduce", profiled_reduce)
+        self.patch(codegen, "emit", profiled_emit)
+    def disable(self) -> None:
+        while self.saved:
+            owner, name, value = self.saved.pop()
+            setattr(owner, name, value)
+        for transformer, original, installed in self.tables.values():
+            # rules registered while profiling went to the installed table
+            for kind, fn in enumerate(transformer.table):
+                if kind >= len(installed) or fn is not installed[kind]:
+                    if kind >= len(original):
+                        original.extend([None] * (kind + 1 - len(original)))
+                    original[kind] = fn
+            transformer.table = original
+        self.tables.clear()
+    def __enter__(self) -> 'Profiler':
+        self.enable()
+        return self
+    def __exit__(self, *_: Any) -> None:
+        self.disable()
+    def rows(self) -> list[tuple[str, str, Stats]]:
+        rows = [(phase, name, stats) for (phase, name), stats in self.stats.items()]
+        rows.sort(key=lambda row: -row[2].self_time)
+        return rows
+    def report(self, limit: int | None = None) -> str:
+        lines = [f"{'phase':<10} {'calls':>9} {'ok':>9} {'failed':>9} {'tokens':>9} {'cumulative':>11} {'self':>9}  name"]
+        for phase, name, stats in self.rows()[:limit]:
+            lines.append(
+                f"{phase:<10} {stats.calls:>9} {stats.successes:>9} {stats.failures:>9} {stats.tokens:>9} "
+                f"{stats.time:>10.4f}s {stats.self_time:>8.4f}s  {name}"
+            )
+        return "\n".join(lines)
+    def folded(self) -> str:
+        # one "frame;frame;frame microseconds" line per call stack, the
+        # input format of flamegraph.pl and speedscope
+        lines = []
+        for frames, seconds in self.stacks.items():
+            stack = ";".join(frame.replace(";", "<semicolon>") for frame in frames)
+            lines.append(f"{stack} {round(seconds * 1e6)}")
+        return "\n".join(lines) + "\n"
+    def write_folded(self, path: str) -> None:
+        with open(path, "w") as f:
+            f.write(self.folded())
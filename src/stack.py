@@ -0,0 +1,139 @@
+from collections import Counter
+from src.parse import Tree, C
+from src.optimize import fold_node, int_value, literal, size
+from typing import Callable, Iterable
+
+class Op:
+    __slots__ = ("name", "pops", "pushes", "build", "effect")
+    def __init__(self, name: str, pops: int, pushes: int, build: Callable[..., Tree] | None = None, effect: bool = False):
+        assert pushes <= 1 or build is None, f"Not implemented: '{name}' pushing {pushes} values"
+        self.name = name
+        self.pops = pops
+        self.pushes = pushes
+        self.build = build
+        self.effect = effect
+    def __repr__(self) -> str:
+        return f"Op({self.name!r})"
+
+def push(value: Tree | int) -> Op:
+    tree = literal(value) if isinstance(value, int) else value
+    return Op("push", 0, 1, lambda: tree)
+
+def dup() -> Op:
+    return Op("dup", 1, 2)
+
+def drop() -> Op:
+    return Op("drop", 1, 0)
+
+def swap() -> Op:
+    return Op("swap", 2, 2)
+
+def over() -> Op:
+    return Op("over", 2, 3)
+
+def apply(name: str, build: Callable[..., Tree], pops: int, pushes: int = 1, effect: bool = False) -> Op:
+    return Op(name, pops, pushes, build, effect)
+
+def binary(op: str) -> Op:
+    return apply(op, lambda left, right: C.BinaryOperator(left, op, right), 2)
+
+def unary(op: str) -> Op:
+    return apply(op, lambda value: C.UnaryOperator(op, value), 1)
+
+class Lowering:
+    # the stack holds C expressions instead of values: pure operations build
+    # bigger expressions, and only values that are shared, too big, or the
+    # result of an effect are stored to a slot variable. A slot is reused
+    # as soon as no expression on the stack reads it
+    def __init__(self, prefix: str = "s", max_size: int = 32):
+        self.prefix = prefix
+        self.max_size = max_size
+        self.stack: list[Tree] = []
+        # the names each stack entry reads, and how many entries read each
+        # name, kept up to date on every push and pop
+        self.reads: list[set[str]] = []
+        self.live: Counter[str] = Counter()
+        self.statements: list[Tree] = []
+        self.declared: set[str] = set()
+    def push(self, value: Tree) -> None:
+        names: set[str] = set()
+        pending = [value]
+        while pending:
+            tree = pending.pop()
+            if isinstance(tree, Tree):
+                if tree.type == "C_Identifier":
+                    names.add(tree.nodes[0])
+                pending.extend(tree.nodes)
+        self.stack.append(value)
+        self.reads.append(names)
+        self.live.update(names)
+    def pop(self) -> Tree:
+        self.live.subtract(self.reads.pop())
+        return self.stack.pop()
+    def used(self, name: str, skip: int | None = None) -> bool:
+        count = self.live[name]
+        if skip is not None and name in self.reads[skip]:
+            count -= 1
+        return count > 0
+    def store(self, value: Tree, skip: int | None = None) -> Tree:
+        n = 0
+        while self.used(f"{self.prefix}{n}", skip):
+            n += 1
+        name = f"{self.prefix}{n}"
+        slot = C.Identifier(name)
+        if name in self.declared:
+            self.statements.append(C.Assignment(slot, value))
+        else:
+            self.declared.add(name)
+            self.statements.append(C.VariableDeclaration(C.IntType(), slot, value))
+        return slot
+    def replace(self, index: int, slot: Tree) -> None:
+        self.live.subtract(self.reads[index])
+        self.stack[index] = slot
+        self.reads[index] = {slot.nodes[0]}
+        self.live[slot.nodes[0]] += 1
+    def share(self, index: int) -> Tree:
+        value = self.stack[index]
+        if int_value(value) is None and value.type not in ("C_Identifier", "C_Variable", "C_CharLiteral"):
+            value = self.store(value, index)
+            self.replace(index, value)
+        return value
+    def settle(self) -> None:
+        # an effect may change any name but the slots, so entries still
+        # reading other names are stored before it runs
+        for index, names in enumerate(self.reads):
+            if not names <= self.declared:
+                self.replace(index, self.store(self.stack[index], index))
+    def run(self, op: Op) -> None:
+        stack = self.stack
+        assert len(stack) >= op.pops, f"Stack underflow: '{op.name}' needs {op.pops} values, found {len(stack)}"
+        match op.name:
+            case "dup":
+                self.push(self.share(-1))
+            case "over":
+                self.push(self.share(-2))
+            case "drop":
+                self.pop()
+            case "swap":
+                stack[-2], stack[-1] = stack[-1], stack[-2]
+                self.reads[-2], self.reads[-1] = self.reads[-1], self.reads[-2]
+            case _:
+                args = [self.pop() for _ in range(op.pops)][::-1]
+                value = op.build(*args)
+                if op.effect:
+                    self.settle()
+                if op.effect and not op.pushes:
+                    self.statements.append(C.Statement(value))
+                elif op.effect:
+                    self.push(self.store(value))
+                elif op.pushes:
+                    value = fold_node(value)
+                    if size(value) > self.max_size:
+                        value = self.store(value)
+                    self.push(value)
+
+def lower(ops: Iterable[Op], prefix: str = "s", max_size: int = 32) -> list[Tree]:
+    lowering = Lowering(prefix, max_size)
+    for op in ops:
+        lowering.run(op)
+    return lowering.statements
@@ -0,0 +1,435 @@
+from src.lex import Token, NO_LOCATION
+from src.parse import Parser, Tree, ParseError
+from abc import ABC, abstractmethod
+from typing import Any, Sequence
+
+EOF = "<EOF>"
+
+type Symbol = int | str
+
+class Production:
+    def __init__(self, lhs: int, rhs: tuple[Symbol, ...], action: str, data: Any = None):
+        self.lhs = lhs
+        self.rhs = rhs
+        self.action = action
+        self.data = data
+
+# context-free view of a frozen combinator graph: every Parser becomes a
+# nonterminal (ints), token names are terminals (strs), and each
+# production carries the action that rebuilds the Tree Parser.parse makes
+class Grammar:
+    def __init__(self, root: Parser):
+        self.names: list[str] = []
+        self.productions: list[Production] = []
+        self.rules: list[list[int]] = []
+        self.terminals: list[str] = []
+        self.unsupported: list[str] = []
+        self.nodes: dict[Parser, int] = {}
+        self.tokens: dict[str, int] = {}
+        self.pending: list[Parser] = []
+        root.freeze()
+        self.start = self.nonterminal("start")
+        self.add(self.start, (self.node(root),), "pass")
+        while self.pending:
+            self.expand(self.pending.pop())
+        self.terminals.append(EOF)
+    def nonterminal(self, name: str) -> int:
+        self.names.append(name)
+        self.rules.append([])
+        return len(self.names) - 1
+    def terminal(self, name: str) -> str:
+        if name not in self.terminals:
+            self.terminals.append(name)
+        return name
+    def add(self, lhs: int, rhs: tuple[Symbol, ...], action: str, data: Any = None) -> None:
+        self.rules[lhs].append(len(self.productions))
+        self.productions.append(Production(lhs, rhs, action, data))
+    def node(self, p: Parser) -> int:
+        if p.kind == "token":
+            if p.name not in self.tokens:
+                self.tokens[p.name] = self.nonterminal(p.label())
+                self.add(self.tokens[p.name], (self.terminal(p.name),), "token")
+            return self.tokens[p.name]
+        if p not in self.nodes:
+            self.nodes[p] = self.nonterminal(p.label())
+            self.pending.append(p)
+        return self.nodes[p]
+    def expand(self, p: Parser) -> None:
+        n = self.nodes[p]
+        if p.kind == "seq":
+            self.add(n, tuple(self.node(c) for c in p.children), "seq", (p.name, p.bindings))
+        elif p.kind == "alt":
+            for c in p.children:
+                self.add(n, (self.node(c),), "pass")
+        elif p.kind == "some":
+            item = self.node(p.children[0])
+            tail = self.nonterminal(f"{p.label()} tail")
+            self.add(n, (item, tail), "some", p.name)
+            self.add(tail, (item, tail), "cons")
+            self.add(tail, (), "nil")
+        elif p.kind == "many":
+            self.add(n, (self.node(p.children[0]),), "pass")
+            self.add(n, (), "empty", p.name)
+        elif p.kind == "operators":
+            self.expand_operators(n, p)
+        elif p.children:
+            self.add(n, (self.node(p.children[0]),), "pass")
+        else:
+            self.unsupported.append(f"{p.label()}: not built from combinators")
+    def expand_operators(self, n: int, p: Parser) -> None:
+        levels: dict[int, tuple[bool, dict[str, str]]] = {}
+        for op, (precedence, right, type) in p.table.items():
+            levels.setdefault(precedence, (right, {}))[1][op] = type
+        count = max(levels, default=-1) + 1
+        heads = [n] + [self.nonterminal(f"{p.label()} level {i}") for i in range(1, count)]
+        heads.append(self.node(p.children[0]))
+        for i in range(count):
+            right, ops = levels.get(i, (False, {}))
+            tail = self.nonterminal(f"{p.label()} level {i} tail")
+            if right:
+                self.add(heads[i], (heads[i + 1], tail), "fold_right")
+                for op, type in ops.items():
+                    self.add(tail, (self.terminal(op), heads[i]), "operator", type)
+            else:
+                self.add(heads[i], (heads[i + 1], tail), "fold_left")
+                for op, type in ops.items():
+                    self.add(tail, (self.terminal(op), heads[i + 1], tail), "operators", type)
+            self.add(tail, (), "nil")
+    def describe(self, index: int) -> str:
+        production = self.productions[index]
+        rhs = [self.names[s] if isinstance(s, int) else f"'{s}'" for s in production.rhs]
+        return f"{self.names[production.lhs]} -> {' '.join(rhs) or 'ε'}"
+    def first_sets(self) -> tuple[set[int], list[set[str]]]:
+        nullable: set[int] = set()
+        first: list[set[str]] = [set() for _ in self.names]
+        changed = True
+        while changed:
+            changed = False
+            for production in self.productions:
+                f, null = self.first_of(production.rhs, nullable, first)
+                if not f <= first[production.lhs]:
+                    first[production.lhs] |= f
+                    changed = True
+                if null and production.lhs not in nullable:
+                    nullable.add(production.lhs)
+                    changed = True
+        return nullable, first
+    def first_of(self, symbols: Sequence[Symbol], nullable: set[int], first: list[set[str]]) -> tuple[set[str], bool]:
+        result: set[str] = set()
+        for symbol in symbols:
+            if isinstance(symbol, str):
+                result.add(symbol)
+                return result, False
+            result |= first[symbol]
+            if symbol not in nullable:
+                return result, False
+        return result, True
+
+def reduce(production: Production, values: list[Any], tokens: Sequence[Token], start: int, end: int) -> Any:
+    action = production.action
+    if action == "pass":
+        return values[0]
+    if action == "token":
+        tok: Token = values[0]
+        return Tree(tok.name, [tok.value], tok.location, end)
+    if action == "seq":
+        type, bindings = production.data
+        nodes = [v for (v, binding) in zip(values, bindings) if binding]
+        location = tokens[start].location if start < len(tokens) else NO_LOCATION
+        return Tree(type, nodes, location, end)
+    if action == "some":
+        items = [values[0]]
+        tail = values[1]
+        while tail is not None:
+            items.append(tail[0])
+            tail = tail[1]
+        return Tree(production.data, items, items[-1].location, end)
+    if action == "cons":
+        return (values[0], values[1])
+    if action == "nil":
+        return None
+    if action == "empty":
+        return Tree(production.data, [], NO_LOCATION, end)
+    if action == "operators":
+        return ((production.data, values[1]), values[2])
+    if action == "operator":
+        return (production.data, values[1])
+    if action == "fold_left":
+        left = values[0]
+        tail = values[1]
+        while tail is not None:
+            (type, right), tail = tail
+            left = Tree(type, [left, right], tokens[start].location, right.rest)
+        return left
+    if action == "fold_right":
+        if values[1] is None:
+            return values[0]
+        type, right = values[1]
+        return Tree(type, [values[0], right], tokens[start].location, end)
+    assert False, f"Not implemented: '{action}'"
+
+def unexpected(tokens: Sequence[Token], pos: int, expected: list[str]) -> ParseError:
+    expected = ["EOF" if e == EOF else e for e in expected]
+    if pos < len(tokens):
+        tok = tokens[pos]
+        return ParseError(expected, tok.value, tok.location)
+    location = tokens[-1].location if tokens else NO_LOCATION
+    return ParseError(expected, "EOF", location)
+
+class ConflictReport:
+    def __init__(self, unsupported: list[str], ll: list[str], lalr: list[str]):
+        self.unsupported = unsupported
+        self.ll = ll
+        self.lalr = lalr
+    def format(self) -> str:
+        lines: list[str] = []
+        if self.unsupported:
+            lines.append("Unsupported parsers:")
+            lines.extend(f"    {u}" for u in self.unsupported)
+        if self.ll:
+            lines.append("LL(1) conflicts:")
+            lines.extend(f"    {c}" for c in self.ll)
+        if self.lalr:
+            lines.append("LALR(1) conflicts:")
+            lines.extend(f"    {c}" for c in self.lalr)
+        return "\n".join(lines)
+
+class TableParser(ABC):
+    def __init__(self, grammar: Grammar):
+        self.grammar = grammar
+    @abstractmethod
+    def raw_parse(self, tokens: Sequence[Token]) -> Tree | ParseError: ...
+    def parse_error(self, tokens: Sequence[Token]) -> str:
+        result = self.raw_parse(tokens)
+        if isinstance(result, ParseError):
+            return result.format()
+        if result.rest < len(tokens):
+            rest = tokens[result.rest]
+            return f"{rest.location} SYNTAX ERROR: Expected EOF, but got '{rest.value}'"
+        return "No Errors Found (table.py)"
+    def parse(self, tokens: Sequence[Token]) -> Tree:
+        result = self.raw_parse(tokens)
+        if isinstance(result, ParseError):
+            print(result.format())
+            exit(1)
+        if result.rest < len(tokens):
+            rest = tokens[result.rest]
+            print(f"{rest.location} SYNTAX ERROR: Expected EOF, but got '{rest.value}'")
+            exit(1)
+        return result
+
+class LLParser(TableParser):
+    method = "LL(1)"
+    def __init__(self, grammar: Grammar):
+        super().__init__(grammar)
+        self.table: list[dict[str, int]] = [{} for _ in grammar.names]
+        self.conflicts: list[str] = []
+        nullable, first = grammar.first_sets()
+        follow: list[set[str]] = [set() for _ in grammar.names]
+        follow[grammar.start].add(EOF)
+        changed = True
+        while changed:
+            changed = False
+            for production in grammar.productions:
+                for i, symbol in enumerate(production.rhs):
+                    if isinstance(symbol, str):
+                        continue
+                    f, null = grammar.first_of(production.rhs[i+1:], nullable, first)
+                    if null:
+                        f = f | follow[production.lhs]
+                    if not f <= follow[symbol]:
+                        follow[symbol] |= f
+                        changed = True
+        for index, production in enumerate(grammar.productions):
+            f, null = grammar.first_of(production.rhs, nullable, first)
+            if null:
+                f = f | follow[production.lhs]
+            row = self.table[production.lhs]
+            for terminal in sorted(f, key=grammar.terminals.index):
+                if terminal in row and row[terminal] != index:
+                    self.conflicts.append(
+                        f"on '{terminal}': {grammar.describe(row[terminal])} | {grammar.describe(index)}")
+                    continue
+                row[terminal] = index
+    def raw_parse(self, tokens: Sequence[Token]) -> Tree | ParseError:
+        grammar = self.grammar
+        productions = grammar.productions
+        table = self.table
+        stack: list[Symbol | tuple[int, int]] = [grammar.start]
+        values: list[Any] = []
+        pos = 0
+        tok = tokens[0] if tokens else None
+        while stack:
+            top = stack.pop()
+            name = tok.name if tok is not None else EOF
+            if isinstance(top, tuple):
+                index, start = top
+                production = productions[index]
+                count = len(production.rhs)
+                args = values[len(values) - count:]
+                del values[len(values) - count:]
+                values.append(reduce(production, args, tokens, start, pos))
+            elif isinstance(top, str):
+                if name != top:
+                    return unexpected(tokens, pos, [top])
+                values.append(tok)
+                pos += 1
+                tok = tokens[pos] if pos < len(tokens) else None
+            else:
+                index = table[top].get(name, -1)
+                if index == -1:
+                    return unexpected(tokens, pos, list(table[top]))
+                stack.append((index, pos))
+                stack.extend(reversed(productions[index].rhs))
+        return values[0]
+
+class LALRParser(TableParser):
+    method = "LALR(1)"
+    def __init__(self, grammar: Grammar):
+        super().__init__(grammar)
+        self.conflicts: list[str] = []
+        productions = grammar.productions
+        nullable, first = grammar.first_sets()
+        start_item = (grammar.rules[grammar.start][0], 0)
+        kernels: list[frozenset[tuple[int, int]]] = [frozenset([start_item])]
+        index = {kernels[0]: 0}
+        self.goto: list[dict[Symbol, int]] = []
+        i = 0
+        while i < len(kernels):
+            moves: dict[Symbol, set[tuple[int, int]]] = {}
+            for (p, dot) in self.closure(kernels[i]):
+                rhs = productions[p].rhs
+                if dot < len(rhs):
+                    moves.setdefault(rhs[dot], set()).add((p, dot + 1))
+            edges: dict[Symbol, int] = {}
+            for symbol, items in moves.items():
+                kernel = frozenset(items)
+                if kernel not in index:
+                    index[kernel] = len(kernels)
+                    kernels.append(kernel)
+                edges[symbol] = index[kernel]
+            self.goto.append(edges)
+            i += 1
+        # propagate lookaheads over the LR(0) automaton until they settle
+        lookaheads: list[dict[tuple[int, int], set[str]]] = [{} for _ in kernels]
+        lookaheads[0][start_item] = {EOF}
+        follows: dict[tuple[int, int], tuple[set[str], bool]] = {}
+        closures: list[dict[tuple[int, int], set[str]]] = []
+        changed = True
+        while changed:
+            changed = False
+            closures = []
+            for state, kernel in enumerate(kernels):
+                items = {item: set(lookaheads[state].get(item, ())) for item in kernel}
+                work = list(kernel)
+                while work:
+                    item = work.pop()
+                    p, dot = item
+                    rhs = productions[p].rhs
+                    if dot >= len(rhs) or isinstance(rhs[dot], str):
+                        continue
+                    if item not in follows:
+                        follows[item] = grammar.first_of(rhs[dot+1:], nullable, first)
+                    f, null = follows[item]
+                    las = f | items[item] if null else f
+                    for q in grammar.rules[rhs[dot]]:
+                        current = items.get((q, 0))
+                        if current is None:
+                            items[(q, 0)] = set(las)
+                            work.append((q, 0))
+                        elif not las <= current:
+                            current |= las
+                            work.append((q, 0))
+                for (p, dot), las in items.items():
+                    rhs = productions[p].rhs
+                    if dot < len(rhs):
+                        target = lookaheads[self.goto[state][rhs[dot]]].setdefault((p, dot + 1), set())
+                        if not las <= target:
+                            target |= las
+                            changed = True
+                closures.append(items)
+        self.action: list[dict[str, int]] = []
+        for state, items in enumerate(closures):
+            row: dict[str, int] = {}
+            for symbol, target in self.goto[state].items():
+                if isinstance(symbol, str):
+                    row[symbol] = target
+            for (p, dot), las in items.items():
+                if dot < len(productions[p].rhs):
+                    continue
+                for terminal in sorted(las, key=grammar.terminals.index):
+                    if terminal in row:
+                        other = row[terminal]
+                        kind = "shift/reduce" if other >= 0 else "reduce/reduce"
+                        previous = "shift" if other >= 0 else grammar.describe(-1 - other)
+                        self.conflicts.append(
+                            f"state {state} on '{terminal}': {kind} {previous} | {grammar.describe(p)}")
+                        continue
+                    row[terminal] = -1 - p
+            self.action.append(row)
+    def closure(self, kernel: frozenset[tuple[int, int]]) -> set[tuple[int, int]]:
+        productions = self.grammar.productions
+        items = set(kernel)
+        work = list(kernel)
+        while work:
+            p, dot = work.pop()
+            rhs = productions[p].rhs
+            if dot < len(rhs) and isinstance(rhs[dot], int):
+                for q in self.grammar.rules[rhs[dot]]:
+                    if (q, 0) not in items:
+                        items.add((q, 0))
+                        work.append((q, 0))
+        return items
+    def raw_parse(self, tokens: Sequence[Token]) -> Tree | ParseError:
+        grammar = self.grammar
+        productions = grammar.productions
+        action = self.action
+        goto = self.goto
+        accept = grammar.rules[grammar.start][0]
+        states = [0]
+        values: list[Any] = []
+        starts: list[int] = []
+        pos = 0
+        tok = tokens[0] if tokens else None
+        while True:
+            name = tok.name if tok is not None else EOF
+            act = action[states[-1]].get(name)
+            if act is None:
+                return unexpected(tokens, pos, list(action[states[-1]]))
+            if act >= 0:
+                states.append(act)
+                values.append(tok)
+                starts.append(pos)
+                pos += 1
+                tok = tokens[pos] if pos < len(tokens) else None
+                continue
+            p = -1 - act
+            if p == accept:
+                return values[0]
+            production = productions[p]
+            count = len(production.rhs)
+            start = starts[len(starts) - count] if count else pos
+            args = values[len(values) - count:]
+            del values[len(values) - count:]
+            del starts[len(starts) - count:]
+            del states[len(states) - count:]
+            values.append(reduce(production, args, tokens, start, pos))
+            starts.append(start)
+            states.append(goto[states[-1]][production.lhs])
+
+def build_table(parser: Parser, method: str = "auto") -> TableParser | ConflictReport:
+    grammar = Grammar(parser)
+    if grammar.unsupported:
+        return ConflictReport(grammar.unsupported, [], [])
+    ll: list[str] = []
+    if method in ("auto", "LL(1)"):
+        ll_parser = LLParser(grammar)
+        if not ll_parser.conflicts:
+            return ll_parser
+        ll = ll_parser.conflicts
+        if method == "LL(1)":
+            return ConflictReport([], ll, [])
+    lalr_parser = LALRParser(grammar)
+    if not lalr_parser.conflicts:
+        return lalr_parser
+    return ConflictReport([], ll, lalr_parser.conflicts)
@@ -1,25 +1,87 @@
-from src.parse import Tree
+from src.parse import Tree, TYPES, intern_type
+from src.cache import LRU, MISSING
 from typing import Any, Callable
 
+APPLY = object()
+
 class Transformer:
-    def __init__(self):
+    def __init__(self, bottom_up: bool = False, cache_size: int = 0):
         self.rules: dict[str, Callable[..., Any]] = {}
+        # rules indexed by interned node type, see parse.intern_type
+        self.table: list[Callable[..., Any] | None] = []
+        # bottom-up rules receive their children already transformed
+        self.bottom_up = bottom_up
+        # results by tree identity, so subtrees shared through HashCons are
+        # transformed once; only valid for rules without side effects
+        self.cache = LRU(cache_size) if cache_size else None
     def new_rule(self, name: str):
         def wrapper(fn: Callable[..., Any]):
-            def impl(*args: Any):
-                return fn(*args)
             self.rules[name] = fn
-            return impl
+            kind = intern_type(name)
+            if kind >= len(self.table):
+                self.table.extend([None] * (kind + 1 - len(self.table)))
+            self.table[kind] = fn
+            return fn
         return wrapper
+    def rule(self, tree: Tree) -> Callable[..., Any]:
+        fn = self.table[tree.kind] if tree.kind < len(self.table) else None
+        if fn is None:
+            assert False, f"Not implemented: '{tree.type}'"
+        return fn
     def transform(self, tree: Tree | str, start: bool = False) -> Tree:
         if start:
-            return self.rules["#Start"](tree)
-        if isinstance(tree, Tree) and not self.rules.get(tree.type):
-            assert False, f"Not implemented: '{tree.type}'"
+            return self.start(tree)
         if not isinstance(tree, Tree):
             test: Any = tree
             any: Tree = test
             return any
-        return self.rules[tree.type](*[n for n in tree.nodes])
+        if self.bottom_up:
+            return self.reduce(tree)
+        if self.cache is None:
+            return self.rule(tree)(*tree.nodes)
+        result = self.cache.get(tree)
+        if result is MISSING:
+            result = self.rule(tree)(*tree.nodes)
+            self.cache.put(tree, result)
+        return result
+    def reduce(self, tree: Tree) -> Any:
+        table = self.table
+        size = len(table)
+        cache = self.cache
+        values: list[Any] = []
+        # post-order walk: a node is pushed under an APPLY marker and its
+        # children, and its rule runs once their values are on the stack
+        stack: list[Any] = [tree]
+        while stack:
+            item = stack.pop()
+            if item is APPLY:
+                node = stack.pop()
+                count = len(node.nodes)
+                fn = table[node.kind]
+                if count:
+                    args = values[-count:]
+                    del values[-count:]
+                    result = fn(*args)
+                else:
+                    result = fn()
+                if cache is not None:
+                    cache.put(node, result)
+                values.append(result)
+            elif isinstance(item, Tree):
+                if cache is not None:
+                    result = cache.get(item)
+                    if result is not MISSING:
+                        values.append(result)
+                        continue
+                if item.kind >= size or table[item.kind] is None:
+                    assert False, f"Not implemented: '{TYPES[item.kind]}'"
+                stack.append(item)
+                stack.append(APPLY)
+                stack.extend(reversed(item.nodes))
+            else:
+                values.append(item)
+        return values[0]
     def start(self, tree: Tree | str):
-        return self.transform(tree, True)
+        if self.bottom_up:
+            return self.rules["#Start"](self.transform(tree))
+        return self.rules["#Start"](tree)
@@ -1,4 +1,6 @@
-from src.lex import Lexer
+import io
+import pickle
+from src.lex import Lexer, LexError, TokenStream
 
 def test_math_grammar():
     lexer = Lexer()
@@ -14,4 +16,99 @@ def test_math_grammar():
     lexer.skip(r"\s+")
     text = "(1 + 3(2 / 4)^2) / 10"
     tokens = lexer.lex("<test>", text)
-    assert repr(tokens) == expected
\ No newline at end of file
+    assert repr(tokens) == expected
+
+def test_declaration_order():
+    lexer = Lexer()
+    lexer.add_token("fn")
+    lexer.add_token("IDENTIFIER", r"[a-z]+")
+    lexer.add_token("+")
+    lexer.skip(r"\s+")
+    tokens = lexer.lex("<test>", "fn f + x")
+    assert repr(tokens) == "[[fn], [IDENTIFIER:f], [+], [IDENTIFIER:x]]"
+    regex = lexer.compile()
+    lexer.lex("<test>", "x")
+    assert lexer.compile() is regex
+    lexer.add_token("INT", r"\d+")
+    tokens = lexer.lex("<test>", "x + 1")
+    assert repr(tokens) == "[[IDENTIFIER:x], [+], [INT:1]]"
+
+
+def test_locations():
+    lexer = Lexer()
+    lexer.add_token("IDENTIFIER", r"[a-z]+")
+    lexer.skip(r"\s+")
+    tokens = lexer.lex("<test>", "a\n  bb\n\ncc d")
+    locations = [repr(t.location) for t in tokens]
+    assert locations == ["<test>:1:1:", "<test>:2:3:", "<test>:4:1:", "<test>:4:4:"]
+    assert lexer.lex_error("<test>", "ab\n c?") == "<test>:2:3: SYNTAX ERROR: Unknown character: '?'"
+
+
+def test_stream():
+    lexer = Lexer()
+    lexer.add_token("==")
+    lexer.add_token("=")
+    lexer.add_token("IDENTIFIER", r"[a-z]+")
+    lexer.add_token("STRING", r'"[^"]*"')
+    lexer.skip(r"\s+")
+    text = 'abc == "x y"\n  de = fgh\n"long string"==z' * 20
+    expected = [(t.name, t.value, repr(t.location)) for t in lexer.lex("<test>", text)]
+    for size in [1, 2, 3, 7, 64]:
+        chunks = [text[i:i+size] for i in range(0, len(text), size)]
+        tokens = lexer.lex_stream("<test>", chunks, size)
+        assert [(t.name, t.value, repr(t.location)) for t in tokens] == expected
+    data = io.BytesIO(text.encode())
+    tokens = lexer.lex_stream("<test>", data, 5)
+    assert [(t.name, t.value, repr(t.location)) for t in tokens] == expected
+    errors = list(lexer.iter_tokens("<test>", ["ab", "\n?"], 1))
+    assert isinstance(errors[-1], LexError)
+    assert errors[-1].format() == "<test>:2:1: SYNTAX ERROR: Unknown character: '?'"
+    # no token starts with '?', so the error is reported without reading on
+    def chunks():
+        yield 'ab "?"?'
+        assert False, "read past the error"
+    errors = list(lexer.iter_tokens("<test>", chunks(), 1))
+    assert [t.value for t in errors[:-1]] == ["ab", '"?"']
+    assert errors[-1].format() == "<test>:1:7: SYNTAX ERROR: Unknown character: '?'"
+    # an unterminated string may still end in a later chunk
+    tokens = lexer.lex_stream("<test>", ['ab "?', ' ', '?" z'], 1)
+    assert [t.value for t in tokens] == ["ab", '"? ?"', "z"]
+
+
+def test_token_stream():
+    lexer = Lexer()
+    lexer.add_token("INT", r"\d+")
+    lexer.add_token("+")
+    lexer.skip(r"\s+")
+    tokens = lexer.lex("<test>", "1 + 2\n+ 30")
+    assert isinstance(tokens, TokenStream)
+    assert len(tokens) == 5
+    assert repr(tokens[1:]) == "[[+], [INT:2], [+], [INT:30]]"
+    assert repr(tokens[1:][2:][0]) == "[+]"
+    assert repr(tokens[-1].location) == "<test>:2:3:"
+    assert len(tokens[5:]) == 0
+    assert [t.name for t in tokens] == ["INT", "+", "INT", "+", "INT"]
+    # compares and concatenates like the list of its tokens
+    streamed = list(lexer.lex_stream("<test>", "1 + 2\n+ 30"))
+    assert tokens == streamed and streamed == tokens
+    assert tokens[1:] == streamed[1:] and tokens[1:] != streamed
+    assert tokens[:2] + tokens[3:] == streamed[:2] + streamed[3:]
+    assert streamed[:1] + tokens[4:] == [streamed[0], streamed[4]]
+    assert TokenStream.of(streamed) == tokens
+    assert TokenStream.of(streamed).location(4) is streamed[4].location
+    assert tokens.name(4) == "INT" and tokens.value(4) == "30"
+    assert tokens[1:].location(3) is tokens.location(4)
+    assert pickle.loads(pickle.dumps(tokens.location(4))) == streamed[4].location
+
+
+def test_literals():
+    lexer = Lexer()
+    lexer.add_token("IDENTIFIER", r"[a-z]+")
+    lexer.add_token("=")
+    lexer.add_token("==")
+    lexer.add_token("while")
+    lexer.add_token("wh")
+    lexer.skip(r"\s+")
+    tokens = lexer.lex("<test>", "while whiles wh == = ===")
+    expected = "[[while], [IDENTIFIER:whiles], [wh], [==], [=], [==], [=]]"
+    assert repr(tokens) == expected
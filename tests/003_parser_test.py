@@ -1,5 +1,7 @@
-from src.parse import Parser, seq, alt
-from src.lex import Lexer
+import sys
+from src.parse import Parser, seq, alt, many, token, operators, TYPES
+from src.lex import Lexer, NO_LOCATION
+from src.arena import Arena
 
 lexer = Lexer()
 lexer.add_token("INT", r"\d+")
@@ -68,3 +70,132 @@ def test_math_6():
     tokens = lexer.lex("<test>", text)
     tree = expr_parser.parse_error(tokens)
     assert tree == "<test>:1:6: SYNTAX ERROR: Expected ')', but got 'EOF' instead"
+    assert expr_parser.parse_error(list(tokens)) == tree
+
+def test_packrat():
+    text = "((1 + 2) * (3 * 4)) + 5"
+    tokens = lexer.lex("<test>", text)
+    assert repr(expr_parser.parse(tokens, packrat=True)) == repr(expr_parser.parse(tokens))
+    tokens = lexer.lex("<test>", "(10 * 2 3)")
+    error = expr_parser.parse_error(tokens, packrat=True)
+    assert error == "<test>:1:9: SYNTAX ERROR: Expected ')', but got '3' instead"
+
+def test_nested_packrat():
+    # a parse started while another one runs gets a memo of its own
+    inner: list[str] = []
+    def parse_int(tokens, pos, memo):
+        if not inner:
+            inner.append(repr(expr_parser.parse(lexer.lex("<inner>", "7 * 8"), packrat=True)))
+        return token("INT").apply(tokens, pos, memo)
+    int_parser = Parser(lambda: parse_int)
+    sum_parser = Parser(lambda: alt(seq("Expr", [int_parser], "+", [int_parser]), int_parser))
+    tokens = lexer.lex("<test>", "1 + 2")
+    assert repr(sum_parser.parse(tokens, packrat=True)) == "Expr(INT(1), INT(2))"
+    assert inner == ["Term(INT(7), INT(8))"]
+
+def test_freeze():
+    calls: list[str] = []
+    def rule():
+        calls.append("list")
+        return seq("List", "(", [many("Items", item_parser)], ")")
+    list_parser = Parser(rule)
+    item_parser = Parser(lambda: alt("INT", list_parser))
+    tokens = lexer.lex("<test>", "(1 (2 3) () 4)")
+    expected = repr(list_parser.parse(tokens))
+    assert expected == "List(Items(INT(1), List(Items(INT(2), INT(3))), List(Items()), INT(4)))"
+    # rules that aren't frozen yet reuse the token parsers of their strings
+    assert rule().children[0] is rule().children[0] is alt("(", "INT").children[0]
+    calls.clear()
+    assert list_parser.freeze() is list_parser
+    assert repr(list_parser.parse(tokens)) == expected
+    assert repr(list_parser.parse(tokens)) == expected
+    assert calls == ["list"]
+
+def test_packrat_depth():
+    # one frame per parser and one for its parse function, memoized or not
+    list_parser = Parser(lambda: seq("List", "(", [many("Items", item_parser)], ")"))
+    item_parser = Parser(lambda: alt("INT", list_parser))
+    list_parser.freeze()
+    def frames(depth: int, packrat: bool) -> int:
+        deepest = 0
+        def profile(frame, event, arg):
+            nonlocal deepest
+            n = 0
+            while frame is not None:
+                n, frame = n + 1, frame.f_back
+            deepest = max(deepest, n)
+        tokens = lexer.lex("<test>", "(" * depth + ")" * depth)
+        sys.setprofile(profile)
+        try:
+            list_parser.parse(tokens, packrat)
+        finally:
+            sys.setprofile(None)
+        return deepest
+    for packrat in (False, True):
+        # the rules item and list, and alt, seq, many and some with their
+        # parse functions
+        assert frames(20, packrat) - frames(10, packrat) == 10 * 10
+
+def test_long_repetition():
+    ints_parser = seq("Ints", [many("Items", token("INT"))], "+")
+    tokens = lexer.lex("<test>", "1 " * 20000 + "+")
+    tree = ints_parser.parse(tokens)
+    items = tree.nodes[0]
+    assert len(items.nodes) == 20000
+    assert repr(items.location) == "<test>:1:39999:"
+    assert items.rest == 20000
+
+def test_operators():
+    pow_lexer = Lexer()
+    pow_lexer.add_token("INT", r"\d+")
+    for op in "+-*^()":
+        pow_lexer.add_token(op)
+    pow_lexer.skip(r"\s+")
+    atom = Parser(lambda: alt("INT", seq("Paren", "(", [expr], ")")))
+    expr = operators(atom,
+        ("left", {"+": "Plus", "-": "Minus"}),
+        ("left", {"*": "Mult"}),
+        ("right", {"^": "Pow"}),
+    )
+    tokens = pow_lexer.lex("<test>", "1 - 2 + 3 * 4 * 5 ^ 6 ^ (7 - 8)")
+    tree = expr.parse(tokens)
+    assert repr(tree) == "Plus(Minus(INT(1), INT(2)), Mult(Mult(INT(3), INT(4)), Pow(INT(5), Pow(INT(6), Paren(Minus(INT(7), INT(8)))))))"
+    assert repr(tree.nodes[1].location) == "<test>:1:9:"
+    tokens = pow_lexer.lex("<test>", "1 + 2 *")
+    assert expr.parse_error(tokens) == "<test>:1:7: SYNTAX ERROR: Expected 'INT' or '(', but got 'EOF' instead"
+
+def make_value_parser() -> Parser:
+    value_parser = Parser(lambda: alt(
+        "INT",
+        seq("Expr", "(", [many("Items", value_parser)], ")"),
+        seq("Tail", [many("Stars", token("*"))], "+"),
+    ))
+    return value_parser
+
+def test_first_sets():
+    plain = make_value_parser()
+    frozen = make_value_parser().freeze()
+    assert frozen.first == {"INT", "(", "*", "+"}
+    assert not frozen.nullable
+    texts = ["(1 (2) * * +", "(1 ) )", ")", "(1 (+ 2", "* * 3", "(((", ""]
+    for text in texts:
+        tokens = lexer.lex("<test>", text)
+        assert frozen.parse_error(tokens) == plain.parse_error(tokens)
+    tokens = lexer.lex("<test>", ")")
+    assert frozen.parse_error(tokens) == "<test>:1:1: SYNTAX ERROR: Expected 'INT', '(' or '+', but got ')' instead"
+
+def test_compact_trees():
+    tokens = lexer.lex("<test>", "(1 + 2) * 3")
+    tree = expr_parser.parse(tokens)
+    assert not hasattr(tree, "__dict__")
+    assert tree.type == "Term" and TYPES[tree.kind] == "Term"
+    empty = many("Items", token("INT")).parse(lexer.lex("<test>", ""))
+    assert empty.location is NO_LOCATION
+    arena = Arena()
+    row = arena.add(tree)
+    assert len(arena) == 6
+    assert arena.type(row) == "Term"
+    assert repr(arena.location(row)) == "<test>:1:1:"
+    copy = arena.tree(row)
+    assert repr(copy) == repr(tree)
+    assert copy.nodes[1].rest == tree.nodes[1].rest == 7
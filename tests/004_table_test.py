@@ -0,0 +1,53 @@
+from src.parse import Parser, seq, alt, many, operators
+from src.table import build_table, LLParser, LALRParser, ConflictReport
+from src.lex import Lexer
+
+lexer = Lexer()
+lexer.add_token("INT", r"\d+")
+lexer.add_token("+")
+lexer.add_token("*")
+lexer.add_token("^")
+lexer.add_token("(")
+lexer.add_token(")")
+lexer.skip(r"\s+")
+
+def test_ll():
+    list_parser = Parser(lambda: seq("List", "(", [many("Items", item_parser)], ")"))
+    item_parser = Parser(lambda: alt("INT", list_parser))
+    table = build_table(list_parser)
+    assert isinstance(table, LLParser)
+    tokens = lexer.lex("<test>", "(1 (2 3) () 4)")
+    assert repr(table.parse(tokens)) == repr(list_parser.parse(tokens))
+    tokens = lexer.lex("<test>", "(1 (2 3) 4")
+    assert table.parse_error(tokens) == "<test>:1:10: SYNTAX ERROR: Expected '(', 'INT' or ')', but got 'EOF' instead"
+
+def test_lalr():
+    atom_parser = Parser(lambda: alt("INT", seq("Expr", "(", [expr_parser], ")")))
+    term_parser = Parser(lambda: alt(seq("Term", [atom_parser], "*", [atom_parser]), atom_parser))
+    expr_parser = Parser(lambda: alt(seq("Expr", [term_parser], "+", [term_parser]), term_parser))
+    table = build_table(expr_parser)
+    assert isinstance(table, LALRParser)
+    tokens = lexer.lex("<test>", "(1 + 2) * 3")
+    tree = table.parse(tokens)
+    assert repr(tree) == "Term(Expr(Expr(INT(1), INT(2))), INT(3))"
+    assert repr(tree.nodes[1].location) == "<test>:1:11:"
+    assert table.parse_error(lexer.lex("<test>", "(10 *)")) == "<test>:1:6: SYNTAX ERROR: Expected 'INT' or '(', but got ')' instead"
+
+def test_operators():
+    atom_parser = Parser(lambda: alt("INT", seq("Paren", "(", [expr_parser], ")")))
+    expr_parser = operators(atom_parser,
+        ("left", {"+": "Plus"}),
+        ("left", {"*": "Mult"}),
+        ("right", {"^": "Pow"}),
+    )
+    table = build_table(expr_parser)
+    assert isinstance(table, LLParser)
+    tokens = lexer.lex("<test>", "1 + 2 * 3 * 4 ^ 5 ^ (6 + 7) + 8")
+    assert repr(table.parse(tokens)) == repr(expr_parser.parse(tokens))
+
+def test_conflicts():
+    ambiguous = Parser(lambda: alt(seq("One", "INT"), seq("Other", "INT")))
+    report = build_table(ambiguous)
+    assert isinstance(report, ConflictReport)
+    assert report.format().splitlines()[0] == "LL(1) conflicts:"
+    assert "reduce/reduce" in report.format()
@@ -0,0 +1,79 @@
+import os
+import sys
+from src.parse import Parser, seq, alt, many, token, operators
+from src.lex import Lexer
+from src import generator
+from src.generator import generate, load
+
+lexer = Lexer()
+lexer.add_token("INT", r"\d+")
+lexer.add_token("let")
+lexer.add_token("IDENTIFIER", r"[a-z]+")
+for op in "+-*^()":
+    lexer.add_token(op)
+lexer.skip(r"\s+")
+
+atom_parser = Parser(lambda: alt(
+    "INT",
+    "IDENTIFIER",
+    seq("Paren", "(", [expr_parser], ")"),
+    seq("Tail", [many("Stars", token("*"))], "+"),
+))
+expr_parser = Parser(lambda: operators(atom_parser,
+    ("left", {"+": "Plus", "-": "Minus"}),
+    ("left", {"*": "Mult"}),
+    ("right", {"^": "Pow"}),
+))
+start_parser = Parser(lambda: many("Start", seq("Let", "let", [token("IDENTIFIER")], [expr_parser])))
+
+texts = [
+    "let x 1 - 2 + 3 * 4 ^ 5 ^ (6 - y)",
+    "let x (1 + 2) let yz * * + ^ 3",
+    "let letter + 1",
+    "let x (1 +",
+    "let x (1 2)",
+    "let 1",
+    "let x + ",
+]
+
+def test_generated_parser(tmp_path):
+    module = load(lexer, start_parser, str(tmp_path))
+    for text in texts:
+        assert module.lex_error("<test>", text) == lexer.lex_error("<test>", text)
+        tokens = module.lex("<test>", text)
+        assert repr(tokens) == repr(lexer.lex("<test>", text))
+        assert module.parse_error(tokens) == start_parser.parse_error(tokens)
+        assert repr(module.raw_parse(tokens)) == repr(start_parser.raw_parse(tokens))
+        assert module.parse_error(list(tokens)) == start_parser.parse_error(tokens)
+    assert module.lex_error("<test>", "let x = 1") == "<test>:1:7: SYNTAX ERROR: Unknown character: '='"
+
+def test_cache(tmp_path, monkeypatch):
+    module = load(lexer, start_parser, str(tmp_path))
+    assert load(lexer, start_parser, str(tmp_path)) is module
+    files = os.listdir(tmp_path)
+    assert len(files) == 1
+    with open(tmp_path / files[0]) as f:
+        assert f.read() == generate(lexer, start_parser)
+    other = Parser(lambda: seq("Let", "let", [token("IDENTIFIER")]))
+    load(lexer, other, str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 2
+    # a cached grammar is imported without generating it again
+    del sys.modules[module.__name__]
+    def fail(*_):
+        assert False, "generated a cached grammar"
+    monkeypatch.setattr(generator, "generate", fail)
+    again = load(lexer, start_parser, str(tmp_path))
+    assert again is not module and again.__file__ == module.__file__
+
+held_parser = Parser(lambda: alt("INT"))
+def hold_rule():
+    return seq("Hold", "let", [held_parser])
+
+def test_cache_sub_rules(tmp_path, monkeypatch):
+    # a rule changed elsewhere changes the key, not only the root's source
+    first = load(lexer, Parser(hold_rule), str(tmp_path))
+    assert first.parse_error(lexer.lex("<test>", "let x")) == "<test>:1:5: SYNTAX ERROR: Expected 'INT', but got 'IDENTIFIER' instead"
+    monkeypatch.setitem(globals(), "held_parser", Parser(lambda: alt("INT", "IDENTIFIER")))
+    second = load(lexer, Parser(hold_rule), str(tmp_path))
+    assert second is not first
+    assert second.parse_error(lexer.lex("<test>", "let x")) == "No Errors Found (parse.py)"
@@ -0,0 +1,121 @@
+from src.parse import Tree, Parser, seq, alt, many, token
+from src.lex import Lexer, LexError
+import pytest
+from array import array
+from src.incremental import Document, MovedTree, Positions, relex
+
+lexer = Lexer()
+lexer.add_token("INT", r"\d+")
+lexer.add_token("let")
+lexer.add_token("IDENTIFIER", r"[a-z]+")
+lexer.add_token("=")
+lexer.add_token("+")
+lexer.add_token(";")
+lexer.skip(r"\s+")
+
+expr_parser = Parser(lambda: alt(
+    seq("Plus", [atom_parser], "+", [expr_parser]),
+    atom_parser,
+))
+atom_parser = Parser(lambda: alt("INT", "IDENTIFIER"))
+start_parser = Parser(lambda: many("Start",
+    seq("Let", "let", [token("IDENTIFIER")], "=", [expr_parser], ";"),
+))
+
+code = "".join(f"let v{'abcdefghij'[i % 10]} = {i} + y;\n" for i in range(50))
+
+def dump(tree) -> str:
+    if isinstance(tree, str):
+        return tree
+    return f"{tree.type}@{tree.location}:{tree.rest}[{', '.join(dump(n) for n in tree.nodes)}]"
+
+def check(doc: Document) -> None:
+    tokens = lexer.lex("<test>", doc.code)
+    assert repr(doc.tokens) == repr(tokens)
+    assert [repr(t.location) for t in doc.tokens] == [repr(t.location) for t in tokens]
+    assert doc.error() == start_parser.parse_error(tokens, packrat=True).replace("parse.py", "incremental.py")
+    if doc.error().startswith("No Errors Found"):
+        assert dump(doc.result) == dump(start_parser.raw_parse(tokens, packrat=True))
+
+def test_relex():
+    tokens = lexer.lex("<test>", "let a = 12;\nlet b = a;")
+    result = relex(lexer, tokens, 9, 1, "34 + c")
+    assert not isinstance(result, LexError)
+    new, damage = result
+    assert repr(new) == "[[let], [IDENTIFIER:a], [=], [INT:134], [+], [IDENTIFIER:c], [;], [let], [IDENTIFIER:b], [=], [IDENTIFIER:a], [;]]"
+    assert (damage.first, damage.resync, damage.shift) == (2, 4, 2)
+    assert repr(new[-1].location) == "<test>:2:10:"
+    error = relex(lexer, tokens, 0, 0, "?")
+    assert isinstance(error, LexError)
+    assert error.format() == "<test>:1:1: SYNTAX ERROR: Unknown character: '?'"
+
+def test_edits():
+    doc = Document(lexer, start_parser, "<test>", code)
+    check(doc)
+    edits = [
+        (code.index("let vf ") + 4, 2, "w"),
+        (0, 0, "let a = b;"),
+        (len(code) // 2, 0, "\n\n"),
+        (len(code) // 2, 3, ""),
+        (10, 0, "= ="),
+        (10, 3, ""),
+        (5, 0, "?"),
+        (5, 1, ""),
+        (len(code) - 3, 3, " + z;\nlet q = 1;"),
+    ]
+    for edit in edits:
+        doc.raw_edit(*edit)
+        if doc.tokens is None:
+            assert doc.error() == "<test>:1:6: SYNTAX ERROR: Unknown character: '?'"
+        else:
+            check(doc)
+
+def test_reuse():
+    doc = Document(lexer, start_parser, "<test>", code)
+    assert isinstance(doc.result, Tree) and doc.result.type == "Start"
+    before = doc.result.nodes
+    doc.edit(code.index("let ve"), 0, "let a = 1;\n\n")
+    after = doc.result.nodes
+    assert len(after) == len(before) + 1
+    # declarations before the edit are the same objects, the ones after it
+    # are moved, also when the edit adds lines, and their children are
+    # only moved when read
+    assert after[0] is before[0]
+    assert isinstance(after[-1], MovedTree) and after[-1].moved is before[-1]
+    assert after[-1].rest == before[-1].rest + 5
+    assert repr(after[-1].location) == "<test>:52:1:"
+    check(doc)
+    assert after[-1].moved is None and after[-1].nodes[1].rest == before[-1].nodes[1].rest + 5
+    doc.edit(0, 0, "let b = 2;")
+    assert doc.result.nodes[-1].moved is after[-1]
+    check(doc)
+
+def test_positions():
+    # against a plain list that is rewritten on every splice
+    expected = list(range(0, 1000, 10))
+    offsets = Positions(array("q", expected))
+    for i in range(100):
+        first = (i * 37) % len(expected)
+        resync = min(first + i % 3, len(expected))
+        inserted = [expected[first] + j for j in range(i % 4)]
+        delta = i % 5 - 2
+        expected = expected[:first] + inserted + [v + delta for v in expected[resync:]]
+        offsets = offsets.splice(first, resync, array("q", inserted), delta)
+        assert len(offsets.firsts) <= 32
+    assert list(offsets) == expected
+    assert offsets[-1] == expected[-1] and offsets[3:6] == expected[3:6]
+
+def test_interrupted():
+    doc = Document(lexer, start_parser, "<test>", code)
+    calls = 0
+    def fail(tokens, pos, memo):
+        nonlocal calls
+        calls += 1
+        raise KeyboardInterrupt
+    parser = doc.parser
+    doc.parser = Parser(lambda: seq("Start", [Parser(lambda: fail)]))
+    with pytest.raises(KeyboardInterrupt):
+        doc.raw_edit(0, 0, " ")
+    doc.parser = parser
+    doc.raw_edit(0, 1, "")
+    check(doc)
@@ -0,0 +1,40 @@
+import pytest
+from src.parse import Tree
+from src.transform import Transformer
+
+def make_transformer(bottom_up: bool) -> Transformer:
+    transformer = Transformer(bottom_up)
+    @transformer.new_rule("INT")
+    def transform_int(n: str):
+        return int(n)
+    @transformer.new_rule("Neg")
+    def transform_neg(x):
+        return -(x if bottom_up else transformer.transform(x))
+    @transformer.new_rule("Plus")
+    def transform_plus(*xs):
+        return sum(xs if bottom_up else [transformer.transform(x) for x in xs])
+    @transformer.new_rule("#Start")
+    def transform_start(x):
+        return ("result", x if bottom_up else transformer.transform(x))
+    return transformer
+
+def test_bottom_up():
+    tree = Tree("Plus", [Tree("INT", ["1"]), Tree("Neg", [Tree("INT", ["2"])]), Tree("Plus", [])])
+    top_down = make_transformer(False)
+    bottom_up = make_transformer(True)
+    assert top_down.start(tree) == bottom_up.start(tree) == ("result", -1)
+    assert bottom_up.transform("leaf") == "leaf"
+    with pytest.raises(AssertionError, match="Not implemented: 'Mult'"):
+        bottom_up.transform(Tree("Plus", [Tree("Mult", [])]))
+
+def test_deep_tree():
+    tree = Tree("INT", ["7"])
+    for _ in range(100000):
+        tree = Tree("Neg", [tree])
+    assert make_transformer(True).transform(tree) == 7
+
+def test_new_rule_returns_function():
+    transformer = Transformer()
+    def rule(n: str):
+        return n
+    assert transformer.new_rule("INT")(rule) is rule
@@ -0,0 +1,58 @@
+from src.parse import Tree, C
+from src.cache import LRU, HashCons, MISSING
+from src.transform import Transformer
+from src import codegen
+
+def make_tree() -> Tree:
+    def square(n: str) -> Tree:
+        return Tree("Mult", [Tree("INT", [n]), Tree("INT", [n])])
+    return Tree("Plus", [square("2"), Tree("Plus", [square("2"), square("3")])])
+
+def test_lru():
+    lru = LRU(2)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    assert lru.get("a") == 1
+    lru.put("c", 3)
+    assert len(lru) == 2
+    assert lru.get("b") is MISSING
+    assert lru.get("a") == 1 and lru.get("c") == 3
+
+def test_hash_cons():
+    tree = HashCons().cons(make_tree())
+    first, rest = tree.nodes
+    assert first is rest.nodes[0]
+    assert first.nodes[0] is first.nodes[1]
+    assert first is not rest.nodes[1]
+    assert repr(tree) == repr(make_tree())
+    tiny = HashCons(1).cons(make_tree())
+    assert repr(tiny) == repr(make_tree())
+
+def test_cached_transform():
+    for bottom_up in (False, True):
+        calls: list[str] = []
+        transformer = Transformer(bottom_up, cache_size=64)
+        @transformer.new_rule("INT")
+        def transform_int(n: str):
+            calls.append(n)
+            return C.IntLiteral(n)
+        @transformer.new_rule("Mult")
+        def transform_mult(l, r):
+            calls.append("*")
+            if not bottom_up:
+                l, r = transformer.transform(l), transformer.transform(r)
+            return C.BinaryOperator(l, "*", r)
+        @transformer.new_rule("Plus")
+        def transform_plus(l, r):
+            if not bottom_up:
+                l, r = transformer.transform(l), transformer.transform(r)
+            return C.BinaryOperator(l, "+", r)
+        c_tree = transformer.transform(HashCons().cons(make_tree()))
+        assert sorted(calls) == ["*", "*", "2", "3"]
+        codegen.set_cache(16)
+        try:
+            code = codegen.generate_c(c_tree)
+            assert codegen.memo is not None and codegen.memo.hits == 2 and len(codegen.memo) == 3
+        finally:
+            codegen.set_cache(0)
+        assert code == codegen.generate_c(c_tree) == "((2 * 2) + ((2 * 2) + (3 * 3)))"
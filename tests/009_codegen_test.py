@@ -0,0 +1,117 @@
+import io
+from src.parse import Tree, C
+from src.codegen import generate_c, generate_c_parallel, write_c
+
+def test_program():
+    x = C.Identifier("x")
+    program = C.Program(
+        C.Include("stdio.h"),
+        C.FunctionDeclaration(C.IntType(), C.Identifier("main"), C.ParameterList(), C.Block(
+            C.VariableDeclaration(C.IntType(), x, C.IntLiteral("3")),
+            C.While(x, C.Block(
+                C.Assignment(x, C.BinaryOperator(x, "-", C.IntLiteral("1"))),
+                C.IfElse(C.BinaryOperator(x, "==", C.IntLiteral("1")), C.Block(
+                    C.Statement(C.Call(C.Identifier("printf"), C.StringLiteral(r"%d\n"), x)),
+                ), C.Block()),
+            )),
+            C.Return(C.IntLiteral("0")),
+        )),
+    )
+    expected = "\n".join([
+        "#include <stdio.h>",
+        "",
+        "int main() {",
+        "    int x = 3;",
+        "    while (x) {",
+        "        x = (x - 1);",
+        "        if ((x == 1)) {",
+        "            printf(\"%d\\n\", x);",
+        "        }",
+        "        else {",
+        "        }",
+        "    }",
+        "    return 0;",
+        "}",
+        "",
+    ])
+    assert generate_c(program) == expected
+    out = io.StringIO()
+    write_c(program, out)
+    assert out.getvalue() == expected
+
+def test_fragments():
+    param = C.Parameter(C.IntType(), C.Identifier("n"))
+    assert generate_c(param) == "int n"
+    assert generate_c(C.If(C.Identifier("n"), C.Block())) == "if (n) {\n}\n"
+    assert generate_c(C.UnaryOperator("-", C.IntLiteral("1"))) == "(-1)"
+
+def test_parallel():
+    def function(name: str, *body: Tree) -> Tree:
+        return C.FunctionDeclaration(C.IntType(), C.Variable(name), C.ParameterList(
+            C.Parameter(C.IntType(), C.Variable("x")),
+        ), C.Block(*body, C.Return(C.Variable("x"))))
+    program = C.Program(
+        C.Include("stdio.h"),
+        C.DeclarationList(
+            C.DeclarationList(*[
+                function(f"f{i}", C.Statement(C.Call(C.Variable(f"f{i + 1}"), C.Variable("y"))))
+                for i in range(12)
+            ]),
+            function("open", C.Statement(C.Identifier("{"))),
+            function("close", C.Statement(C.Identifier("}"))),
+            C.DeclarationList(),
+        ),
+    )
+    outputs = [generate_c_parallel(program, workers) for workers in (1, 2, 3)]
+    assert outputs[0] == outputs[1] == outputs[2]
+    assert outputs[0].startswith("\n".join([
+        "#include <stdio.h>",
+        "",
+        "int v0(int v14) {",
+        "    v1(v15);",
+        "    return v14;",
+        "}",
+        "",
+        "int v1(int v14) {",
+    ]))
+    # braces inside names don't change the indentation
+    assert outputs[0].endswith("\n".join([
+        "int v12(int v14) {",
+        "    {;",
+        "    return v14;",
+        "}",
+        "",
+        "int v13(int v14) {",
+        "    };",
+        "    return v14;",
+        "}",
+        "",
+        "",
+    ]))
+
+def test_parallel_globals():
+    def function(name: str) -> Tree:
+        return C.FunctionDeclaration(C.IntType(), C.Variable(name), C.ParameterList(), C.Block(
+            C.Assignment(C.Variable("count"), C.BinaryOperator(C.Variable("count"), "+", C.IntLiteral("1"))),
+            C.Return(C.Variable("count")),
+        ))
+    program = C.Program(
+        C.VariableDeclaration(C.IntType(), C.Variable("count"), C.IntLiteral("0")),
+        function("first"),
+        function("second"),
+    )
+    for workers in (0, 1, 2):
+        assert generate_c_parallel(program, workers) == "\n".join([
+            "int v0 = 0;",
+            "",
+            "int v1() {",
+            "    v0 = (v0 + 1);",
+            "    return v0;",
+            "}",
+            "",
+            "int v2() {",
+            "    v0 = (v0 + 1);",
+            "    return v0;",
+            "}",
+            "",
+        ])
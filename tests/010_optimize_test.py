@@ -0,0 +1,130 @@
+import pytest
+from src.parse import Tree, C
+from src.codegen import generate_c
+from src.optimize import optimize, fold, simplify, copyprop, dse, cse
+from example.stack_based import compile
+from tests.util import run_test
+
+def binary(left: Tree, op: str, right: Tree) -> Tree:
+    return C.BinaryOperator(left, op, right)
+
+def int_(n: int) -> Tree:
+    return C.IntLiteral(str(n))
+
+def call(*args: Tree) -> Tree:
+    return C.Call(C.Identifier("f"), *args)
+
+def body(*statements: Tree, params: tuple[Tree, ...] = ()) -> Tree:
+    return C.FunctionDeclaration(C.IntType(), C.Identifier("main"), C.ParameterList(*params), C.Block(*statements))
+
+def test_fold():
+    assert generate_c(fold(binary(int_(500), "+", C.UnaryOperator("-", int_(80))))) == "420"
+    assert generate_c(fold(binary(C.UnaryOperator("-", int_(7)), "/", int_(2)))) == "(-3)"
+    assert generate_c(fold(binary(C.UnaryOperator("-", int_(7)), "%", int_(2)))) == "(-1)"
+    assert generate_c(fold(C.UnaryOperator("-", binary(int_(1), "-", int_(4))))) == "3"
+    assert generate_c(fold(binary(int_(1), "/", int_(0)))) == "(1 / 0)"
+    assert generate_c(fold(binary(int_(2147483647), "+", int_(1)))) == "(2147483647 + 1)"
+    assert generate_c(fold(binary(C.IntLiteral("010"), "+", int_(1)))) == "(010 + 1)"
+
+def test_simplify():
+    x = C.Identifier("x")
+    assert generate_c(simplify(binary(binary(x, "*", int_(1)), "+", int_(0)))) == "x"
+    assert generate_c(simplify(binary(x, "*", int_(0)))) == "0"
+    assert generate_c(simplify(binary(call(x), "*", int_(0)))) == "(f(x) * 0)"
+    assert generate_c(simplify(binary(x, "-", x))) == "0"
+    assert generate_c(simplify(C.UnaryOperator("-", C.UnaryOperator("-", x)))) == "x"
+
+def test_copyprop_dse():
+    a, b = C.Identifier("a"), C.Identifier("b")
+    tree = body(
+        C.VariableDeclaration(C.IntType(), a, int_(1)),
+        C.VariableDeclaration(C.IntType(), b, a),
+        C.While(binary(a, "<", b), C.Block(C.Assignment(a, binary(a, "+", b)))),
+        C.Assignment(b, call(a)),
+        C.Assignment(b, int_(2)),
+        C.Return(b),
+    )
+    tree = dse(copyprop(tree))
+    assert generate_c(tree.nodes[3]) == "\n".join([
+        "{",
+        "int a = 1;",
+        "while ((a < 1)) {",
+        "a = (a + 1);",
+        "}",
+        "f(a);",
+        "return 2;",
+        "}\n",
+    ])
+
+def test_cse():
+    x, y = C.Identifier("x"), C.Identifier("y")
+    tree = body(
+        C.VariableDeclaration(C.IntType(), y, binary(x, "*", x)),
+        C.Statement(call(binary(x, "*", x), binary(binary(x, "*", x), "/", int_(2)))),
+        C.Assignment(x, binary(binary(x, "*", x), "+", int_(1))),
+        C.Return(binary(binary(x, "*", x), "||", binary(x, "*", x))),
+        params=(C.Parameter(C.IntType(), x),),
+    )
+    assert generate_c(cse(tree).nodes[3]) == "\n".join([
+        "{",
+        "int y = (x * x);",
+        "f(y, (y / 2));",
+        "x = (y + 1);",
+        "return ((x * x) || (x * x));",
+        "}\n",
+    ])
+
+def test_pointer_operands():
+    s, n = C.Identifier("s"), C.Identifier("n")
+    char = C.UnaryOperator("*", binary(s, "+", int_(1)))
+    tree = body(
+        C.Statement(call(char, binary(n, "*", n))),
+        C.Statement(call(char, binary(n, "*", n))),
+        params=(C.Parameter(C.Type("char*"), s), C.Parameter(C.IntType(), n)),
+    )
+    assert generate_c(cse(tree).nodes[3]) == "\n".join([
+        "{",
+        "int _cse0 = (n * n);",
+        "f((*(s + 1)), _cse0);",
+        "f((*(s + 1)), _cse0);",
+        "}\n",
+    ])
+    tree = body(C.Statement(call(binary(n, "*", n))), C.Statement(call(binary(n, "*", n))))
+    assert "_cse" not in generate_c(cse(tree))
+
+def test_side_effects():
+    x, y = C.Identifier("x"), C.Identifier("y")
+    declare = C.VariableDeclaration(C.IntType(), x, int_(1))
+    tree = body(declare, C.Statement(C.UnaryOperator("++", x)), C.Return(x))
+    assert generate_c(optimize(tree).nodes[3]) == "{\nint x = 1;\n(++x);\nreturn x;\n}\n"
+    tree = body(declare, C.VariableDeclaration(C.IntType(), y, C.UnaryOperator("--", x)), C.Return(x))
+    assert generate_c(optimize(tree).nodes[3]) == "{\nint x = 1;\n(--x);\nreturn x;\n}\n"
+    tree = body(declare, C.Statement(call(C.UnaryOperator("&", x))), C.Return(x))
+    assert generate_c(optimize(tree).nodes[3]) == "{\nint x = 1;\nf((&x));\nreturn x;\n}\n"
+
+def test_globals():
+    g, y = C.Identifier("g"), C.Identifier("y")
+    def program(*statements: Tree) -> Tree:
+        return C.Program(C.VariableDeclaration(C.IntType(), g, int_(0)), body(*statements))
+    tree = program(C.Assignment(g, int_(1)), C.VariableDeclaration(C.IntType(), y, call()), C.Assignment(g, int_(2)), C.Return(y))
+    assert generate_c(optimize(tree).nodes[1].nodes[3]) == "{\ng = 1;\nint y = f();\ng = 2;\nreturn y;\n}\n"
+    tree = program(C.Assignment(g, int_(1)), C.Statement(call()), C.Return(g))
+    assert generate_c(optimize(tree).nodes[1].nodes[3]) == "{\ng = 1;\nf();\nreturn g;\n}\n"
+    square = binary(g, "*", g)
+    tree = program(C.VariableDeclaration(C.IntType(), y, square), C.Statement(call()), C.Return(binary(y, "+", square)))
+    assert generate_c(cse(tree).nodes[1].nodes[3]) == "{\nint y = (g * g);\nf();\nreturn (y + (g * g));\n}\n"
+
+def test_passes():
+    tree = body(C.Statement(call(binary(int_(2), "*", int_(3)))))
+    assert generate_c(optimize(tree, ()).nodes[3]) == "{\nf((2 * 3));\n}\n"
+    assert generate_c(optimize(tree, ("fold",)).nodes[3]) == "{\nf(6);\n}\n"
+    with pytest.raises(AssertionError, match="Not implemented: optimization pass 'inline'"):
+        optimize(tree, ("fold", "inline"))
+
+def test_stack_program():
+    text = "1 2 + print 400 200 * 3 * . + print 500 20 / 7 % print"
+    plain, out = run_test(text, compile)
+    code, optimized = run_test(text, lambda file, text: compile(file, text, passes=("fold", "simplify", "copyprop", "dse", "cse")))
+    assert optimized.split() == out.split() == ["3", "480000", "4"]
+    assert len(code) < len(plain)
+    assert "s0" not in code and "printf(\"%d\\n\", 480000);" in code
@@ -0,0 +1,61 @@
+import pytest
+from src.parse import Tree, C
+from src.codegen import generate_c
+from src import stack
+from example.stack_based import compile
+from tests.util import run_test
+
+def read() -> stack.Op:
+    return stack.apply("read", lambda: C.Call(C.Identifier("getchar")), 0, effect=True)
+
+def show() -> stack.Op:
+    return stack.apply("show", lambda value: C.Call(C.Identifier("putchar"), value), 1, pushes=0, effect=True)
+
+def code(statements: list[Tree]) -> list[str]:
+    return [generate_c(statement).strip() for statement in statements]
+
+def test_forwarding():
+    x, y = C.Identifier("x"), C.Identifier("y")
+    ops = [stack.push(x), stack.push(y), stack.binary("+"), stack.dup(), stack.binary("*"), show()]
+    assert code(stack.lower(ops)) == ["int s0 = (x + y);", "putchar((s0 * s0));"]
+    ops = [stack.push(2), stack.push(3), stack.binary("*"), stack.unary("-"), stack.dup(), stack.swap(), stack.drop(), show()]
+    assert code(stack.lower(ops)) == ["putchar((-6));"]
+
+def test_slot_reuse():
+    ops = [read(), read(), stack.binary("-"), stack.dup(), stack.binary("*"), read(), stack.over(), stack.binary("+"), show(), show()]
+    assert code(stack.lower(ops)) == [
+        "int s0 = getchar();",
+        "int s1 = getchar();",
+        "s0 = (s0 - s1);",
+        "s1 = getchar();",
+        "s0 = (s0 * s0);",
+        "putchar((s1 + s0));",
+        "putchar(s0);",
+    ]
+
+def test_max_size():
+    ops = [read(), *[op for n in range(5) for op in (stack.push(n + 1), stack.binary("+"))], show()]
+    assert code(stack.lower(ops, "t", max_size=5)) == [
+        "int t0 = getchar();",
+        "t0 = (((t0 + 1) + 2) + 3);",
+        "putchar(((t0 + 4) + 5));",
+    ]
+
+def test_effect_order():
+    g = C.Identifier("g")
+    increment = stack.apply("++", lambda value: C.UnaryOperator("++", value), 1, pushes=0, effect=True)
+    ops = [stack.push(g), stack.push(g), increment, show()]
+    assert code(stack.lower(ops)) == ["int s0 = g;", "(++g);", "putchar(s0);"]
+    ops = [read(), stack.push(g), stack.binary("+"), stack.push(2), stack.push(g), increment, stack.binary("*"), show()]
+    assert code(stack.lower(ops)) == ["int s0 = getchar();", "s0 = (s0 + g);", "(++g);", "putchar((s0 * 2));"]
+
+def test_underflow():
+    with pytest.raises(AssertionError, match="Stack underflow: '\\+' needs 2 values, found 1"):
+        stack.lower([stack.push(1), stack.binary("+")])
+
+def test_stack_program():
+    text = "1 2 + print 400 200 * 3 * . + print 500 20 / 7 % print"
+    plain, out = run_test(text, compile)
+    code, lowered = run_test(text, lambda file, text: compile(file, text, lowered=True))
+    assert lowered.split() == out.split() == ["3", "480000", "4"]
+    assert "s0" not in code and "printf(\"%d\\n\", 480000);" in code
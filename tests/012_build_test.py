@@ -0,0 +1,51 @@
+import os
+import subprocess
+from pathlib import Path
+from src.build import BuildCache, BuildError
+
+def program(n: int) -> str:
+    return f'#include <stdio.h>\nint main() {{ printf("%d\\n", {n}); }}\n'
+
+def run(path: str) -> str:
+    return subprocess.run([path], capture_output=True, text=True).stdout
+
+def test_build_cache(tmp_path: Path):
+    cache = BuildCache(str(tmp_path / "cache"))
+    out = str(tmp_path / "out" / "a.exe")
+    assert cache.raw_build(program(1), out) == out and run(out) == "1\n"
+    assert cache.raw_build(program(1), out) == out and run(out) == "1\n"
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.raw_build(program(1), out, ["-O2"])
+    cache.raw_build(program(2), out)
+    assert (cache.hits, cache.misses) == (1, 3) and run(out) == "2\n"
+    assert len(os.listdir(tmp_path / "cache")) == 3
+
+def test_eviction(tmp_path: Path):
+    cache = BuildCache(str(tmp_path / "cache"))
+    out = str(tmp_path / "a.exe")
+    clock = iter(range(1_000_000, 2_000_000, 10))
+    def build(n: int) -> None:
+        # recency comes from explicit times, not from how fast gcc runs
+        cache.raw_build(program(n), out)
+        now = next(clock)
+        os.utime(os.path.join(cache.cache_dir, cache.key(program(n), ())), (now, now))
+    for n in range(3):
+        build(n)
+    build(0)
+    cache.max_bytes = 2 * os.path.getsize(out)
+    cache.evict()
+    build(2)
+    assert (cache.hits, cache.misses) == (2, 3)
+    build(0)
+    build(1)
+    assert (cache.hits, cache.misses) == (3, 4) and run(out) == "1\n"
+    build(2)
+    assert (cache.hits, cache.misses) == (3, 5)
+    assert sorted(os.listdir(tmp_path / "cache")) == sorted(cache.key(program(n), ()) for n in (1, 2))
+
+def test_build_error(tmp_path: Path):
+    cache = BuildCache(str(tmp_path / "cache"))
+    result = cache.raw_build("int main() { return x; }", str(tmp_path / "a.exe"))
+    assert isinstance(result, BuildError)
+    assert result.format().startswith("BUILD ERROR: gcc -o ") and "undeclared" in result.output
+    assert os.listdir(tmp_path / "cache") == []
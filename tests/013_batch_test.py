@@ -0,0 +1,57 @@
+from pathlib import Path
+from src.batch import main, expand
+
+def write(path: Path, text: str) -> str:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return str(path)
+
+def test_batch(tmp_path: Path, capsys):
+    write(tmp_path / "src" / "a.stk", "1 2 + print")
+    write(tmp_path / "src" / "sub" / "b.stk", "3 4 * print")
+    bad = write(tmp_path / "src" / "bad.stk", "1 x print")
+    out = tmp_path / "out"
+    for jobs in ("1", "2"):
+        assert main(["example.stack_based", str(tmp_path / "src" / "**" / "*.stk"), "-o", str(out), "-j", jobs]) == 1
+        assert capsys.readouterr().out == "\n".join([
+            f"FAILED {bad}:",
+            f"    {bad}:1:3: SYNTAX ERROR: Unknown character: 'x'",
+            "2 compiled, 1 failed",
+            "",
+        ])
+        assert "s0 = (s0 * s1);" in (out / "sub" / "b.stk.c").read_text()
+        assert not (out / "bad.stk.c").exists()
+
+def test_pipeline(tmp_path: Path, capsys):
+    file = write(tmp_path / "main.src", "fn negate(x) = -x;\nprint(500 + negate(80))\n")
+    assert main(["example.example", file, "-o", str(tmp_path / "out")]) == 0
+    assert capsys.readouterr().out == "1 compiled, 0 failed\n"
+    assert 'printf("%d\\n", (500 + v0(80)));' in (tmp_path / "out" / "main.src.c").read_text()
+
+def test_same_output(tmp_path: Path, capsys):
+    # every file compiles as if it was the only one, whatever ran before it
+    a = write(tmp_path / "a.src", "fn negate(x) = -x;\nprint(negate(8))\n")
+    b = write(tmp_path / "b.src", "fn twice(y) = y * 2;\nprint(twice(8))\n")
+    c = write(tmp_path / "b.stk", "1 2 + print")
+    assert main(["example.example", a, b, "-o", str(tmp_path / "all"), "-j", "1"]) == 0
+    for file in (a, b):
+        assert main(["example.example", file, "-o", str(tmp_path / "one")]) == 0
+        name = Path(file).name + ".c"
+        assert (tmp_path / "all" / name).read_text() == (tmp_path / "one" / name).read_text()
+    assert "v0(8)" in (tmp_path / "all" / "b.src.c").read_text()
+    assert main(["example.stack_based", c, "-o", str(tmp_path / "all")]) == 0
+    assert (tmp_path / "all" / "b.src.c").exists() and (tmp_path / "all" / "b.stk.c").exists()
+    capsys.readouterr()
+
+def test_bad_grammar(tmp_path: Path, capsys):
+    file = write(tmp_path / "a.stk", "1 2 + print")
+    other = write(tmp_path / "b.stk", "3 print")
+    assert main(["tests.missing_grammar", file, other, "-o", str(tmp_path / "out"), "-j", "2"]) == 1
+    assert capsys.readouterr().out == "Cannot load grammar 'tests.missing_grammar': ModuleNotFoundError: No module named 'tests.missing_grammar'\n"
+    assert main(["example.example", file, other, "-o", str(tmp_path / "out"), "-j", "2", "--parser", "missing"]) == 1
+    assert capsys.readouterr().out == "Cannot load grammar 'example.example': AttributeError: module 'example.example' has no attribute 'missing'\n"
+
+def test_expand(tmp_path: Path):
+    a = write(tmp_path / "a.stk", "")
+    b = write(tmp_path / "b.stk", "")
+    assert expand([b, str(tmp_path / "*.stk"), "missing.stk"]) == [b, a, "missing.stk"]
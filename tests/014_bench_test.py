@@ -0,0 +1,25 @@
+from bench.inputs import stack_source, example_source
+from bench.suite import run, compare, parse_size, format_size, PHASES
+
+def test_inputs():
+    for source in (stack_source, example_source):
+        assert 1000 <= len(source(1000)) < 1100
+        assert len(source(10000)) >= 10000
+
+def test_sizes():
+    assert parse_size("1K") == parse_size("1kb") == 1024
+    assert parse_size("100M") == 100 << 20 and parse_size("512") == 512
+    assert format_size(100 << 20) == "100M" and format_size(1500) == "1500"
+
+def test_run():
+    report = run(["stack", "example"], [512, 1024], repeat=1, rules=True)
+    results = report["results"]
+    assert [(r["grammar"], r["size"], r["phase"]) for r in results] == [
+        (grammar, size, phase) for grammar in ("stack", "example") for size in (512, 1024) for phase in PHASES
+    ]
+    assert all(r["seconds"] > 0 and r["items"] > 0 and r["peak_bytes"] > 0 for r in results)
+    assert [len(report["scaling"]["stack"][phase]) for phase in PHASES] == [1, 1, 1, 1]
+    assert set(report["rules"]["stack"]["transform"]) == {"INT", "+ or -", "* or /", ".", "print", "Expr"}
+    assert "C_Assignment" in report["rules"]["stack"]["generate_c"]
+    lines = compare(report, report)
+    assert len(lines) == len(results) and all("time x1.00 memory x1.00" in line for line in lines)
@@ -0,0 +1,64 @@
+from src.parse import Parser, Tree
+from src.transform import Transformer
+from src.profiler import Profiler
+from src import codegen
+from example import stack_based, example
+
+def test_profile_stack_program():
+    apply, transform, emit = Parser.apply, Transformer.transform, codegen.emit
+    with Profiler() as profiler:
+        stack_based.stack_top = 0
+        tree = stack_based.expr_parser.parse(stack_based.lexer.lex("<tests>", "1 2 + print"))
+        code = codegen.generate_c(stack_based.transformer.start(tree), {})
+    assert (Parser.apply, Transformer.transform, codegen.emit) == (apply, transform, emit)
+    assert "printf" in code
+    stats = profiler.stats
+    integer = stats["parse", "'INT'"]
+    assert (integer.calls, integer.successes, integer.failures, integer.tokens) == (5, 2, 3, 2)
+    assert stats["parse", "some Expr"].tokens == 4
+    assert stats["transform", "INT"].calls == 2 and stats["transform", "print"].calls == 1
+    assert stats["generate_c", "C_Identifier"].calls == 8
+    assert all(s.time >= s.self_time >= 0 for s in stats.values())
+    rows = profiler.report().splitlines()
+    assert rows[0].split() == ["phase", "calls", "ok", "failed", "tokens", "cumulative", "self", "name"]
+    assert len(rows) == len(stats) + 1
+
+def test_bottom_up_rules():
+    for cache_size in (0, 16):
+        transformer = Transformer(bottom_up=True, cache_size=cache_size)
+        transformer.new_rule("INT")(int)
+        transformer.new_rule("Plus")(lambda left, right: left + right)
+        table = transformer.table
+        three = Tree("INT", ["3"])
+        with Profiler() as profiler:
+            result = transformer.transform(Tree("Plus", [three, Tree("Plus", [three, Tree("INT", ["4"])])]))
+        assert result == 10 and transformer.table is table
+        plus, integer = profiler.stats["transform", "Plus"], profiler.stats["transform", "INT"]
+        assert plus.calls == 2 and integer.calls == (2 if cache_size else 3)
+        # children are reduced before their parent's rule runs, so rules
+        # never appear nested
+        assert {line.rsplit(" ", 1)[0] for line in profiler.folded().splitlines()} == {"transform Plus", "transform INT"}
+
+def test_rules_added_while_profiling():
+    transformer = Transformer(bottom_up=True)
+    transformer.new_rule("INT")(int)
+    table = transformer.table
+    with Profiler() as profiler:
+        assert transformer.transform(Tree("INT", ["3"])) == 3
+        transformer.new_rule("Neg")(lambda value: -value)
+        transformer.new_rule("INT")(lambda value: int(value) * 2)
+        assert transformer.transform(Tree("Neg", [Tree("INT", ["3"])])) == -6
+    assert transformer.table is table
+    assert transformer.transform(Tree("Neg", [Tree("INT", ["4"])])) == -8
+    assert profiler.stats["transform", "INT"].calls == 1
+
+def test_folded_stacks():
+    with Profiler() as profiler:
+        example.start_parser.parse(example.lexer.lex("<tests>", "print(1 + 2)"), packrat=True)
+    lines = profiler.folded().splitlines()
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    stacks = [line.rsplit(" ", 1)[0].split(";") for line in lines]
+    assert all(stack[0] == example.start_parser.label() for stack in stacks)
+    assert any("seq Plus;rule at example.py:54;alt;seq Minus" in line for line in lines)
+    assert profiler.stats["parse", "alt in rule at example.py:45"].calls == 2
+    assert profiler.stats["parse", "seq Plus"].successes == 1
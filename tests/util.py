@@ -1,13 +1,12 @@
 import subprocess
 from typing import Callable
+from src.build import build
 
 def run_test(text: str, compile: Callable[[str, str], None]):
     compile("<tests>", text)
     with open("build/out.c") as f:
         got = f.read()
-    subprocess.run([
-        "gcc", "-o", "build/out.exe", "build/out.c"
-    ])
+    build(got, "build/out.exe")
     result = subprocess.run([
         "./build/out.exe",
     ], capture_output=True)